@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+import hashlib
+import zlib
+from functools import lru_cache
+from pathlib import Path
+
+from autobook import locks
+
+from typing import Any
+
+
+def directory_for(db_file: str) -> str:
+    """Return the blob directory that goes with a database file.
+
+    Blobs of instance/db.json are kept in instance/db.blobs.
+    """
+    return str(Path(db_file).with_suffix(".blobs"))
+
+
+def blob_path(directory: str, key: str) -> Path:
+    """Return where a blob is stored, spread over subdirectories by its first characters"""
+    return Path(directory) / key[:2] / key[2:]
+
+
+def put(directory: str, text: str) -> str:
+    """Store compressed text under the hash of its content, returning the hash.
+
+    Identical text is only stored once.
+    """
+    data = text.encode("utf-8")
+    key = hashlib.sha256(data).hexdigest()
+    path = blob_path(directory, key)
+    if not path.exists():
+        locks.atomic_write(str(path), zlib.compress(data))
+    return key
+
+
+@lru_cache(maxsize=64)
+def get(directory: str, key: str) -> str:
+    """Return the text stored under a hash"""
+    with open(blob_path(directory, key), "rb") as file:
+        return zlib.decompress(file.read()).decode("utf-8")
+
+
+def remove(directory: str, key: str) -> None:
+    """Delete a blob, if it exists"""
+    blob_path(directory, key).unlink(missing_ok=True)
+
+
+def pack(directory: str, chapter: dict[str, Any]) -> dict[str, Any]:
+    """Return a chapter whose content is replaced by the hash of a stored blob.
+
+    Empty and partial content is kept inline, since it changes on every
+    streaming checkpoint.
+    """
+    if not chapter.get("content") or chapter.get("partial"):
+        return dict(chapter)
+    packed = {k: v for k, v in chapter.items() if k != "content"}
+    packed["blob"] = put(directory, chapter["content"])
+    return packed
+
+
+def unpack(directory: str, chapter: dict[str, Any]) -> dict[str, Any]:
+    """Return a chapter with the content of its blob, if it has one"""
+    if "blob" not in chapter:
+        return chapter
+    unpacked = {k: v for k, v in chapter.items() if k != "blob"}
+    unpacked["content"] = get(directory, chapter["blob"])
+    return unpacked
+
+
+def keys(chapters: list[dict[str, Any]] | None) -> set[str]:
+    """Return the hashes of the blobs a list of chapters refers to"""
+    return {chapter["blob"] for chapter in chapters or [] if "blob" in chapter}
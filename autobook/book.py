@@ -1,73 +1,288 @@
 #!/usr/bin/env python3
-import openai
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import contextvars
 import os
 import re
+import time
+from string import Formatter
 
+from autobook import cache, metrics, providers, scheduler, tracing
+from autobook.models import Chapter
 from autobook.prompts import prompts
+from autobook.providers import Usage
+from autobook.scheduler import quiet, report
 
-from typing import Any
+from typing import Any, Callable, Hashable, Iterator, TypeVar
 
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+K = TypeVar("K", bound=Hashable)
 
 
-def get_response(prompt, logit_bias={}, history=None):
-    """Send a prompt to the OpenAI chat-based API
-    and return the content of the response
+def get_response(
+    prompt,
+    logit_bias={},
+    history=None,
+    prompt_type=None,
+    book_id=None,
+    use_cache=True,
+):
+    """Send a prompt to the language model and return the content of the response
+
+    See providers.provider for which model that is.
+    Responses are cached on disk by model, messages and logit_bias,
+    so a repeated prompt is answered without spending any tokens.
+    With use_cache False, the cache is neither read nor written.
+    Token usage and latency are recorded under prompt_type and book_id.
     """
-    print(
+    report(
         f"Sending this prompt:\n--------------------\n{prompt}\n--------------------\n"
     )
-    print("Waiting for response...")
 
+    llm = providers.provider()
     messages = [{"role": "user", "content": prompt}]
     if history:
         messages = history + messages
-    while True:
-        try:
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo-16k", messages=messages, logit_bias=logit_bias, n=1
-            )
-            break
-        except openai.Timeout as e:
-            # Handle timeout error, e.g. retry or log
-            print(f"OpenAI API request timed out: {e}")
-            pass
-        except openai.APIError as e:
-            # Handle API error, e.g. retry or log
-            print(f"OpenAI API returned an API Error: {e}")
-            break
-        except openai.APIConnectionError as e:
-            # Handle connection error, e.g. check network or log
-            print(f"OpenAI API request failed to connect: {e}")
-            pass
-        except openai.InvalidRequestError as e:
-            # Handle invalid request error, e.g. validate parameters or log
-            print(f"OpenAI API request was invalid: {e}")
-            break
-        except openai.AuthenticationError as e:
-            # Handle authentication error, e.g. check credentials or log
-            print(f"OpenAI API request was not authorized: {e}")
-            break
-        except openai.PermissionError as e:
-            # Handle permission error, e.g. check scope or log
-            print(f"OpenAI API request was not permitted: {e}")
-            break
-        except openai.RateLimitError as e:
-            # Handle rate limit error, e.g. wait or log
-            print(f"OpenAI API request exceeded rate limit: {e}")
+    key = cache.make_key(llm.model, messages, logit_bias)
+    cached = cache.load("responses", key) if use_cache else None
+    if cached is not None:
+        report("Using cached response.")
+        metrics.record(llm.model, prompt_type, book_id, 0, 0, 0.0, cached=True)
+        return cached["content"], 0
+
+    report("Waiting for response...")
+    estimated_tokens = scheduler.estimate_tokens(messages)
+    start = time.monotonic()
+    with tracing.span("api.request", model=llm.model, prompt_type=prompt_type):
+        content, usage = scheduler.schedule(
+            lambda: llm.complete(messages, logit_bias),
+            llm.retryable_errors,
+            llm.fatal_errors,
+            estimated_tokens,
+            llm.name,
+        )
+    record_usage(llm, prompt_type, book_id, estimated_tokens, usage, start)
+    content = content.strip()
+    if use_cache:
+        cache.store("responses", key, {"content": content})
+    return content, usage.total_tokens
+
+
+def record_usage(
+    llm: providers.Provider,
+    prompt_type: str | None,
+    book_id: int | None,
+    estimated_tokens: int,
+    usage: Usage,
+    start: float,
+) -> None:
+    """Report the usage of a request to the scheduler and the metrics"""
+    scheduler.record_usage(estimated_tokens, usage.total_tokens)
+    report(f"Used {usage.prompt_tokens} prompt tokens (estimated {estimated_tokens}).")
+    metrics.record(
+        llm.model,
+        prompt_type,
+        book_id,
+        usage.prompt_tokens,
+        usage.completion_tokens,
+        time.monotonic() - start,
+        estimated_tokens=estimated_tokens,
+    )
+
+
+def stream_response(
+    prompt, logit_bias={}, history=None, prompt_type=None, book_id=None
+) -> Iterator[str]:
+    """Send a prompt to the language model
+    and yield the content of the response as it arrives
+    """
+    report(
+        f"Sending this prompt:\n--------------------\n{prompt}\n--------------------\n"
+    )
+
+    llm = providers.provider()
+    messages = [{"role": "user", "content": prompt}]
+    if history:
+        messages = history + messages
+    key = cache.make_key(llm.model, messages, logit_bias)
+    cached = cache.load("responses", key)
+    if cached is not None:
+        report("Using cached response.")
+        metrics.record(llm.model, prompt_type, book_id, 0, 0, 0.0, cached=True)
+        yield cached["content"]
+        return
+
+    estimated_tokens = scheduler.estimate_tokens(messages)
+    start = time.monotonic()
+    # the caller runs between pieces, so the span is recorded by hand
+    span_start, span_parent = time.perf_counter(), tracing.current()
+    stream = scheduler.schedule(
+        lambda: llm.stream(messages, logit_bias),
+        llm.retryable_errors,
+        llm.fatal_errors,
+        estimated_tokens,
+        llm.name,
+    )
+    content = ""
+    for piece in stream:
+        if isinstance(piece, Usage):
+            record_usage(llm, prompt_type, book_id, estimated_tokens, piece, start)
+            continue
+        content += piece
+        yield piece
+    tracing.record(
+        "api.stream",
+        span_start,
+        span_parent,
+        model=llm.model,
+        prompt_type=prompt_type,
+    )
+    cache.store("responses", key, {"content": content.strip()})
+
+
+def prompt_budget() -> int:
+    """Return the most tokens a prompt may take before its outline is condensed
+
+    Set AUTOBOOK_PROMPT_BUDGET in your environment to change it (default 8000).
+    """
+    return int(os.environ.get("AUTOBOOK_PROMPT_BUDGET", "8000"))
+
+
+def condense_outline(
+    chapters: list[Chapter],
+    target: int,
+    sections_within: int,
+    headers_within: int,
+) -> str:
+    """Return an outline that only has the details of chapters near the target
+
+    Chapters further than sections_within from the target lose their sections,
+    and runs of chapters further than headers_within are replaced by "...".
+    """
+    lines: list[str] = []
+    for index, chapter in enumerate(chapters):
+        distance = abs(index - target)
+        if distance > headers_within:
+            if lines[-1:] != ["..."]:
+                lines.append("...")
+            continue
+        lines.append(chapter.header)
+        if distance <= sections_within:
+            lines.extend(chapter.sections)
+    return "\n".join(lines) + "\n"
+
+
+@tracing.traced("prompt.format")
+def format_prompt(format_vars: dict, prompt_type: str) -> str:
+    """Fill in a prompt, condensing its outline if it doesn't fit the budget
+
+    The chapter being written keeps its sections, and the chapters furthest
+    from it are condensed first: their sections are dropped, then their headers.
+    """
+    template = prompts[prompt_type]
+    formatted_prompt = template.format(**format_vars)
+    budget = prompt_budget()
+    estimated = scheduler.estimate_text_tokens(formatted_prompt)
+    if estimated <= budget or "{outline}" not in template:
+        return formatted_prompt
+    chapters = string_to_chapters(format_vars.get("outline", ""))
+    headers = [chapter.header for chapter in chapters]
+    if format_vars.get("chapter") not in headers:
+        return formatted_prompt
+    target = headers.index(format_vars["chapter"])
+    farthest = max(target, len(chapters) - 1 - target)
+    steps = [(within, farthest) for within in range(farthest - 1, -1, -1)]
+    steps += [(0, within) for within in range(farthest - 1, -1, -1)]
+    condensed = estimated
+    for sections_within, headers_within in steps:
+        outline = condense_outline(chapters, target, sections_within, headers_within)
+        formatted_prompt = template.format(**dict(format_vars, outline=outline))
+        condensed = scheduler.estimate_text_tokens(formatted_prompt)
+        if condensed <= budget:
             break
+    report(
+        f"Condensed the outline to fit the prompt budget of {budget} tokens "
+        f"(estimated {estimated} -> {condensed} tokens)."
+    )
+    return formatted_prompt
 
-    return response.choices[0].message.content.strip(), response.usage.total_tokens
+
+def generate_content_stream(
+    format_vars: dict, prompt_type: str, resume_from: str = ""
+) -> Iterator[str]:
+    """Use a prompt to get some content, yielding it piece by piece
+
+    If resume_from is given, the response continues that text instead of starting over.
+    """
+    formatted_prompt = format_prompt(format_vars, prompt_type)
+    tags = {"prompt_type": prompt_type, "book_id": format_vars.get("book_id")}
+    if not resume_from:
+        return stream_response(formatted_prompt, **tags)
+    history = [
+        {"role": "user", "content": formatted_prompt},
+        {"role": "assistant", "content": resume_from},
+    ]
+    return stream_response(prompts["continue"], history=history, **tags)
+
+
+def varies(prompt_type: str) -> bool:
+    """Check if a prompt has no inputs, like the random topic, so each response should be new"""
+    return not any(field for _, field, _, _ in Formatter().parse(prompts[prompt_type]))
 
 
 def generate_content(format_vars: dict, prompt_type: str) -> str:
-    """Use a prompt to get some content"""
-    formatted_prompt = prompts[prompt_type].format(**format_vars)
-    content, tokens = get_response(formatted_prompt)
+    """Use a prompt to get some content
+
+    Usage is recorded under prompt_type and the book_id in format_vars, if any.
+    Prompts without inputs are kept out of the response cache, see varies.
+    """
+    with tracing.span("generate", prompt_type=prompt_type):
+        formatted_prompt = format_prompt(format_vars, prompt_type)
+        content, tokens = get_response(
+            formatted_prompt,
+            prompt_type=prompt_type,
+            book_id=format_vars.get("book_id"),
+            use_cache=not varies(prompt_type),
+        )
     return content
 
 
+def concurrency() -> int:
+    """Return the maximum number of requests to send at once
+
+    Set AUTOBOOK_CONCURRENCY in your environment to change it.
+    """
+    return max(1, int(os.environ.get("AUTOBOOK_CONCURRENCY", "4")))
+
+
+def generate_contents(
+    jobs: dict[K, tuple],
+    max_workers: int | None = None,
+    generate: Callable[..., str] | None = None,
+) -> Iterator[tuple[K, str]]:
+    """Use several prompts at once to get some content
+
+    Each job maps a key to the arguments for generate, which defaults to
+    generate_content, so jobs are (format_vars, prompt_type) by default.
+    Results are yielded as (key, content) in the order they finish.
+    Failed jobs are reported and skipped.
+    Each job runs in a copy of the caller's context, so context variables
+    like a cache bypass still apply.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers or concurrency()) as executor:
+        futures = {
+            executor.submit(
+                contextvars.copy_context().run, generate or generate_content, *job
+            ): key
+            for key, job in jobs.items()
+        }
+        for future in as_completed(futures):
+            try:
+                content = future.result()
+            except Exception as e:
+                print(f"Generation failed for {futures[future]}: {e}")
+                continue
+            yield futures[future], content
+
+
 def generate_field(fields: dict[str, Any], field: str) -> str:
     if field in fields and fields[field]:
         return fields[field]
@@ -89,36 +304,33 @@ def header_type(regex: str, line: str) -> bool:
     return re.match(regex, line) is not None
 
 
-# cannot figure out type hints for this
-def string_to_chapters(string: str) -> list[dict[str, Any]]:
-    """Return the chapter headers plus associated sections
+@tracing.traced("outline.parse")
+def string_to_chapters(string: str) -> list[Chapter]:
+    """Return the chapter headers plus associated sections, as unwritten chapters
 
     Format:
-        [ { "header": "I. Chapter 1",
-            "sections": [ "1. Section 1",
-                          "2. Section 2" ],
-            "content": "" },
-          { "header": "II. Chapter 2",
-            "sections": [ "1. Section 3",
-                          "2. Section 4" ],
-            "content": "" } ]
+        [ Chapter(header="I. Chapter 1",
+                  sections=["1. Section 1", "2. Section 2"]),
+          Chapter(header="II. Chapter 2",
+                  sections=["1. Section 3", "2. Section 4"]) ]
     """
-    chapters: list[dict[str, Any]] = []
+    chapters: list[Chapter] = []
     lines: list[str] = get_lines(string)
     for line in lines:
         if header_type(_is_chapter, line):
-            chapters.append({"header": line, "sections": [], "content": ""})
+            chapters.append(Chapter(line, []))
         elif header_type(_is_section, line) and len(chapters) > 0:
-            chapters[-1]["sections"].append(line)  # type: ignore
+            chapters[-1].sections.append(line)
 
     return chapters
 
 
-def chapters_to_string(chapters: list) -> str:
+@tracing.traced("outline.format")
+def chapters_to_string(chapters: list[Chapter]) -> str:
     """Return a chapters structure as a single string"""
     string = ""
     for chapter in chapters:
-        string += chapter["header"] + "\n"
-        for section in chapter["sections"]:
+        string += chapter.header + "\n"
+        for section in chapter.sections:
             string += section + "\n"
     return string
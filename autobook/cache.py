@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, suppress
+from contextvars import ContextVar
+from pathlib import Path
+
+from autobook import tracing
+
+from typing import Any, Iterator
+
+_bypass: ContextVar[bool] = ContextVar("bypass", default=False)
+_lock = threading.Lock()
+stats: dict[str, dict[str, int]] = {}
+# By cache directory, its size as of its last eviction plus what was stored
+# since, and the number of stores since
+_usage: dict[str, list[int]] = {}
+# How many stores go between evictions of a namespace that stays under size
+evict_every = 100
+
+
+def cache_dir(namespace: str) -> Path:
+    """Return the directory that holds a namespace of the cache.
+
+    Cache will be stored in instance/cache by default.
+    Set AUTOBOOK_CACHE_DIR in your environment to change the directory.
+    """
+    return Path(os.environ.get("AUTOBOOK_CACHE_DIR", "instance/cache")) / namespace
+
+
+def max_age() -> float:
+    """Return the age in seconds after which entries expire (default 30 days)."""
+    return float(os.environ.get("AUTOBOOK_CACHE_MAX_AGE", 30 * 24 * 60 * 60))
+
+
+def max_bytes() -> int:
+    """Return the size in bytes a namespace may grow to (default 100 MB)."""
+    return int(os.environ.get("AUTOBOOK_CACHE_MAX_BYTES", 100 * 1024 * 1024))
+
+
+def enabled() -> bool:
+    """Check whether the cache should be used.
+
+    Set AUTOBOOK_NO_CACHE in your environment to turn it off entirely.
+    """
+    return not (_bypass.get() or os.environ.get("AUTOBOOK_NO_CACHE"))
+
+
+@contextmanager
+def bypassed() -> Iterator[None]:
+    """Skip cache lookups inside this block; fresh results are still stored."""
+    token = _bypass.set(True)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+def make_key(*parts: Any) -> str:
+    """Return a stable hash of everything that affects a cached value."""
+    serialized = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def count(namespace: str, outcome: str) -> None:
+    """Increment the hit or miss counter of a namespace."""
+    with _lock:
+        counters = stats.setdefault(namespace, {"hits": 0, "misses": 0})
+        counters[outcome] += 1
+
+
+@tracing.traced("cache.load")
+def load(namespace: str, key: str) -> Any | None:
+    """Return a cached value, or None if it is missing, expired or bypassed."""
+    if not enabled():
+        return None
+    path = cache_dir(namespace) / f"{key}.json"
+    try:
+        if time.time() - path.stat().st_mtime > max_age():
+            path.unlink(missing_ok=True)
+            raise FileNotFoundError(path)
+        with open(path, "r") as file:
+            value = json.load(file)
+        # mark the entry as recently used so that eviction drops it last
+        os.utime(path)
+    except (OSError, ValueError):
+        count(namespace, "misses")
+        return None
+    count(namespace, "hits")
+    return value
+
+
+@tracing.traced("cache.store")
+def store(namespace: str, key: str, value: Any) -> None:
+    """Save a value to the cache, evicting old entries if it grows too large.
+
+    Storing is best effort: a value that can't be saved is just not cached,
+    so a response that was paid for is never lost to a cache error.
+    """
+    if os.environ.get("AUTOBOOK_NO_CACHE"):
+        return
+    directory = cache_dir(namespace)
+    path = directory / f"{key}.json"
+    temp_path = directory / f"{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        with open(temp_path, "w") as file:
+            json.dump(value, file, ensure_ascii=False)
+            size = file.tell()
+        os.replace(temp_path, path)
+        if eviction_due(namespace, size):
+            evict(namespace)
+    except (OSError, TypeError, ValueError):
+        with suppress(OSError):
+            temp_path.unlink(missing_ok=True)
+
+
+def eviction_due(namespace: str, size: int) -> bool:
+    """Count a stored entry, and check if the namespace should be evicted now.
+
+    It is the first time in this process, once the size stored since the
+    last eviction goes over max_bytes, and every evict_every stores, which
+    also catches entries other processes added.
+    """
+    with _lock:
+        usage = _usage.get(str(cache_dir(namespace)))
+        if usage is None:
+            return True
+        usage[0] += size
+        usage[1] += 1
+        return usage[0] > max_bytes() or usage[1] >= evict_every
+
+
+def evict(namespace: str) -> None:
+    """Remove expired entries, then the least recently used until under size.
+
+    Entries that another thread or process removes meanwhile are skipped.
+    """
+    directory = cache_dir(namespace)
+    entries = []
+    now = time.time()
+    for entry in os.scandir(directory):
+        if not entry.name.endswith(".json"):
+            continue
+        try:
+            info = entry.stat()
+        except FileNotFoundError:
+            continue
+        if now - info.st_mtime > max_age():
+            Path(entry.path).unlink(missing_ok=True)
+        else:
+            entries.append((info.st_mtime, info.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes():
+            break
+        Path(path).unlink(missing_ok=True)
+        total -= size
+    with _lock:
+        _usage[str(directory)] = [total, 0]
+
+
+def clear(namespace: str) -> None:
+    """Remove every entry of a namespace."""
+    directory = cache_dir(namespace)
+    if directory.exists():
+        for entry in directory.iterdir():
+            entry.unlink(missing_ok=True)
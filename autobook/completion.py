@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+from typing import Any, Callable
+
+# A book is ready for export once these fields are filled in and every chapter is written
+required_fields = ("title", "author", "chapters")
+
+
+def chapter_stats(chapter: dict[str, Any]) -> dict[str, Any]:
+    """Return the word count of a chapter and whether it is fully written"""
+    return {
+        "words": len(chapter["content"].split()),
+        "written": bool(chapter["content"]) and not chapter.get("partial"),
+    }
+
+
+def summarize(missing_fields: list[str], chapters: list[dict]) -> dict[str, Any]:
+    """Build a completion record from the missing fields and per-chapter stats"""
+    if not chapters and "chapters" not in missing_fields:
+        missing_fields = missing_fields + ["chapters"]
+    unwritten = sum(1 for chapter in chapters if not chapter["written"])
+    return {
+        "missing_fields": missing_fields,
+        "chapters": chapters,
+        "chapter_count": len(chapters),
+        "unwritten_chapters": unwritten,
+        "word_count": sum(chapter["words"] for chapter in chapters),
+        "ready": not missing_fields and not unwritten,
+    }
+
+
+def missing_fields(book: dict[str, Any]) -> list[str]:
+    """Return the required fields a book doesn't have yet"""
+    return [field for field in required_fields if not book.get(field)]
+
+
+def completion_record(book: dict[str, Any]) -> dict[str, Any]:
+    """Work out how complete a book is.
+
+    Records hold the missing fields, word count and written state of each
+    chapter, and the totals derived from them: chapter_count,
+    unwritten_chapters, word_count and whether the book is ready for export.
+    """
+    chapters = [chapter_stats(chapter) for chapter in book.get("chapters") or []]
+    return summarize(missing_fields(book), chapters)
+
+
+def with_fields(record: dict[str, Any], book: dict[str, Any]) -> dict[str, Any]:
+    """Update a record after fields other than chapters changed
+
+    Chapter stats are kept, so the book's chapters don't need to be loaded.
+    """
+    missing = [field for field in missing_fields(book) if field != "chapters"]
+    return summarize(missing, record["chapters"])
+
+
+def with_chapters(
+    record: dict[str, Any], change: Callable[[list[dict]], Any]
+) -> dict[str, Any]:
+    """Update a record by applying a change to its per-chapter stats
+
+    Only the changed chapters need to be counted again.
+    """
+    chapters = list(record["chapters"])
+    change(chapters)
+    missing = [field for field in record["missing_fields"] if field != "chapters"]
+    return summarize(missing, chapters)
+
+
+def matches(
+    record: dict[str, Any],
+    ready: bool | None = None,
+    max_chapters_left: int | None = None,
+) -> bool:
+    """Check a record against a query on completion state
+
+    ready filters on being ready for export, and max_chapters_left keeps books
+    with at least one and at most that many unwritten chapters.
+    """
+    if ready is not None and record["ready"] != ready:
+        return False
+    if max_chapters_left is not None:
+        return 0 < record["unwritten_chapters"] <= max_chapters_left
+    return True
@@ -1,112 +1,194 @@
 #!/usr/bin/env python3
 import os
-from functools import wraps
-from pathlib import Path
-from tinydb import TinyDB, where
-from tinydb.operations import delete
-from tinydb.table import Document
-from tinydb.queries import QueryInstance
-from typing import Callable
+import sqlite3
+from types import ModuleType
+from typing import Any, Callable
 
+from autobook import search, sqlite_storage, tinydb_storage, tracing
+from autobook.models import Book, Chapter, serialize
 
-def init_db(table_name: str) -> Callable:
-    """Decorator function to initialize the database.
+backends: dict[str, ModuleType] = {
+    "tinydb": tinydb_storage,
+    "sqlite": sqlite_storage,
+}
 
-    Database will be stored in instance/db.json by default.
-    Set AUTOBOOK_DB_FILENAME in your environment to change the filename.
 
-    Use as follows:
+def backend() -> ModuleType:
+    """Return the storage backend that holds the books.
+
+    Books are stored with TinyDB in a JSON file by default.
+    Set AUTOBOOK_DB_BACKEND in your environment to "sqlite" to use SQLite instead.
+    Both backends name their file after AUTOBOOK_DB_FILENAME.
+    Backends store plain dicts; books and chapters are turned into models here.
+    Every change is also made to the search index, see search_books.
+    """
+    name = os.environ.get("AUTOBOOK_DB_BACKEND", "tinydb")
+    if name not in backends:
+        raise ValueError(
+            f"AUTOBOOK_DB_BACKEND must be one of {', '.join(backends)}, not {name}"
+        )
+    return backends[name]
 
-    @init_db(table_name)
-    def your_function(db, your_parameter):
-        db.operation()
 
-    your_function(your_argument)
+def update_index(change: Callable[..., None], *args: Any) -> None:
+    """Make a change to the search index, without letting it fail the save
+
+    If the index can't be changed, it is marked out of date and rebuilt on
+    the next search.
     """
+    try:
+        change(*args)
+    except sqlite3.Error as e:
+        print(f"Couldn't update the search index ({e}), it will be rebuilt.")
+        search.invalidate()
 
-    def decorator(func: Callable) -> Callable:
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            file_name = os.environ.get("AUTOBOOK_DB_FILENAME", "db")
-            Path("instance").mkdir(parents=True, exist_ok=True)
-            db = TinyDB(f"instance/{file_name}.json")
-            table = db.table(table_name)
-            return func(table, *args, **kwargs)
 
-        return wrapper
+@tracing.traced("storage.add_book")
+def add_book(fields: dict[str, Any]) -> int:
+    """Add a book to the database, given its fields by name."""
+    stored = {field: serialize(field, value) for field, value in fields.items()}
+    book_id = backend().add_book(stored)
+    update_index(search.index_book, book_id, stored)
+    return book_id
 
-    return decorator
 
+@tracing.traced("storage.all_books")
+def all_books() -> list[Book]:
+    """Return every book in the database."""
+    return [Book.from_dict(book) for book in backend().all_books()]
 
-@init_db("book")
-def add_book(db, fields: dict) -> int:
-    """Add a book to the database."""
-    return db.insert(fields)
 
+@tracing.traced("storage.unfinished_books")
+def unfinished_books() -> list[Book]:
+    """Return the books that aren't ready for export."""
+    return [Book.from_dict(book) for book in backend().unfinished_books()]
 
-def add_doc_ids(books: list[Document]) -> list[Document]:
-    """Add doc ids to a list of books"""
-    for book in books:
-        book["book_id"] = book.doc_id
-    return books
 
+@tracing.traced("storage.book_summaries")
+def book_summaries(
+    fields: list[str],
+    ready: bool | None = None,
+    max_chapters_left: int | None = None,
+) -> list[dict[str, Any]]:
+    """Return only the requested fields of every book, plus its book_id.
 
-@init_db("book")
-def all_books(db) -> list[Document]:
-    """Return every book in the database."""
-    return add_doc_ids(db.all())
+    Listing small fields like the topic doesn't load any chapters.
+    Fields can also name entries of the completion record, like word_count.
+    ready filters on being ready for export, and max_chapters_left keeps books
+    with at least one and at most that many unwritten chapters.
+    """
+    return backend().book_summaries(fields, ready, max_chapters_left)
+
+
+@tracing.traced("storage.unfinished_book_summaries")
+def unfinished_book_summaries(fields: list[str]) -> list[dict[str, Any]]:
+    """Return only the requested fields of every unfinished book, plus its book_id."""
+    return backend().book_summaries(fields, ready=False)
 
 
-def unfinished_field(field: str) -> QueryInstance:
-    """Return a query which filters for a field not existing,
-    or having a None or empty string value
+@tracing.traced("storage.get_completion")
+def get_completion(book_id: int) -> dict[str, Any] | None:
+    """Return how complete a book is, as kept up to date on every save.
+
+    See completion.completion_record for what the record holds.
     """
-    return (where(field).one_of([None, ""])) | ~(where(field).exists())
-
-
-# TODO: so this is intended to return books that are not "finished",
-# as in not all their applicable fields are filled in
-# however, it is only deciding this based on these three fields...
-# Perhaps books should have a finished flag set on completion
-# Perhaps books should simply be listed with their present flags
-# Or perhaps the concept of a finished book is flawed in the first place
-# Something to decide for the future
-@init_db("book")
-def unfinished_books(db) -> list[Document]:
-    """Return the books that don't have all the necessary fields for export."""
-    return add_doc_ids(
-        db.search(
-            unfinished_field("title")
-            | unfinished_field("author")
-            | unfinished_field("chapters")
-        )
-    )
+    return backend().get_completion(book_id)
 
 
-@init_db("book")
-def get_book(db, book_id: int) -> Document | None:
+@tracing.traced("storage.get_book")
+def get_book(book_id: int) -> Book | None:
     """Get a single book from the database."""
-    book = db.get(doc_id=book_id)
-    if book is not None:
-        book["book_id"] = book_id
-    return book
+    book = backend().get_book(book_id)
+    return Book.from_dict(book) if book is not None else None
 
 
-@init_db("book")
-def update_book(db, book_id: int, field: str, content: str) -> None:
+@tracing.traced("storage.update_book")
+def update_book(book_id: int, field: str, content: Any) -> None:
     """Update a field of a book in the database."""
-    db.update({field: content}, doc_ids=[book_id])
+    stored = serialize(field, content)
+    backend().update_book(book_id, field, stored)
+    update_index(search.index_field, book_id, field, stored)
 
 
-@init_db("book")
-def delete_book(db, book_id: int) -> None:
+@tracing.traced("storage.delete_book")
+def delete_book(book_id: int) -> None:
     """Remove a book from the database."""
-    db.remove(doc_ids=[book_id])
+    backend().delete_book(book_id)
+    update_index(search.index_book, book_id, None)
 
 
-@init_db("book")
-def delete_book_field(db, book_id: int, field: str) -> None:
-    """Remove a book from the database."""
-    book = db.get(doc_id=book_id)
-    if field in book:
-        db.update(delete(field), doc_ids=[book_id])
+@tracing.traced("storage.delete_book_field")
+def delete_book_field(book_id: int, field: str) -> None:
+    """Remove a field from a book in the database."""
+    backend().delete_book_field(book_id, field)
+    update_index(search.index_field, book_id, field, None)
+
+
+@tracing.traced("storage.update_chapter")
+def update_chapter(book_id: int, index: int, chapter: Chapter) -> None:
+    """Replace a single chapter of a book."""
+    stored = chapter.to_dict()
+    backend().update_chapter(book_id, index, stored)
+    update_index(search.index_chapter, book_id, index, stored)
+
+
+@tracing.traced("storage.insert_chapter")
+def insert_chapter(book_id: int, index: int, chapter: Chapter) -> None:
+    """Insert a chapter into a book, pushing later chapters up."""
+    stored = chapter.to_dict()
+    backend().insert_chapter(book_id, index, stored)
+    update_index(search.insert_chapter, book_id, index, stored)
+
+
+@tracing.traced("storage.move_chapter")
+def move_chapter(book_id: int, source: int, destination: int) -> None:
+    """Move a chapter of a book, as if it were removed and then inserted."""
+    backend().move_chapter(book_id, source, destination)
+    update_index(search.move_chapter, book_id, source, destination)
+
+
+@tracing.traced("storage.delete_chapter")
+def delete_chapter(book_id: int, index: int) -> None:
+    """Remove a single chapter from a book."""
+    backend().delete_chapter(book_id, index)
+    update_index(search.delete_chapter, book_id, index)
+
+
+@tracing.traced("storage.search_books")
+def search_books(query: str, limit: int = 10) -> list[dict[str, Any]]:
+    """Return the books whose title, topic, outline or chapters best match a query.
+
+    See search.search for what each result holds. The index is kept up to
+    date on every change; the first search indexes every book.
+    """
+    if not search.built():
+        search.rebuild(backend().all_books())
+    return search.search(query, limit)
+
+
+def rebuild_search_index() -> int:
+    """Index every book again, returning how many there are"""
+    return search.rebuild(backend().all_books())
+
+
+def migrate_to_sqlite(json_path: str | None = None) -> int:
+    """Copy every book from a TinyDB JSON file into the SQLite database.
+
+    Defaults to the JSON file named by AUTOBOOK_DB_FILENAME.
+    Returns the number of books copied.
+    """
+    tinydb_storage.flush_db()
+    return sqlite_storage.migrate_from_json(json_path or tinydb_storage.db_path())
+
+
+def flush_db() -> None:
+    """Write any changes held in memory to the database files."""
+    for storage in backends.values():
+        storage.flush_db()
+
+
+def close_db() -> None:
+    """Flush and close every open database handle."""
+    for storage in backends.values():
+        storage.close_db()
+    search.close_db()
@@ -1,16 +1,29 @@
 #!/usr/bin/env python3
 import datetime
+import io
 import os
 import uuid
+from functools import lru_cache
 from PIL import Image
 from dominate.tags import h1, h2, p
 from ebooklib import epub
 
+from autobook import cache, tracing
+
 
 def make_cover_image(width=1600, height=2560, color="white"):
     """Make a blank cover file as a placeholder"""
     print("Creating the image...")
-    return Image.new("RGBA", (width, height), color)
+    # A flat colour only needs a one-entry palette, which encodes far smaller than RGBA
+    return Image.new("P", (width, height), color)
+
+
+@lru_cache(maxsize=16)
+def cover_png(width=1600, height=2560, color="white") -> bytes:
+    """Encode a placeholder cover in memory, once per set of parameters"""
+    buffer = io.BytesIO()
+    make_cover_image(width, height, color).save(buffer, "PNG", optimize=True)
+    return buffer.getvalue()
 
 
 def create_chapter_file(content, header, file_name, css_href) -> epub.EpubHtml:
@@ -70,10 +83,60 @@ def add_title_page(book, title, author, css_href):
     book.spine.append(page)
 
 
+def export_fingerprint(chapters, title, author, css) -> str:
+    """Return a hash of everything that ends up in an exported epub"""
+    return cache.make_key(
+        title,
+        author,
+        css,
+        datetime.date.today().year,
+        [(chapter.header, chapter.content) for chapter in chapters],
+    )
+
+
+def file_state(file_path) -> list[int]:
+    """Return what identifies a version of a file on disk"""
+    stat = os.stat(file_path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def export_is_current(file_path, fingerprint) -> bool:
+    """Check if the file at file_path is our own export of exactly this book"""
+    previous = cache.load("exports", cache.make_key(os.path.abspath(file_path)))
+    try:
+        return (
+            previous is not None
+            and previous["fingerprint"] == fingerprint
+            and previous["state"] == file_state(file_path)
+        )
+    except FileNotFoundError:
+        return False
+
+
+def remember_export(file_path, fingerprint) -> None:
+    """Record which version of a book was exported to file_path"""
+    cache.store(
+        "exports",
+        cache.make_key(os.path.abspath(file_path)),
+        {"fingerprint": fingerprint, "state": file_state(file_path)},
+    )
+
+
 def chapters_to_book(
     chapters, title, author, css=None, cover_image=None, file_path="output/book.epub"
 ):
-    """Format book data into an epub"""
+    """Format book data into an epub
+
+    Chapters rendered by earlier exports are reused, and if the book hasn't
+    changed since it was last exported to file_path, the file is left as it is.
+    """
+
+    with tracing.span("export.epub.check"):
+        fingerprint = export_fingerprint(chapters, title, author, css)
+        current = export_is_current(file_path, fingerprint)
+    if current:
+        print(f"{file_path} is already up to date.")
+        return
 
     print("Creating ebook...")
     book = epub.EpubBook()
@@ -88,12 +151,9 @@ def chapters_to_book(
     book.add_author(author)
 
     print("Adding cover image...")
-    cover = make_cover_image()
-    cover.save("cover.png", "PNG")
-    with open("cover.png", "rb") as file:
-        book.set_cover("cover.png", file.read())
+    with tracing.span("export.epub.cover"):
+        book.set_cover("cover.png", cover_png())
     book.spine.append("cover")
-    os.remove("cover.png")
 
     print("Adding CSS...")
     # Add css file
@@ -106,18 +166,20 @@ def chapters_to_book(
 
     print("Adding frontmatter...")
     # Adding title page, copyright page, and so on
-    add_title_page(book, title, author, css_href)
-    add_copyright_page(book, author, css_href)
+    with tracing.span("export.epub.frontmatter"):
+        add_title_page(book, title, author, css_href)
+        add_copyright_page(book, author, css_href)
 
     book.spine.append("nav")
 
     print("Adding chapters...")
     # Add chapters
 
-    for i, chapter in enumerate(chapters):
-        add_chapter_to_book(
-            book, chapter["content"], chapter["header"], f"chapter{i+1}.xhtml", css_href
-        )
+    with tracing.span("export.epub.chapters", chapters=len(chapters)):
+        for i, chapter in enumerate(chapters):
+            add_chapter_to_book(
+                book, chapter.content, chapter.header, f"chapter{i+1}.xhtml", css_href
+            )
 
     # Add navigation files
     nav = epub.EpubNav()
@@ -128,7 +190,9 @@ def chapters_to_book(
 
     print("Saving book...")
     # create epub file
-    epub.write_epub(file_path, book, {})
+    with tracing.span("export.epub.write"):
+        epub.write_epub(file_path, book, {})
+    remember_export(file_path, fingerprint)
     print("Success!")
 
 
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows, where only threads of one process are kept apart
+    fcntl = None  # type: ignore
+
+# Open lock files of the locks this process holds, by the path they guard
+_handles: dict[str, int] = {}
+_lock = threading.Lock()
+
+
+def lock_path(path: str) -> str:
+    """Return the lock file that guards a file, like instance/db.json.lock"""
+    return f"{path}.lock"
+
+
+def acquire(path: str) -> None:
+    """Take the lock that guards a file, waiting while another process holds it.
+
+    Locks are advisory, so they only keep apart processes that take them.
+    They aren't reentrant: take each lock once and release it when done.
+    The lock is let go of by the system if the process exits without
+    releasing it.
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    handle = os.open(lock_path(path), os.O_RDWR | os.O_CREAT, 0o644)
+    if fcntl is not None:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+    with _lock:
+        _handles[path] = handle
+
+
+def release(path: str) -> None:
+    """Let go of the lock that guards a file, if this process holds it"""
+    with _lock:
+        handle = _handles.pop(path, None)
+    if handle is not None:
+        # closing the lock file releases the lock
+        os.close(handle)
+
+
+@contextmanager
+def locked(path: str) -> Iterator[None]:
+    """Hold the lock that guards a file for the length of a block"""
+    acquire(path)
+    try:
+        yield
+    finally:
+        release(path)
+
+
+def forget_locks() -> None:
+    """Drop the locks inherited from a parent process, without releasing them
+
+    The locks stay with the parent, which is the one that takes and releases them.
+    """
+    global _lock
+    _lock = threading.Lock()
+    _handles.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=forget_locks)
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    """Replace the content of a file all at once.
+
+    The data is written to a temporary file next to it, which then takes its
+    place, so readers see either the old or the new content and a crash
+    midway leaves the old content.
+    """
+    directory = Path(path).parent
+    directory.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        dir=directory, delete=False, prefix=".tmp-"
+    ) as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(file.name, path)
@@ -1,19 +1,24 @@
 #!/usr/bin/env python3
-from autobook import book, epub, text
+import contextvars
+import os
+import threading
+import time
+from concurrent import futures
+from pathlib import Path
+
+from autobook import book, cache, metrics, tasks, tracing
 from autobook import database as db
-from typing import Any
+from autobook.models import Book, Chapter
+from typing import Any, Callable, Iterator
 
 
 def list_book(book_id: int) -> dict[str, Any]:
     """Return every field of a single book in the database."""
-    try:
-        return dict(db.get_book(book_id))
-    except TypeError as e:
-        if "NoneType" in str(e):
-            print(
-                f"main.list_book: error: argument book_id: book_id {book_id} not found"
-            )
+    book = db.get_book(book_id)
+    if book is None:
+        print(f"main.list_book: error: argument book_id: book_id {book_id} not found")
         return {}
+    return book.fields()
 
 
 def simple_list_of_books(raw_books: list) -> list:
@@ -23,12 +28,52 @@ def simple_list_of_books(raw_books: list) -> list:
 
 def list_books() -> list[dict[str, Any] | None]:
     """Return the id and topic for every book in the database."""
-    return simple_list_of_books(db.all_books())
+    return simple_list_of_books(db.book_summaries(["topic"]))
 
 
 def list_unfinished_books() -> list[dict[str, Any] | None]:
     """Return every unfinished book in the database."""
-    return simple_list_of_books(db.unfinished_books())
+    return simple_list_of_books(db.unfinished_book_summaries(["topic"]))
+
+
+def list_ready_books() -> list[dict[str, Any] | None]:
+    """Return every book that is ready for export."""
+    return simple_list_of_books(db.book_summaries(["topic"], ready=True))
+
+
+def list_books_with_chapters_left(chapters_left: int) -> list[dict[str, Any] | None]:
+    """Return every book with at least one and at most chapters_left unwritten chapters."""
+    return simple_list_of_books(
+        db.book_summaries(["topic"], max_chapters_left=chapters_left)
+    )
+
+
+def book_completion(book_id: int) -> dict[str, Any] | None:
+    """Return how complete a book is."""
+    return db.get_completion(book_id)
+
+
+def search_books(query: str, limit: int = 10) -> list[dict[str, Any]]:
+    """Return the books that best match a query, best first, with their title and topic."""
+    results = db.search_books(query, limit)
+    if results:
+        books = {
+            book["book_id"]: book for book in db.book_summaries(["title", "topic"])
+        }
+        for result in results:
+            book = books.get(result["book_id"], {})
+            result.update(title=book.get("title"), topic=book.get("topic"))
+    return results
+
+
+def rebuild_search_index() -> int:
+    """Index every book for searching again, returning how many there are."""
+    return db.rebuild_search_index()
+
+
+def usage_stats(book_id: int | None = None) -> dict[str, dict[str, Any]]:
+    """Return the token usage and cost of every request, or of one book's, by prompt type."""
+    return metrics.summarize(metrics.load(book_id))
 
 
 def create_book(fields: dict[str, Any]) -> int:
@@ -37,8 +82,10 @@ def create_book(fields: dict[str, Any]) -> int:
     return book_id
 
 
-def random_topic() -> str:
-    """Generate a random topic for a book."""
+def random_topic(taken: list[str] | None = None) -> str:
+    """Generate a random topic for a book, unlike any of the topics taken."""
+    if taken:
+        return book.generate_content({"topics": "; ".join(taken)}, "new_topic")
     return book.generate_content({}, "topic")
 
 
@@ -47,20 +94,201 @@ def generate_field_content(fields: dict[str, Any], field: str) -> str:
     return book.generate_content(fields, field)
 
 
-def chapters_to_outline(chapters: list[dict[str, Any]]) -> str:
+def generate_chapter_contents(
+    book_id: int,
+    chapters: list[Chapter],
+    format_args: dict[int, dict],
+    task_prefix: str | None = None,
+) -> int:
+    """Generate content for several chapters at once, saving each as it finishes.
+
+    With a task_prefix, each chapter is a task in the durable queue, so
+    content generated by an interrupted run is reused instead of requested again.
+    """
+    written = 0
+    jobs: dict[int, tuple] = {
+        index: (args, "content") for index, args in format_args.items()
+    }
+    generate = None
+    if task_prefix is not None:
+        jobs = {
+            index: (f"{task_prefix}/chapter/{index}", *job)
+            for index, job in jobs.items()
+        }
+        generate = lambda key, args, prompt_type: run_task(
+            key, book.generate_content, args, prompt_type
+        )
+    for index, content in book.generate_contents(jobs, generate=generate):
+        chapters[index].content = content
+        chapters[index].partial = False
+        save_chapter(book_id, index, chapters[index])
+        print(f"Chapter {index + 1} written.")
+        written += 1
+    return written
+
+
+def run_task(key: str, generate: Callable, *args) -> Any:
+    """Run a step of a long job through the durable task queue.
+
+    If an earlier run already finished the step, its result is returned
+    without doing the work again.
+    """
+    return tasks.run(key, lambda: generate(*args))
+
+
+def reset_tasks(prefix: str) -> int:
+    """Let failed steps whose keys start with prefix run again."""
+    return tasks.reset(prefix)
+
+
+def streaming() -> bool:
+    """Check whether chapter content should be streamed as it is generated.
+
+    Set AUTOBOOK_STREAM in your environment to turn streaming on.
+    """
+    return bool(os.environ.get("AUTOBOOK_STREAM"))
+
+
+def stream_chapter_content(
+    book_id: int, chapters: list[Chapter], index: int, format_args: dict
+) -> str:
+    """Generate content for a chapter, printing it live and saving it as it arrives.
+
+    Partial content is saved every AUTOBOOK_CHECKPOINT_TOKENS pieces (default 50)
+    or AUTOBOOK_CHECKPOINT_SECONDS seconds (default 5), and the chapter is marked
+    partial until the response is complete, so an interrupted chapter resumes
+    where it stopped the next time it is generated.
+    """
+    checkpoint_tokens = int(os.environ.get("AUTOBOOK_CHECKPOINT_TOKENS", "50"))
+    checkpoint_seconds = float(os.environ.get("AUTOBOOK_CHECKPOINT_SECONDS", "5"))
+    chapter = chapters[index]
+    resume_from = chapter.content if chapter.partial else ""
+    if resume_from:
+        print(f"Resuming partial chapter {index + 1}...\n{resume_from}", end="")
+    chapter.content = resume_from
+    chapter.partial = True
+    pieces = 0
+    last_saved = time.monotonic()
+    try:
+        for piece in book.generate_content_stream(format_args, "content", resume_from):
+            print(piece, end="", flush=True)
+            chapter.content += piece
+            pieces += 1
+            if (
+                pieces >= checkpoint_tokens
+                or time.monotonic() - last_saved >= checkpoint_seconds
+            ):
+                save_chapter(book_id, index, chapter)
+                pieces = 0
+                last_saved = time.monotonic()
+        chapter.content = chapter.content.strip()
+        chapter.partial = False
+    finally:
+        print()
+        save_chapter(book_id, index, chapter)
+    return chapter.content
+
+
+def lookahead() -> bool:
+    """Check whether the next unwritten chapter should be written while one is reviewed.
+
+    Set AUTOBOOK_LOOKAHEAD in your environment to turn look-ahead on.
+    """
+    return bool(os.environ.get("AUTOBOOK_LOOKAHEAD"))
+
+
+# The key and future of the chapter being written ahead, if any
+_ahead: dict[str, Any] = {}
+_ahead_lock = threading.Lock()
+
+
+def write_ahead(format_args: dict) -> None:
+    """Start generating content for a chapter in a background thread.
+
+    Only one chapter is written ahead at a time; starting another one
+    replaces it. The request goes through the response cache like any other,
+    without printing its progress. The thread doesn't keep the program from
+    exiting.
+    """
+    key = cache.make_key(format_args)
+    with _ahead_lock:
+        if _ahead.get("key") == key:
+            return
+        if _ahead:
+            _ahead["future"].cancel()
+        future: futures.Future = futures.Future()
+        _ahead.update(key=key, future=future)
+    threading.Thread(
+        target=contextvars.copy_context().run,
+        args=(run_ahead, future, format_args),
+        daemon=True,
+    ).start()
+
+
+def run_ahead(future: futures.Future, format_args: dict) -> None:
+    """Generate content for a chapter written ahead, unless it was replaced first"""
+    if not future.set_running_or_notify_cancel():
+        return
+    try:
+        with book.quiet():
+            future.set_result(book.generate_content(format_args, "content"))
+    except Exception as e:
+        future.set_exception(e)
+
+
+def take_written_ahead(format_args: dict) -> futures.Future | None:
+    """Take the chapter being written ahead, if it has exactly these format args.
+
+    A chapter whose outline or header changed since it was started doesn't
+    match and is left alone until it is replaced. See ahead_content for
+    getting the content.
+    """
+    key = cache.make_key(format_args)
+    with _ahead_lock:
+        if _ahead.get("key") != key:
+            return None
+        future = _ahead.pop("future")
+        _ahead.clear()
+    return future
+
+
+def ahead_content(future: futures.Future) -> str | None:
+    """Return the content of a chapter written ahead, waiting for it if needed.
+
+    Returns None if writing it failed.
+    """
+    if not future.done():
+        print("Waiting for the chapter being written ahead...")
+    try:
+        return future.result()
+    except Exception:
+        return None
+
+
+def without_cache(generate: Callable, *args) -> Any:
+    """Call a generator while making sure it asks the AI for new content."""
+    with cache.bypassed():
+        return generate(*args)
+
+
+def cache_stats() -> dict[str, dict[str, int]]:
+    """Return the hit and miss counters of each cache."""
+    return cache.stats
+
+
+def chapters_to_outline(chapters: list[Chapter]) -> str:
     """Convert a chapters structure to an outline for viewing."""
     return book.chapters_to_string(chapters)
 
 
-def outline_to_chapters(outline: str) -> list:
+def outline_to_chapters(outline: str) -> list[Chapter]:
     """Convert an outline to a chapters structure."""
     return book.string_to_chapters(outline)
 
 
 def load_from_book(book_id: int, field: str) -> str:
     """Grab specific data from a book."""
-    book = db.get_book(book_id)
-    return book[field]
+    return getattr(db.get_book(book_id), field)
 
 
 def save_to_book(book_id: int, field: str, content: str) -> None:
@@ -68,6 +296,26 @@ def save_to_book(book_id: int, field: str, content: str) -> None:
     db.update_book(book_id, field, content)
 
 
+def save_chapter(book_id: int, index: int, chapter: Chapter) -> None:
+    """Save a single chapter of a book."""
+    db.update_chapter(book_id, index, chapter)
+
+
+def insert_chapter(book_id: int, index: int, chapter: Chapter) -> None:
+    """Save a new chapter into a book, pushing later chapters up."""
+    db.insert_chapter(book_id, index, chapter)
+
+
+def move_chapter(book_id: int, source: int, destination: int) -> None:
+    """Move a saved chapter to another place in a book."""
+    db.move_chapter(book_id, source, destination)
+
+
+def delete_chapter(book_id: int, index: int) -> None:
+    """Delete a single chapter of a book."""
+    db.delete_chapter(book_id, index)
+
+
 def delete_book(book_id: int) -> None:
     """Delete a book from the database."""
     db.delete_book(book_id)
@@ -78,14 +326,30 @@ def delete_book_field(book_id: int, field: str) -> None:
     db.delete_book_field(book_id, field)
 
 
+def migrate_to_sqlite(json_path: str | None = None) -> int:
+    """Copy every book from the JSON database into the SQLite database."""
+    return db.migrate_to_sqlite(json_path)
+
+
+def saved_book(book_id: int) -> Book:
+    """Return a saved book, raising KeyError if there is none."""
+    book = db.get_book(book_id)
+    if book is None:
+        raise KeyError(book_id)
+    return book
+
+
 def export_book_to_epub(book_id: int, file_path: str) -> None:
     """Export a book to an epub file."""
-    book = db.get_book(book_id)
+    # ebooklib, lxml, pillow and dominate take longer to import than most commands take to run
+    from autobook import epub
+
+    book = saved_book(book_id)
     css = epub.load_css("styles/wendy.css")
     epub.chapters_to_book(
-        chapters=book["chapters"],
-        title=book["title"],
-        author=book["author"],
+        chapters=book.chapters or [],
+        title=book.title,
+        author=book.author,
         css=css,
         file_path=file_path,
     )
@@ -93,10 +357,67 @@ def export_book_to_epub(book_id: int, file_path: str) -> None:
 
 def export_book_to_text(book_id: int, file_path: str) -> None:
     """Export a book to a text file."""
-    book = db.get_book(book_id)
+    from autobook import text
+
+    book = saved_book(book_id)
     text.chapters_to_text(
-        chapters=book["chapters"],
-        title=book["title"],
-        author=book["author"],
+        chapters=book.chapters or [],
+        title=book.title,
+        author=book.author,
         file_path=file_path,
     )
+
+
+exporters: dict[str, Callable[[int, str], None]] = {
+    "epub": export_book_to_epub,
+    "txt": export_book_to_text,
+}
+
+
+def export_book(book_id: int, format: str, file_path: str) -> float:
+    """Export a book in one of the formats in exporters, returning the seconds it took."""
+    start = time.perf_counter()
+    with tracing.span("export", format=format, book_id=book_id):
+        exporters[format](book_id, file_path)
+    return time.perf_counter() - start
+
+
+def exportable_books() -> list[int]:
+    """Return the id of every book with at least one chapter."""
+    return [
+        summary["book_id"]
+        for summary in db.book_summaries(["chapter_count"])
+        if summary["chapter_count"]
+    ]
+
+
+def export_books(
+    book_ids: list[int],
+    formats: list[str],
+    output_dir: str,
+    max_workers: int | None = None,
+) -> Iterator[tuple[int, str, str, float]]:
+    """Export several books in several formats at once, one process per export.
+
+    Each book is saved to output_dir as <book_id>.<format>.
+    Yields the book id, format, file path and seconds taken of each export as it
+    finishes. Failed exports are reported and skipped.
+    """
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    # worker processes read the database files, so they must be up to date
+    db.flush_db()
+    with futures.ProcessPoolExecutor(max_workers) as executor:
+        exports = {}
+        for book_id in book_ids:
+            for format in formats:
+                file_path = os.path.join(output_dir, f"{book_id}.{format}")
+                future = executor.submit(export_book, book_id, format, file_path)
+                exports[future] = (book_id, format, file_path)
+        for future in futures.as_completed(exports):
+            book_id, format, file_path = exports[future]
+            try:
+                seconds = future.result()
+            except Exception as e:
+                print(f"Could not export book {book_id} to {file_path}: {e}")
+                continue
+            yield book_id, format, file_path, seconds
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from typing import Any
+
+_lock = threading.Lock()
+
+# Dollars per 1000 prompt tokens and per 1000 completion tokens
+prices: dict[str, tuple[float, float]] = {
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+}
+
+
+def metrics_path() -> Path:
+    """Return the file that usage records are appended to.
+
+    Records are stored in instance/db.metrics.jsonl by default, named after
+    AUTOBOOK_DB_FILENAME so that they go with the books they describe.
+    Set AUTOBOOK_METRICS_FILE in your environment to use another file.
+    """
+    if "AUTOBOOK_METRICS_FILE" in os.environ:
+        return Path(os.environ["AUTOBOOK_METRICS_FILE"])
+    file_name = os.environ.get("AUTOBOOK_DB_FILENAME", "db")
+    return Path(f"instance/{file_name}.metrics.jsonl")
+
+
+def cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Return the price in dollars of a request, or 0 for models without a price"""
+    prompt_price, completion_price = prices.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+def record(
+    model: str,
+    prompt_type: str | None,
+    book_id: int | None,
+    prompt_tokens: int,
+    completion_tokens: int,
+    latency: float,
+    cached: bool = False,
+    estimated_tokens: int = 0,
+) -> None:
+    """Append the usage of a single request to the metrics file
+
+    estimated_tokens is what the prompt was expected to take before sending it.
+    """
+    line = json.dumps(
+        {
+            "time": time.time(),
+            "model": model,
+            "prompt_type": prompt_type,
+            "book_id": book_id,
+            "estimated_tokens": estimated_tokens,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "latency": latency,
+            "cached": cached,
+        }
+    )
+    path = metrics_path()
+    with _lock:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # a single short append is atomic, so processes can share the file
+        with open(path, "a") as file:
+            file.write(line + "\n")
+
+
+def load(book_id: int | None = None) -> list[dict[str, Any]]:
+    """Return every usage record, or only those of one book"""
+    try:
+        with open(metrics_path(), "r") as file:
+            lines = file.readlines()
+    except FileNotFoundError:
+        return []
+    records = []
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            # skip a line cut short by a crash
+            continue
+        if book_id is None or entry["book_id"] == book_id:
+            records.append(entry)
+    return records
+
+
+def summarize(records: list[dict[str, Any]]) -> dict[str, dict[str, Any]]:
+    """Total the usage of records by prompt type, most expensive first.
+
+    Each summary holds the number of calls, how many were answered from the
+    cache, estimated and actual prompt tokens, completion tokens, average
+    latency of the calls sent to the API and cost in dollars.
+    The "total" entry covers every record.
+    """
+    summaries: dict[str, dict[str, Any]] = {}
+    for entry in records:
+        for name in (entry["prompt_type"] or "other", "total"):
+            summary = summaries.setdefault(
+                name,
+                {
+                    "calls": 0,
+                    "cached": 0,
+                    "estimated_tokens": 0,
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "latency": 0.0,
+                    "cost": 0.0,
+                },
+            )
+            summary["calls"] += 1
+            summary["cached"] += entry["cached"]
+            # records from before estimates were kept have none
+            summary["estimated_tokens"] += entry.get("estimated_tokens", 0)
+            summary["prompt_tokens"] += entry["prompt_tokens"]
+            summary["completion_tokens"] += entry["completion_tokens"]
+            summary["latency"] += entry["latency"]
+            summary["cost"] += cost(
+                entry["model"], entry["prompt_tokens"], entry["completion_tokens"]
+            )
+    for summary in summaries.values():
+        sent = summary["calls"] - summary["cached"]
+        summary["latency"] = summary["latency"] / sent if sent else 0.0
+    return dict(
+        sorted(
+            summaries.items(),
+            key=lambda item: (item[0] == "total", -item[1]["cost"]),
+        )
+    )
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+import dataclasses
+from dataclasses import dataclass, field
+
+from typing import Any
+
+
+@dataclass(slots=True)
+class Chapter:
+    """A chapter of a book, with its section headers and content
+
+    A chapter is partial while its content is only partly written, like after
+    an interrupted stream.
+    """
+
+    header: str
+    sections: list[str]
+    content: str = ""
+    partial: bool = False
+
+    @classmethod
+    def from_dict(cls, record: dict[str, Any]) -> "Chapter":
+        """Read a chapter as it is stored"""
+        return cls(
+            record["header"],
+            list(record.get("sections") or []),
+            record.get("content") or "",
+            bool(record.get("partial")),
+        )
+
+    def to_dict(self) -> dict[str, Any]:
+        """Return the chapter as it is stored, only marking it partial if it is"""
+        record: dict[str, Any] = {
+            "header": self.header,
+            "sections": list(self.sections),
+            "content": self.content,
+        }
+        if self.partial:
+            record["partial"] = True
+        return record
+
+
+@dataclass(slots=True)
+class Book:
+    """A saved book. Fields the book doesn't have yet are None.
+
+    Stored fields that aren't listed here are kept in extra, so that they
+    can still be listed, saved back and deleted.
+    """
+
+    book_id: int | None = None
+    topic: str | None = None
+    title: str | None = None
+    author: str | None = None
+    num_chapters: int | None = None
+    category: str | None = None
+    outline: str | None = None
+    chapters: list[Chapter] | None = None
+    extra: dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, record: dict[str, Any]) -> "Book":
+        """Read a book as it is stored"""
+        values = {name: record.get(name) for name in book_fields}
+        if values["chapters"] is not None:
+            values["chapters"] = [
+                Chapter.from_dict(chapter) for chapter in values["chapters"]
+            ]
+        extra = {
+            name: value for name, value in record.items() if name not in book_fields
+        }
+        return cls(**values, extra=extra)
+
+    def fields(self) -> dict[str, Any]:
+        """Return the fields the book has by name, sharing its chapters"""
+        values = {name: getattr(self, name) for name in book_fields}
+        values = {name: value for name, value in values.items() if value is not None}
+        return dict(values, **self.extra)
+
+
+# Every known field of a book, in the order they are listed
+book_fields = tuple(
+    known.name for known in dataclasses.fields(Book) if known.name != "extra"
+)
+
+
+def list_index(index: int, length: int) -> int:
+    """Turn an index into a position in a list of chapters, the way Python lists treat them"""
+    if index < 0:
+        index += length
+    return max(0, min(index, length))
+
+
+def serialize(field: str, value: Any) -> Any:
+    """Return the value of a book field as it is stored"""
+    if field == "chapters" and value is not None:
+        return [chapter.to_dict() for chapter in value]
+    return value
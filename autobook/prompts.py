@@ -5,6 +5,11 @@ prompts = {
         "Write a topic for a book. This topic is one sentence long. "
         "Only return the topic, nothing else."
     ),
+    "new_topic": (
+        "Write a topic for a book. This topic is one sentence long and about "
+        "something other than any of these topics: {topics}. "
+        "Only return the topic, nothing else."
+    ),
     "title": (
         "Write a title for a book about {topic}. Only write the title, nothing else."
     ),
@@ -38,4 +43,8 @@ prompts = {
         "{outline}\n\n"
         "Write section headers for this chapter header: {chapter}."
     ),
+    "continue": (
+        "Continue writing exactly where the text stops, even mid-sentence. "
+        "Don't repeat anything that was already written."
+    ),
 }
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+
+from autobook import scheduler
+
+from typing import Any, Iterator
+
+
+@dataclass
+class Usage:
+    """Tokens taken by a single request"""
+
+    prompt_tokens: int
+    completion_tokens: int
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+class Provider(ABC):
+    """A language model that chat messages can be sent to.
+
+    name, retryable_errors and fatal_errors are passed to scheduler.schedule.
+    """
+
+    name = "API"
+    retryable_errors: tuple[type[Exception], ...] = ()
+    fatal_errors: tuple[type[Exception], ...] = ()
+
+    @property
+    @abstractmethod
+    def model(self) -> str:
+        """Name the model, which is part of the cache key of every response"""
+
+    @abstractmethod
+    def complete(
+        self, messages: list[dict[str, str]], logit_bias: dict
+    ) -> tuple[str, Usage]:
+        """Return the full response to the messages and its usage"""
+
+    @abstractmethod
+    def stream(
+        self, messages: list[dict[str, str]], logit_bias: dict
+    ) -> Iterator[str | Usage]:
+        """Send the messages and return an iterator over the response
+
+        The request is sent before this returns, so that the scheduler can
+        retry it. The response is yielded piece by piece, followed by the usage
+        of the request if the provider reports it.
+        """
+
+
+class OpenAIProvider(Provider):
+    """The OpenAI chat completions API, using OPENAI_API_KEY.
+
+    Set AUTOBOOK_MODEL in your environment to change the model
+    (default: gpt-3.5-turbo-16k).
+    """
+
+    name = "OpenAI API"
+
+    def __init__(self, client: Any = None):
+        # imported here so that other providers don't need the openai package
+        import openai
+
+        # retries are handled by the scheduler, so that they respect the rate limits
+        self.client = client or openai.OpenAI(
+            api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0
+        )
+        # Timeouts, connection failures, rate limits and server errors are worth retrying
+        self.retryable_errors = (
+            openai.APIConnectionError,
+            openai.RateLimitError,
+            openai.InternalServerError,
+        )
+        # Anything else the API reports (invalid request, authentication, permission...) is not
+        self.fatal_errors = (openai.APIError,)
+
+    @property
+    def model(self) -> str:
+        return os.environ.get("AUTOBOOK_MODEL", "gpt-3.5-turbo-16k")
+
+    def complete(self, messages, logit_bias):
+        response = self.client.chat.completions.create(
+            model=self.model, messages=messages, logit_bias=logit_bias, n=1
+        )
+        usage = Usage(response.usage.prompt_tokens, response.usage.completion_tokens)
+        return response.choices[0].message.content, usage
+
+    def stream(self, messages, logit_bias):
+        chunks = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            logit_bias=logit_bias,
+            n=1,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        return self.pieces(chunks)
+
+    def pieces(self, chunks: Iterator[Any]) -> Iterator[str | Usage]:
+        """Yield the content of streamed chunks, then the usage"""
+        usage = None
+        for chunk in chunks:
+            # the last chunk carries the usage of the whole response and no choices
+            usage = getattr(chunk, "usage", None) or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+        if usage is not None:
+            yield Usage(usage.prompt_tokens, usage.completion_tokens)
+
+
+vocabulary = (
+    "the a of and to in that it with as for on was by at from this which "
+    "book chapter story world light river garden city winter memory voice "
+    "history science journey question answer idea method practice change "
+    "quiet bright ancient careful simple hidden open long early distant "
+    "begins follows reveals explains carries finds builds returns turns"
+).split()
+
+
+def roman(number: int) -> str:
+    """Return a number from 1 to 399 as a Roman numeral"""
+    numerals = [(100, "C"), (90, "XC"), (50, "L"), (40, "XL"), (10, "X")]
+    numerals += [(9, "IX"), (5, "V"), (4, "IV"), (1, "I")]
+    result = ""
+    for value, numeral in numerals:
+        while number >= value:
+            result += numeral
+            number -= value
+    return result
+
+
+class LocalProvider(Provider):
+    """A deterministic stand-in for a language model that needs no network.
+
+    The same messages always get the same response. Outline prompts get an
+    outline with the requested number of chapters, prompts asking for
+    "nothing else" get a short phrase and anything else gets paragraphs.
+    Set AUTOBOOK_LOCAL_WORDS to the number of words in a long response
+    (default 500) and AUTOBOOK_LOCAL_LATENCY to the seconds each response
+    takes (default 0).
+    """
+
+    name = "Local provider"
+
+    @property
+    def model(self) -> str:
+        """Name the settings too, so that cached responses are only reused with the same ones"""
+        return f"local-{self.words()}w-{self.latency():g}s"
+
+    def respond(self, messages: list[dict[str, str]]) -> str:
+        """Return the response to the messages"""
+        prompt = messages[-1]["content"]
+        seed = hashlib.sha256(repr(messages).encode()).digest()
+        generator = random.Random(seed)
+
+        def phrase(length: int) -> str:
+            return " ".join(generator.choice(vocabulary) for _ in range(length))
+
+        chapters = re.search(r"exactly (\d+) chapters", prompt)
+        if chapters:
+            lines = []
+            for number in range(1, min(int(chapters.group(1)), 100) + 1):
+                lines.append(f"{roman(number)}. {phrase(4).capitalize()}")
+                for section in range(1, generator.randint(1, 3) + 1):
+                    lines.append(f"{section}. {phrase(3).capitalize()}")
+            return "\n".join(lines)
+        if "nothing else" in prompt:
+            return phrase(generator.randint(3, 6)).title()
+        words = self.words()
+        paragraphs = []
+        while words > 0:
+            length = min(words, generator.randint(40, 120))
+            paragraphs.append(phrase(length).capitalize() + ".")
+            words -= length
+        return "\n".join(paragraphs)
+
+    def words(self) -> int:
+        return int(os.environ.get("AUTOBOOK_LOCAL_WORDS", "500"))
+
+    def latency(self) -> float:
+        return float(os.environ.get("AUTOBOOK_LOCAL_LATENCY", "0"))
+
+    def usage(self, messages: list[dict[str, str]], content: str) -> Usage:
+        return Usage(
+            scheduler.estimate_tokens(messages),
+            scheduler.estimate_text_tokens(content),
+        )
+
+    def complete(self, messages, logit_bias):
+        content = self.respond(messages)
+        time.sleep(self.latency())
+        return content, self.usage(messages, content)
+
+    def stream(self, messages, logit_bias):
+        content = self.respond(messages)
+        pieces = re.findall(r"\S+\s*", content)
+        # spread the latency over the pieces, like a real stream
+        delay = self.latency() / max(1, len(pieces))
+        for piece in pieces:
+            time.sleep(delay)
+            yield piece
+        yield self.usage(messages, content)
+
+
+providers: dict[str, type[Provider]] = {
+    "openai": OpenAIProvider,
+    "local": LocalProvider,
+}
+_instances: dict[str, Provider] = {}
+_lock = threading.Lock()
+
+
+def provider() -> Provider:
+    """Return the provider that prompts are sent to, creating it on first use.
+
+    Prompts are sent to OpenAI by default.
+    Set AUTOBOOK_PROVIDER in your environment to "local" to generate
+    placeholder text offline instead.
+    """
+    name = os.environ.get("AUTOBOOK_PROVIDER", "openai")
+    if name not in providers:
+        raise ValueError(
+            f"AUTOBOOK_PROVIDER must be one of {', '.join(providers)}, not {name}"
+        )
+    with _lock:
+        if name not in _instances:
+            _instances[name] = providers[name]()
+        return _instances[name]
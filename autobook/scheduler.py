@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+import contextvars
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from typing import Any, Callable, Iterator, TypeVar
+
+T = TypeVar("T")
+_quiet: contextvars.ContextVar[bool] = contextvars.ContextVar("quiet", default=False)
+
+
+class GenerationError(Exception):
+    """A request to the AI failed for good.
+
+    kind is the name of the last underlying error, attempts is how many times
+    the request was sent, and status is the HTTP status code if there was one.
+    """
+
+    def __init__(
+        self, message: str, kind: str, attempts: int, status: int | None = None
+    ):
+        super().__init__(message)
+        self.kind = kind
+        self.attempts = attempts
+        self.status = status
+
+
+class TokenBucket:
+    """Allow a number of units per minute, refilling continuously."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.available = per_minute
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(
+            self.capacity, self.available + (now - self.updated) * self.capacity / 60
+        )
+        self.updated = now
+
+    def acquire(self, amount: float = 1) -> float:
+        """Wait until the units are available and take them.
+
+        Requests larger than the whole bucket wait for a full bucket instead of forever.
+        Returns the number of seconds spent waiting.
+        """
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                self.refill()
+                if self.available >= amount:
+                    self.available -= amount
+                    return waited
+                wait = (amount - self.available) * 60 / self.capacity
+            time.sleep(wait)
+            waited += wait
+
+    def settle(self, difference: float) -> None:
+        """Correct an earlier estimate once the real amount is known."""
+        with self.lock:
+            self.refill()
+            self.available = min(self.capacity, self.available - difference)
+
+
+_buckets: dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def bucket(variable: str, default: float) -> TokenBucket:
+    """Return the shared bucket whose rate is set by an environment variable"""
+    per_minute = float(os.environ.get(variable, default))
+    with _buckets_lock:
+        if variable not in _buckets or _buckets[variable].capacity != per_minute:
+            _buckets[variable] = TokenBucket(per_minute)
+        return _buckets[variable]
+
+
+def request_bucket() -> TokenBucket:
+    """Requests per minute, set by AUTOBOOK_REQUESTS_PER_MINUTE (default 3500)."""
+    return bucket("AUTOBOOK_REQUESTS_PER_MINUTE", 3500)
+
+
+def token_bucket() -> TokenBucket:
+    """Tokens per minute, set by AUTOBOOK_TOKENS_PER_MINUTE (default 180000)."""
+    return bucket("AUTOBOOK_TOKENS_PER_MINUTE", 180000)
+
+
+def max_attempts() -> int:
+    """Return how many times a request may be sent, set by AUTOBOOK_MAX_ATTEMPTS (default 6)."""
+    return max(1, int(os.environ.get("AUTOBOOK_MAX_ATTEMPTS", "6")))
+
+
+def retry_after(error: Exception) -> float | None:
+    """Return the delay the server asked for, if any"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """Return a jittered exponential delay for a zero-based retry attempt"""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+@contextmanager
+def quiet() -> Iterator[None]:
+    """Keep requests made inside this block from printing their progress"""
+    token = _quiet.set(True)
+    try:
+        yield
+    finally:
+        _quiet.reset(token)
+
+
+def report(message: str) -> None:
+    """Print the progress of a request, unless it runs quietly"""
+    if not _quiet.get():
+        print(message)
+
+
+def schedule(
+    request: Callable[[], T],
+    retryable: tuple[type[Exception], ...],
+    fatal: tuple[type[Exception], ...] = (),
+    estimated_tokens: int = 0,
+    name: str = "API",
+) -> T:
+    """Send a request within the rate limits, retrying retryable errors with backoff
+
+    Errors in fatal or retryable are raised as a GenerationError once they
+    can't be retried; anything else is raised unchanged. name says where the
+    request went in the messages about failures.
+    """
+    attempts = max_attempts()
+    attempt = 0
+    while True:
+        attempt += 1
+        request_bucket().acquire()
+        token_bucket().acquire(estimated_tokens)
+        try:
+            return request()
+        except retryable + fatal as e:
+            kind = type(e).__name__
+            if not isinstance(e, retryable) or attempt >= attempts:
+                raise GenerationError(
+                    f"{name} request failed after {attempt} attempt(s): {kind}: {e}",
+                    kind,
+                    attempt,
+                    getattr(e, "status_code", None),
+                ) from e
+            delay = retry_after(e)
+            if delay is None:
+                delay = backoff_delay(attempt - 1)
+            report(f"{name} request failed ({kind}: {e}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+
+def record_usage(estimated_tokens: int, actual_tokens: int) -> None:
+    """Correct the token bucket once a response reports its real usage"""
+    token_bucket().settle(actual_tokens - estimated_tokens)
+
+
+_token_pattern = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_text_tokens(text: str) -> int:
+    """Estimate the tokens of a text without a tokenizer
+
+    Each word or punctuation mark is a token, and long words take one more
+    token per eight characters, which is close for English prose.
+    """
+    return sum(1 + len(piece) // 8 for piece in _token_pattern.findall(text))
+
+
+def estimate_tokens(messages: list[dict[str, Any]]) -> int:
+    """Estimate the prompt tokens of a list of messages, including their framing"""
+    return sum(4 + estimate_text_tokens(m["content"]) for m in messages) + 3
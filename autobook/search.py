@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+import atexit
+import os
+import re
+import sqlite3
+import threading
+from pathlib import Path
+
+from autobook.models import list_index
+from typing import Any, Iterable
+
+_connections: dict[str, sqlite3.Connection] = {}
+_lock = threading.RLock()
+# Paths of indexes that are out of date, for when that can't be saved in them
+_stale: set[str] = set()
+
+# Each part of a book that can be found is a row of passages, with the same
+# id as its row of parts. Chapters are parts with the position of the chapter.
+schema = """
+CREATE TABLE IF NOT EXISTS parts (
+    id INTEGER PRIMARY KEY,
+    book_id INTEGER NOT NULL,
+    field TEXT NOT NULL,
+    position INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS parts_book ON parts(book_id, field, position);
+CREATE VIRTUAL TABLE IF NOT EXISTS passages USING fts5(
+    heading, body, tokenize = 'porter unicode61'
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+# Fields other than chapters that are searched
+indexed_fields = ("title", "topic", "outline")
+# How much more a match in a title or chapter header counts than one in a body
+heading_weight = 4.0
+# SQLite before 3.35 doesn't know MATERIALIZED, and may then scan the matches twice
+materialized = "MATERIALIZED " if sqlite3.sqlite_version_info >= (3, 35) else ""
+
+
+def index_path() -> str:
+    """Return the path of the search index.
+
+    The index is stored in instance/db.search.sqlite by default, named after
+    AUTOBOOK_DB_FILENAME so that it goes with the books it indexes.
+    """
+    file_name = os.environ.get("AUTOBOOK_DB_FILENAME", "db")
+    return f"instance/{file_name}.search.sqlite"
+
+
+def connect() -> sqlite3.Connection:
+    """Return the process-wide connection, creating the schema on first use."""
+    path = index_path()
+    with _lock:
+        if path not in _connections:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.executescript(schema)
+            _connections[path] = connection
+        return _connections[path]
+
+
+def close_db() -> None:
+    """Close every open connection."""
+    with _lock:
+        for connection in _connections.values():
+            connection.close()
+        _connections.clear()
+
+
+def forget_connections() -> None:
+    """Drop the connections inherited from a parent process, without using them
+
+    A SQLite connection must not be used across a fork, so a forked child,
+    like an export worker, opens its own.
+    """
+    global _lock
+    _lock = threading.RLock()
+    _connections.clear()
+
+
+atexit.register(close_db)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=forget_connections)
+
+
+def field_text(field: str, value: Any) -> tuple[str, str]:
+    """Return the heading and body a field is searched by"""
+    text = str(value or "")
+    return ("", text) if field == "outline" else (text, "")
+
+
+def chapter_text(chapter: dict[str, Any]) -> tuple[str, str]:
+    """Return the heading and body a chapter is searched by"""
+    heading = "\n".join([chapter.get("header") or "", *(chapter.get("sections") or [])])
+    return heading, chapter.get("content") or ""
+
+
+def remove(
+    connection: sqlite3.Connection,
+    book_id: int,
+    field: str | None = None,
+    position: int | None = None,
+) -> None:
+    """Remove the parts of a book, only those of a field or a single chapter if given"""
+    condition = "book_id = ?"
+    parameters: list[Any] = [book_id]
+    if field is not None:
+        condition += " AND field = ?"
+        parameters.append(field)
+    if position is not None:
+        condition += " AND position = ?"
+        parameters.append(position)
+    connection.execute(
+        f"DELETE FROM passages WHERE rowid IN (SELECT id FROM parts WHERE {condition})",
+        parameters,
+    )
+    connection.execute(f"DELETE FROM parts WHERE {condition}", parameters)
+
+
+def add(
+    connection: sqlite3.Connection,
+    book_id: int,
+    field: str,
+    position: int,
+    text: tuple[str, str],
+) -> None:
+    """Add a part of a book"""
+    cursor = connection.execute(
+        "INSERT INTO parts (book_id, field, position) VALUES (?, ?, ?)",
+        (book_id, field, position),
+    )
+    connection.execute(
+        "INSERT INTO passages (rowid, heading, body) VALUES (?, ?, ?)",
+        (cursor.lastrowid, *text),
+    )
+
+
+def add_field(
+    connection: sqlite3.Connection, book_id: int, field: str, value: Any
+) -> None:
+    """Add a field of a book as it is stored, chapters and all"""
+    if field == "chapters":
+        for position, chapter in enumerate(value or []):
+            add(connection, book_id, field, position, chapter_text(chapter))
+    elif field in indexed_fields and value:
+        add(connection, book_id, field, 0, field_text(field, value))
+
+
+def index_book(book_id: int, book: dict[str, Any] | None) -> None:
+    """Replace every part of a book, or remove them if book is None"""
+    with _lock, connect() as connection:
+        remove(connection, book_id)
+        for field, value in (book or {}).items():
+            add_field(connection, book_id, field, value)
+
+
+def index_field(book_id: int, field: str, value: Any) -> None:
+    """Replace the parts of a field of a book, or remove them if value is None"""
+    if field not in indexed_fields and field != "chapters":
+        return
+    with _lock, connect() as connection:
+        remove(connection, book_id, field)
+        add_field(connection, book_id, field, value)
+
+
+def chapter_count(connection: sqlite3.Connection, book_id: int) -> int:
+    """Return how many chapters of a book are indexed"""
+    return connection.execute(
+        "SELECT COUNT(*) FROM parts WHERE book_id = ? AND field = 'chapters'",
+        (book_id,),
+    ).fetchone()[0]
+
+
+def shift(connection: sqlite3.Connection, book_id: int, start: int, by: int) -> None:
+    """Move the chapters of a book from position start onwards by a number of places"""
+    connection.execute(
+        "UPDATE parts SET position = position + ? "
+        "WHERE book_id = ? AND field = 'chapters' AND position >= ?",
+        (by, book_id, start),
+    )
+
+
+def index_chapter(book_id: int, index: int, chapter: dict[str, Any]) -> None:
+    """Replace a single chapter of a book"""
+    with _lock, connect() as connection:
+        position = index if index >= 0 else index + chapter_count(connection, book_id)
+        remove(connection, book_id, "chapters", position)
+        add(connection, book_id, "chapters", position, chapter_text(chapter))
+
+
+def insert_chapter(book_id: int, index: int, chapter: dict[str, Any]) -> None:
+    """Add a chapter of a book, moving later chapters up"""
+    with _lock, connect() as connection:
+        position = list_index(index, chapter_count(connection, book_id))
+        shift(connection, book_id, position, 1)
+        add(connection, book_id, "chapters", position, chapter_text(chapter))
+
+
+def move_chapter(book_id: int, source: int, destination: int) -> None:
+    """Move a chapter of a book, as if it were removed and then inserted"""
+    with _lock, connect() as connection:
+        length = chapter_count(connection, book_id)
+        if not length:
+            return
+        source %= length
+        destination = list_index(destination, length - 1)
+        connection.execute(
+            "UPDATE parts SET position = -1 "
+            "WHERE book_id = ? AND field = 'chapters' AND position = ?",
+            (book_id, source),
+        )
+        shift(connection, book_id, source + 1, -1)
+        shift(connection, book_id, destination, 1)
+        connection.execute(
+            "UPDATE parts SET position = ? "
+            "WHERE book_id = ? AND field = 'chapters' AND position = -1",
+            (destination, book_id),
+        )
+
+
+def delete_chapter(book_id: int, index: int) -> None:
+    """Remove a chapter of a book, moving later chapters down"""
+    with _lock, connect() as connection:
+        length = chapter_count(connection, book_id)
+        if not length:
+            return
+        position = index % length
+        remove(connection, book_id, "chapters", position)
+        shift(connection, book_id, position + 1, -1)
+
+
+def built() -> bool:
+    """Check if every book has been indexed, which happens before the first search"""
+    with _lock:
+        if index_path() in _stale:
+            return False
+        return (
+            connect().execute("SELECT 1 FROM meta WHERE key = 'built'").fetchone()
+            is not None
+        )
+
+
+def invalidate() -> None:
+    """Mark the index as out of date, so that the next search rebuilds it
+
+    If the index can't be written, it is only marked out of date in this process.
+    """
+    with _lock:
+        _stale.add(index_path())
+        try:
+            with connect() as connection:
+                connection.execute("DELETE FROM meta WHERE key = 'built'")
+        except sqlite3.Error:
+            pass
+
+
+def rebuild(books: Iterable[dict[str, Any]]) -> int:
+    """Index every book from scratch, given as stored with their book_id
+
+    Returns the number of books indexed.
+    """
+    count = 0
+    with _lock, connect() as connection:
+        connection.execute("DELETE FROM passages")
+        connection.execute("DELETE FROM parts")
+        for book in books:
+            for field, value in book.items():
+                add_field(connection, book["book_id"], field, value)
+            count += 1
+        connection.execute("INSERT OR REPLACE INTO meta VALUES ('built', '1')")
+    _stale.discard(index_path())
+    return count
+
+
+def match_expression(query: str) -> str | None:
+    """Turn a query into an FTS5 expression that matches passages with every word
+
+    Only letters and digits count, so no query is a syntax error. The last
+    word also matches words that start with it.
+    """
+    words = re.findall(r"\w+", query.lower())
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words) + "*"
+
+
+def search(query: str, limit: int = 10) -> list[dict[str, Any]]:
+    """Return the books that best match a query, best first.
+
+    Each result has the book_id, the field and chapter position of its best
+    matching part, that part's score (lower is better), a snippet of it with
+    the matched words in [brackets], and how many of its parts matched.
+    Snippets are only made for the books returned.
+    """
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    with _lock:
+        connection = connect()
+        # with MIN, SQLite takes the other columns from the best part of each book
+        rows = connection.execute(
+            f"WITH matched AS {materialized}("
+            "SELECT rowid AS id, bm25(passages, ?, 1.0) AS score "
+            "FROM passages WHERE passages MATCH ?"
+            ") SELECT book_id, field, position, id, MIN(score), COUNT(*) "
+            "FROM matched JOIN parts USING (id) "
+            "GROUP BY book_id ORDER BY MIN(score) LIMIT ?",
+            (heading_weight, expression, limit),
+        ).fetchall()
+        return [
+            {
+                "book_id": book_id,
+                "field": field,
+                "chapter": position if field == "chapters" else None,
+                "score": score,
+                "snippet": snippet(connection, expression, part_id),
+                "matches": matches,
+            }
+            for book_id, field, position, part_id, score, matches in rows
+        ]
+
+
+def snippet(connection: sqlite3.Connection, expression: str, part_id: int) -> str:
+    """Return the words around the best match of a part, on one line"""
+    (text,) = connection.execute(
+        "SELECT snippet(passages, -1, '[', ']', '...', 16) FROM passages "
+        "WHERE passages MATCH ? AND rowid = ?",
+        (expression, part_id),
+    ).fetchone()
+    return " ".join(text.split())
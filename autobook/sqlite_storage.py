@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+import atexit
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from autobook import blobs, tracing
+from autobook.completion import chapter_stats, missing_fields
+from autobook.models import list_index
+from typing import Any, Iterator, cast
+
+_connections: dict[str, sqlite3.Connection] = {}
+_lock = threading.RLock()
+
+schema = """
+CREATE TABLE IF NOT EXISTS books (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    fields TEXT NOT NULL,
+    has_chapters INTEGER NOT NULL DEFAULT 0,
+    finished INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS chapters (
+    book_id INTEGER NOT NULL REFERENCES books(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    header TEXT NOT NULL,
+    sections TEXT NOT NULL,
+    content TEXT NOT NULL,
+    extra TEXT NOT NULL DEFAULT '{}',
+    written INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (book_id, position)
+);
+CREATE INDEX IF NOT EXISTS books_finished ON books(finished);
+CREATE INDEX IF NOT EXISTS chapters_written ON chapters(book_id, written);
+"""
+
+# Each migration brings the schema up one version, tracked in PRAGMA user_version
+migrations = [
+    """
+    ALTER TABLE chapters ADD COLUMN words INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE books ADD COLUMN missing_fields TEXT NOT NULL DEFAULT '[]';
+    ALTER TABLE books ADD COLUMN chapter_count INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE books ADD COLUMN unwritten_chapters INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE books ADD COLUMN word_count INTEGER NOT NULL DEFAULT 0;
+    CREATE INDEX books_completion ON books(finished, unwritten_chapters);
+    CREATE INDEX chapters_completion ON chapters(book_id, written, words);
+    """,
+]
+
+chapter_columns = ("header", "sections", "content")
+insert_chapter_row = (
+    "INSERT {}INTO chapters "
+    "(book_id, position, header, sections, content, extra, written, words) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+def db_path() -> str:
+    """Return the path of the database file.
+
+    Database will be stored in instance/db.sqlite by default.
+    Set AUTOBOOK_DB_FILENAME in your environment to change the filename.
+    """
+    file_name = os.environ.get("AUTOBOOK_DB_FILENAME", "db")
+    return f"instance/{file_name}.sqlite"
+
+
+def connect() -> sqlite3.Connection:
+    """Return the process-wide connection, creating the schema on first use."""
+    path = db_path()
+    with _lock:
+        if path not in _connections:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            with tracing.span("storage.open", path=path):
+                # wait for other processes' writes rather than failing at once
+                connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+                connection.row_factory = sqlite3.Row
+                connection.execute("PRAGMA foreign_keys = ON")
+                connection.execute("PRAGMA journal_mode = WAL")
+                connection.executescript(schema)
+                migrate(connection)
+            _connections[path] = connection
+        return _connections[path]
+
+
+@contextmanager
+def writing() -> Iterator[sqlite3.Connection]:
+    """Return the connection inside a transaction that commits at the end of the block
+
+    The transaction takes the write lock as it begins, so that what it reads
+    can't be changed by another process before it writes.
+    """
+    with connect() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        yield connection
+
+
+def migrate(connection: sqlite3.Connection) -> None:
+    """Bring an existing database up to the current schema"""
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(migrations[version:], start=version + 1):
+        with connection:
+            for statement in migration.split(";"):
+                if statement.strip():
+                    connection.execute(statement)
+            if number == 1:
+                count_words(connection)
+            connection.execute(f"PRAGMA user_version = {number}")
+
+
+def count_words(connection: sqlite3.Connection) -> None:
+    """Fill in the word counts and completion records of every book"""
+    rows = connection.execute("SELECT book_id, position, content FROM chapters")
+    connection.executemany(
+        "UPDATE chapters SET words = ? WHERE book_id = ? AND position = ?",
+        [
+            (len(content.split()), book_id, position)
+            for book_id, position, content in rows.fetchall()
+        ],
+    )
+    for (book_id,) in connection.execute("SELECT id FROM books").fetchall():
+        update_completion(connection, book_id)
+
+
+def flush_db() -> None:
+    """Commit anything still pending. Writes are committed as they happen."""
+    with _lock:
+        for connection in _connections.values():
+            connection.commit()
+
+
+def close_db() -> None:
+    """Close every open connection."""
+    with _lock:
+        for connection in _connections.values():
+            connection.close()
+        _connections.clear()
+
+
+def forget_connections() -> None:
+    """Drop the connections inherited from a parent process, without using them
+
+    A SQLite connection must not be used across a fork, so a forked child,
+    like an export worker, opens its own.
+    """
+    global _lock
+    _lock = threading.RLock()
+    _connections.clear()
+
+
+atexit.register(close_db)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=forget_connections)
+
+
+def chapter_to_row(book_id: int, position: int, chapter: dict[str, Any]) -> tuple:
+    """Flatten a chapter into the columns of the chapters table"""
+    extra = {k: v for k, v in chapter.items() if k not in chapter_columns}
+    stats = chapter_stats(chapter)
+    return (
+        book_id,
+        position,
+        chapter["header"],
+        json.dumps(chapter["sections"]),
+        chapter["content"],
+        json.dumps(extra),
+        stats["written"],
+        stats["words"],
+    )
+
+
+def row_to_chapter(row: sqlite3.Row) -> dict[str, Any]:
+    """Rebuild a chapter from a row of the chapters table"""
+    chapter = {
+        "header": row["header"],
+        "sections": json.loads(row["sections"]),
+        "content": row["content"],
+    }
+    chapter.update(json.loads(row["extra"]))
+    return chapter
+
+
+def write_chapters(
+    connection: sqlite3.Connection, book_id: int, chapters: list[dict[str, Any]]
+) -> None:
+    """Replace every chapter row of a book"""
+    connection.execute("DELETE FROM chapters WHERE book_id = ?", (book_id,))
+    connection.executemany(
+        insert_chapter_row.format(""),
+        [chapter_to_row(book_id, i, chapter) for i, chapter in enumerate(chapters)],
+    )
+
+
+def write_book(
+    connection: sqlite3.Connection, book_id: int | None, fields: dict[str, Any]
+) -> int:
+    """Insert or replace a whole book, returning its id"""
+    fields = {k: v for k, v in fields.items() if k != "book_id"}
+    chapters = fields.pop("chapters", None)
+    cursor = connection.execute(
+        "INSERT OR REPLACE INTO books (id, fields, has_chapters) VALUES (?, ?, ?)",
+        (book_id, json.dumps(fields), chapters is not None),
+    )
+    if book_id is None:
+        # an insert always sets lastrowid
+        book_id = cast(int, cursor.lastrowid)
+    if chapters is not None:
+        write_chapters(connection, book_id, chapters)
+    update_completion(connection, book_id)
+    return book_id
+
+
+def read_book(connection: sqlite3.Connection, row: sqlite3.Row) -> dict[str, Any]:
+    """Rebuild a book from its row and its chapter rows"""
+    book = json.loads(row["fields"])
+    if row["has_chapters"]:
+        book["chapters"] = [
+            row_to_chapter(chapter)
+            for chapter in connection.execute(
+                "SELECT * FROM chapters WHERE book_id = ? ORDER BY position",
+                (row["id"],),
+            )
+        ]
+    book["book_id"] = row["id"]
+    return book
+
+
+def read_fields(connection: sqlite3.Connection, book_id: int) -> dict[str, Any]:
+    """Return a book's fields without its chapters, raising KeyError if it doesn't exist"""
+    row = connection.execute(
+        "SELECT fields FROM books WHERE id = ?", (book_id,)
+    ).fetchone()
+    if row is None:
+        raise KeyError(book_id)
+    return json.loads(row["fields"])
+
+
+def add_book(fields: dict) -> int:
+    """Add a book to the database."""
+    with _lock, writing() as connection:
+        return write_book(connection, None, fields)
+
+
+def all_books() -> list[dict[str, Any]]:
+    """Return every book in the database."""
+    with _lock:
+        connection = connect()
+        rows = connection.execute("SELECT * FROM books ORDER BY id").fetchall()
+        return [read_book(connection, row) for row in rows]
+
+
+def unfinished_books() -> list[dict[str, Any]]:
+    """Return the books that aren't ready for export."""
+    with _lock:
+        connection = connect()
+        rows = connection.execute(
+            "SELECT * FROM books WHERE finished = 0 ORDER BY id"
+        ).fetchall()
+        return [read_book(connection, row) for row in rows]
+
+
+def book_summaries(
+    fields: list[str],
+    ready: bool | None = None,
+    max_chapters_left: int | None = None,
+) -> list[dict[str, Any]]:
+    """Return the requested fields of every book matching a completion state.
+
+    Fields can also name entries of the completion record, like word_count.
+    Chapters are only read if they are requested.
+    """
+    conditions: list[str] = []
+    parameters: list[Any] = []
+    if ready is not None:
+        conditions.append("finished = ?")
+        parameters.append(ready)
+    if max_chapters_left is not None:
+        conditions.append("unwritten_chapters BETWEEN 1 AND ?")
+        parameters.append(max_chapters_left)
+    query = "SELECT * FROM books"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    with _lock:
+        connection = connect()
+        summaries = []
+        for row in connection.execute(query + " ORDER BY id", parameters).fetchall():
+            book = (
+                read_book(connection, row)
+                if "chapters" in fields
+                else json.loads(row["fields"])
+            )
+            book.update(
+                {k: v for k, v in row_to_completion(row).items() if k not in book}
+            )
+            summaries.append(
+                dict({field: book.get(field) for field in fields}, book_id=row["id"])
+            )
+        return summaries
+
+
+def row_to_completion(row: sqlite3.Row) -> dict[str, Any]:
+    """Return the completion totals stored in a row of the books table"""
+    return {
+        "missing_fields": json.loads(row["missing_fields"]),
+        "chapter_count": row["chapter_count"],
+        "unwritten_chapters": row["unwritten_chapters"],
+        "word_count": row["word_count"],
+        "ready": bool(row["finished"]),
+    }
+
+
+def get_completion(book_id: int) -> dict[str, Any] | None:
+    """Return the completion record of a book."""
+    with _lock:
+        connection = connect()
+        row = connection.execute(
+            "SELECT * FROM books WHERE id = ?", (book_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        chapters = [
+            {"words": words, "written": bool(written)}
+            for words, written in connection.execute(
+                "SELECT words, written FROM chapters WHERE book_id = ? ORDER BY position",
+                (book_id,),
+            )
+        ]
+        return dict(row_to_completion(row), chapters=chapters)
+
+
+def get_book(book_id: int) -> dict[str, Any] | None:
+    """Get a single book from the database."""
+    with _lock:
+        connection = connect()
+        row = connection.execute(
+            "SELECT * FROM books WHERE id = ?", (book_id,)
+        ).fetchone()
+        return read_book(connection, row) if row is not None else None
+
+
+def update_book(book_id: int, field: str, content: Any) -> None:
+    """Update a field of a book in the database."""
+    with _lock, writing() as connection:
+        fields = read_fields(connection, book_id)
+        if field == "chapters":
+            write_chapters(connection, book_id, content or [])
+            connection.execute(
+                "UPDATE books SET has_chapters = 1 WHERE id = ?", (book_id,)
+            )
+        else:
+            fields[field] = content
+            connection.execute(
+                "UPDATE books SET fields = ? WHERE id = ?",
+                (json.dumps(fields), book_id),
+            )
+        update_completion(connection, book_id)
+
+
+def update_completion(connection: sqlite3.Connection, book_id: int) -> None:
+    """Recalculate the completion record of a book after one of its fields changed
+
+    Chapter totals come from the chapters_completion index, without reading any content.
+    """
+    row = connection.execute(
+        "SELECT fields, has_chapters FROM books WHERE id = ?", (book_id,)
+    ).fetchone()
+    count, unwritten, words = connection.execute(
+        "SELECT COUNT(*), COALESCE(SUM(written = 0), 0), COALESCE(SUM(words), 0) "
+        "FROM chapters WHERE book_id = ?",
+        (book_id,),
+    ).fetchone()
+    fields = json.loads(row["fields"])
+    missing = [field for field in missing_fields(fields) if field != "chapters"]
+    if not row["has_chapters"] or not count:
+        missing.append("chapters")
+    connection.execute(
+        "UPDATE books SET finished = ?, missing_fields = ?, chapter_count = ?, "
+        "unwritten_chapters = ?, word_count = ? WHERE id = ?",
+        (
+            not missing and not unwritten,
+            json.dumps(missing),
+            count,
+            unwritten,
+            words,
+            book_id,
+        ),
+    )
+
+
+def shift_chapters(
+    connection: sqlite3.Connection, book_id: int, start: int, end: int, by: int
+) -> None:
+    """Move the chapters with positions from start up to end by a number of places
+
+    Positions go through negative values first so they never collide midway.
+    """
+    connection.execute(
+        "UPDATE chapters SET position = -(position + ?) - 1 "
+        "WHERE book_id = ? AND position >= ? AND position < ?",
+        (by, book_id, start, end),
+    )
+    connection.execute(
+        "UPDATE chapters SET position = -position - 1 "
+        "WHERE book_id = ? AND position < 0",
+        (book_id,),
+    )
+
+
+def count_chapters(connection: sqlite3.Connection, book_id: int) -> int:
+    """Return how many chapters a book has, raising KeyError if it doesn't exist"""
+    read_fields(connection, book_id)
+    return connection.execute(
+        "SELECT COUNT(*) FROM chapters WHERE book_id = ?", (book_id,)
+    ).fetchone()[0]
+
+
+def update_chapter(book_id: int, index: int, chapter: dict[str, Any]) -> None:
+    """Replace a single chapter of a book."""
+    with _lock, writing() as connection:
+        length = count_chapters(connection, book_id)
+        if not -length <= index < length:
+            raise IndexError(index)
+        connection.execute(
+            insert_chapter_row.format("OR REPLACE "),
+            chapter_to_row(book_id, list_index(index, length), chapter),
+        )
+        update_completion(connection, book_id)
+
+
+def insert_chapter(book_id: int, index: int, chapter: dict[str, Any]) -> None:
+    """Insert a chapter into a book, pushing later chapters up."""
+    with _lock, writing() as connection:
+        length = count_chapters(connection, book_id)
+        position = list_index(index, length)
+        shift_chapters(connection, book_id, position, length, 1)
+        connection.execute(
+            insert_chapter_row.format(""),
+            chapter_to_row(book_id, position, chapter),
+        )
+        connection.execute("UPDATE books SET has_chapters = 1 WHERE id = ?", (book_id,))
+        update_completion(connection, book_id)
+
+
+def move_chapter(book_id: int, source: int, destination: int) -> None:
+    """Move a chapter of a book, as if it were removed and then inserted."""
+    with _lock, writing() as connection:
+        length = count_chapters(connection, book_id)
+        if not -length <= source < length:
+            raise IndexError(source)
+        source = list_index(source, length)
+        destination = list_index(destination, length - 1)
+        connection.execute(
+            "UPDATE chapters SET position = ? WHERE book_id = ? AND position = ?",
+            (length, book_id, source),
+        )
+        if source < destination:
+            shift_chapters(connection, book_id, source + 1, destination + 1, -1)
+        else:
+            shift_chapters(connection, book_id, destination, source, 1)
+        connection.execute(
+            "UPDATE chapters SET position = ? WHERE book_id = ? AND position = ?",
+            (destination, book_id, length),
+        )
+
+
+def delete_chapter(book_id: int, index: int) -> None:
+    """Remove a single chapter from a book."""
+    with _lock, writing() as connection:
+        length = count_chapters(connection, book_id)
+        if not -length <= index < length:
+            raise IndexError(index)
+        position = list_index(index, length)
+        connection.execute(
+            "DELETE FROM chapters WHERE book_id = ? AND position = ?",
+            (book_id, position),
+        )
+        shift_chapters(connection, book_id, position + 1, length, -1)
+        update_completion(connection, book_id)
+
+
+def delete_book(book_id: int) -> None:
+    """Remove a book from the database."""
+    with _lock, writing() as connection:
+        if connection.execute("DELETE FROM books WHERE id = ?", (book_id,)).rowcount:
+            return
+    raise KeyError(book_id)
+
+
+def delete_book_field(book_id: int, field: str) -> None:
+    """Remove a field from a book in the database."""
+    with _lock, writing() as connection:
+        fields = read_fields(connection, book_id)
+        if field == "chapters":
+            connection.execute("DELETE FROM chapters WHERE book_id = ?", (book_id,))
+            connection.execute(
+                "UPDATE books SET has_chapters = 0 WHERE id = ?", (book_id,)
+            )
+        elif field in fields:
+            del fields[field]
+            connection.execute(
+                "UPDATE books SET fields = ? WHERE id = ?",
+                (json.dumps(fields), book_id),
+            )
+        update_completion(connection, book_id)
+
+
+def migrate_from_json(json_path: str) -> int:
+    """Copy every book from a TinyDB JSON file, keeping their ids.
+
+    Chapter content kept in blobs next to the file is copied too.
+
+    Books that already exist in the SQLite database are replaced,
+    so running the migration again is safe. Returns the number of books copied.
+    """
+    with open(json_path, "r") as file:
+        books = json.load(file).get("book", {})
+    directory = blobs.directory_for(json_path)
+    with _lock, writing() as connection:
+        for book_id, fields in books.items():
+            if fields.get("chapters"):
+                chapters = [blobs.unpack(directory, c) for c in fields["chapters"]]
+                fields = dict(fields, chapters=chapters)
+            connection.execute("DELETE FROM chapters WHERE book_id = ?", (book_id,))
+            write_book(connection, int(book_id), fields)
+    return len(books)
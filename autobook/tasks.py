@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+import atexit
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+_connections: dict[str, sqlite3.Connection] = {}
+_lock = threading.RLock()
+
+schema = """
+CREATE TABLE IF NOT EXISTS tasks (
+    key TEXT PRIMARY KEY,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    claimed_at REAL,
+    result TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks(state);
+"""
+
+
+class TaskBusy(Exception):
+    """Another live worker holds the task."""
+
+
+class TaskFailed(Exception):
+    """The task failed too many times to try again."""
+
+
+def queue_path() -> str:
+    """Return the path of the task queue.
+
+    Tasks are stored in instance/db.tasks.sqlite by default, named after
+    AUTOBOOK_DB_FILENAME so that they go with the books they write.
+    """
+    file_name = os.environ.get("AUTOBOOK_DB_FILENAME", "db")
+    return f"instance/{file_name}.tasks.sqlite"
+
+
+def connect() -> sqlite3.Connection:
+    """Return the process-wide connection, creating the schema on first use."""
+    path = queue_path()
+    with _lock:
+        if path not in _connections:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            # autocommit, so that every statement is atomic on its own
+            connection = sqlite3.connect(
+                path, check_same_thread=False, isolation_level=None, timeout=30
+            )
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.executescript(schema)
+            _connections[path] = connection
+        return _connections[path]
+
+
+def close_db() -> None:
+    """Close every open connection."""
+    with _lock:
+        for connection in _connections.values():
+            connection.close()
+        _connections.clear()
+
+
+def forget_connections() -> None:
+    """Drop the connections inherited from a parent process, without using them
+
+    A SQLite connection must not be used across a fork, so a forked child,
+    like an export worker, opens its own.
+    """
+    global _lock
+    _lock = threading.RLock()
+    _connections.clear()
+
+
+atexit.register(close_db)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=forget_connections)
+
+
+def max_attempts() -> int:
+    """Return how many times a task may be started, set by AUTOBOOK_TASK_ATTEMPTS (default 3)."""
+    return max(1, int(os.environ.get("AUTOBOOK_TASK_ATTEMPTS", "3")))
+
+
+def lease() -> float:
+    """Return the seconds after which a running task is presumed abandoned.
+
+    Set AUTOBOOK_TASK_LEASE in your environment to change it (default 3600).
+    Tasks claimed by a process on this machine that no longer runs are
+    taken over straight away.
+    """
+    return float(os.environ.get("AUTOBOOK_TASK_LEASE", "3600"))
+
+
+def worker_id() -> str:
+    """Return the name this process claims tasks under"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def abandoned(owner: str | None, claimed_at: float | None) -> bool:
+    """Check if the worker that claimed a task has gone away"""
+    if owner is None or claimed_at is None:
+        return True
+    if time.time() - claimed_at > lease():
+        return True
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except (PermissionError, ValueError):
+        return False
+    return zombie(int(pid))
+
+
+def zombie(pid: int) -> bool:
+    """Check if a process has exited but not been reaped yet, where /proc tells"""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as file:
+            # the state follows the parenthesized command name
+            return file.read().rpartition(")")[2].split()[0] == "Z"
+    except (OSError, IndexError):
+        return False
+
+
+def decode(row: sqlite3.Row) -> dict[str, Any]:
+    """Return a task row as a dict, with its result decoded."""
+    task = dict(row)
+    task["result"] = json.loads(task["result"]) if task["result"] else None
+    return task
+
+
+def get(key: str) -> dict[str, Any] | None:
+    """Return a task, with its result decoded."""
+    with _lock:
+        row = connect().execute("SELECT * FROM tasks WHERE key = ?", (key,)).fetchone()
+    return decode(row) if row is not None else None
+
+
+def all_tasks(prefix: str = "") -> list[dict[str, Any]]:
+    """Return every task whose key starts with prefix, in key order."""
+    with _lock:
+        rows = connect().execute(
+            "SELECT * FROM tasks WHERE substr(key, 1, ?) = ? ORDER BY key",
+            (len(prefix), prefix),
+        )
+        return [decode(row) for row in rows.fetchall()]
+
+
+def claim(key: str) -> bool:
+    """Atomically take a task that is pending, failed or abandoned.
+
+    Returns False if the task is done, out of attempts, or held by a live worker.
+    """
+    now = time.time()
+    with _lock:
+        connection = connect()
+        connection.execute(
+            "INSERT OR IGNORE INTO tasks (key, updated_at) VALUES (?, ?)", (key, now)
+        )
+        task = get(key)
+        if task is None or task["state"] == "done":
+            return False
+        if task["state"] == "running" and not abandoned(
+            task["owner"], task["claimed_at"]
+        ):
+            return False
+        if task["attempts"] >= max_attempts():
+            return False
+        # only one worker can move the task on from the state it just read
+        claimed = connection.execute(
+            "UPDATE tasks SET state = 'running', attempts = attempts + 1, "
+            "owner = ?, claimed_at = ?, updated_at = ? "
+            "WHERE key = ? AND state = ? AND attempts = ?",
+            (worker_id(), now, now, key, task["state"], task["attempts"]),
+        )
+        return claimed.rowcount == 1
+
+
+def complete(key: str, result: Any) -> None:
+    """Record the result of a task."""
+    with _lock:
+        connect().execute(
+            "UPDATE tasks SET state = 'done', result = ?, error = NULL, updated_at = ? "
+            "WHERE key = ?",
+            (json.dumps(result), time.time(), key),
+        )
+
+
+def fail(key: str, error: str) -> None:
+    """Record that a task failed, so it can be claimed again."""
+    with _lock:
+        connect().execute(
+            "UPDATE tasks SET state = 'failed', error = ?, updated_at = ? WHERE key = ?",
+            (error, time.time(), key),
+        )
+
+
+def run(key: str, compute: Callable[[], T]) -> T:
+    """Return the result of a task, computing it only if no earlier run finished it.
+
+    The result must be JSON serializable. If compute raises, the task is
+    marked failed and the error propagates; the next run tries again, up to
+    AUTOBOOK_TASK_ATTEMPTS times. Raises TaskBusy if another live worker
+    holds the task, and TaskFailed if it is out of attempts.
+    """
+    if not claim(key):
+        task = get(key)
+        if task is not None and task["state"] == "done":
+            return task["result"]
+        if task is not None and task["state"] == "running":
+            raise TaskBusy(f"{key} is being worked on by {task['owner']}")
+        error = task["error"] if task is not None else None
+        raise TaskFailed(f"{key} failed {max_attempts()} times, last with {error}")
+    try:
+        result = compute()
+    except BaseException as e:
+        fail(key, f"{type(e).__name__}: {e}")
+        raise
+    complete(key, result)
+    return result
+
+
+def reset(prefix: str) -> int:
+    """Make failed tasks under prefix available again, returning how many there were."""
+    with _lock:
+        cursor = connect().execute(
+            "UPDATE tasks SET state = 'pending', attempts = 0, updated_at = ? "
+            "WHERE substr(key, 1, ?) = ? AND state = 'failed'",
+            (time.time(), len(prefix), prefix),
+        )
+        return cursor.rowcount
@@ -8,8 +8,8 @@ def chapters_to_text(chapters, title, author, file_path="output/book.txt"):
         f.write(author or "")
         f.write("\n\n\n\n")
         for chapter in chapters:
-            f.write(chapter["header"] or "")
+            f.write(chapter.header or "")
             f.write("\n\n")
-            f.write(chapter["content"] or "")
+            f.write(chapter.content or "")
             f.write("\n\n\n\n")
     print("Book exported to {}.".format(file_path))
@@ -0,0 +1,553 @@
+#!/usr/bin/env python3
+import atexit
+import json
+import os
+import threading
+from contextlib import contextmanager
+from copy import deepcopy
+from functools import wraps
+from pathlib import Path
+from tinydb import TinyDB, where
+from tinydb.middlewares import CachingMiddleware
+from tinydb.operations import delete
+from tinydb.storages import Storage
+from tinydb.table import Document, Table
+
+from autobook import blobs, locks, tracing
+from autobook.completion import (
+    chapter_stats,
+    completion_record,
+    matches,
+    with_chapters,
+    with_fields,
+)
+from typing import Any, Callable, Iterator, cast
+
+_databases: dict[str, TinyDB] = {}
+# How each open database file looked when this process last read or wrote it
+_stamps: dict[str, tuple[int, int, int] | None] = {}
+_lock = threading.RLock()
+# How many transactions this process is inside of, guarded by _lock
+_depth = 0
+# The database file whose lock this process holds, if any
+_held: str | None = None
+# By database file, the blobs that changes stopped referring to, until swept
+_released: dict[str, set[str]] = {}
+
+
+# Fields too large to keep in the metadata index
+large_fields = ("chapters", "outline")
+# Bump whenever the shape of index entries changes, so old indexes are rebuilt
+index_version = 2
+
+
+def db_path(suffix: str = "") -> str:
+    """Return the path of the database file, or of a file that goes with it.
+
+    Database will be stored in instance/db.json by default.
+    Set AUTOBOOK_DB_FILENAME in your environment to change the filename.
+    """
+    file_name = os.environ.get("AUTOBOOK_DB_FILENAME", "db")
+    return f"instance/{file_name}{suffix}.json"
+
+
+class AtomicJSONStorage(Storage):
+    """Store a database in a JSON file that is replaced on every write, never changed in place
+
+    Other processes reading the file see either the old or the new database,
+    and can tell it changed because it is a new file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def read(self) -> dict[str, Any] | None:
+        try:
+            with open(self.path, "r") as file:
+                text = file.read()
+        except FileNotFoundError:
+            return None
+        return json.loads(text) if text.strip() else None
+
+    def write(self, data: dict[str, Any]) -> None:
+        locks.atomic_write(self.path, json.dumps(data).encode("utf-8"))
+
+
+def write_cache() -> int:
+    """Return how many writes to hold in memory before writing them to the file.
+
+    Set AUTOBOOK_DB_WRITE_CACHE in your environment to change it (default 1).
+    """
+    return int(os.environ.get("AUTOBOOK_DB_WRITE_CACHE", "1"))
+
+
+def stamp(path: str) -> tuple[int, int, int] | None:
+    """Return what tells versions of a file apart, or None if it doesn't exist"""
+    try:
+        info = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (info.st_ino, info.st_mtime_ns, info.st_size)
+
+
+def open_db(suffix: str = "") -> TinyDB:
+    """Return a process-wide database handle, opening it on first use.
+
+    The file is parsed once and reads are served from memory afterwards,
+    until another process replaces it. Writes go straight to the file unless
+    AUTOBOOK_DB_WRITE_CACHE is set to the number of writes to hold in memory
+    before flushing.
+    """
+    path = db_path(suffix)
+    with _lock:
+        if path not in _databases:
+            Path("instance").mkdir(parents=True, exist_ok=True)
+            with tracing.span("storage.open", path=path):
+                _stamps[path] = stamp(path)
+                db = TinyDB(path, storage=CachingMiddleware(AtomicJSONStorage))
+                middleware(db).WRITE_CACHE_SIZE = write_cache()
+                # parse the file now rather than on the first read
+                db.storage.read()
+            _databases[path] = db
+        return _databases[path]
+
+
+def middleware(db: TinyDB) -> CachingMiddleware:
+    """Return the middleware that holds a database's writes in memory"""
+    return cast(CachingMiddleware, db.storage)
+
+
+def refresh() -> None:
+    """Drop the handles of database files another process has replaced since we saw them
+
+    They are opened again, and parsed again, when next used.
+    """
+    with _lock:
+        for path in list(_databases):
+            if stamp(path) != _stamps.get(path):
+                _databases.pop(path).close()
+
+
+@contextmanager
+def transaction() -> Iterator[None]:
+    """Hold the database for an operation, keeping out other threads and processes.
+
+    The first transaction of a process locks instance/db.json.lock and reads
+    any changes other processes made, and the last one unlocks it. Nested
+    transactions share the lock. While AUTOBOOK_DB_WRITE_CACHE holds writes
+    in memory, the lock is kept until they are flushed, so that no other
+    process writes in between.
+    """
+    global _depth, _held
+    with _lock:
+        if _held is None:
+            _held = db_path()
+            locks.acquire(_held)
+            refresh()
+        _depth += 1
+        try:
+            yield
+        finally:
+            _depth -= 1
+            if _depth == 0 and write_cache() <= 1:
+                unlock()
+
+
+def unlock() -> None:
+    """Remember how the database files look after our changes and release their lock"""
+    global _held
+    with _lock:
+        if _held is None:
+            return
+        for path in _databases:
+            _stamps[path] = stamp(path)
+        locks.release(_held)
+        _held = None
+
+
+def flush_db() -> None:
+    """Write any changes held in memory to the database files."""
+    with _lock:
+        sweep_blobs()
+        for db in _databases.values():
+            middleware(db).flush()
+        if _depth == 0:
+            unlock()
+
+
+def close_db() -> None:
+    """Flush and close every open database handle."""
+    with _lock:
+        sweep_blobs()
+        for db in _databases.values():
+            db.close()
+        _databases.clear()
+        if _depth == 0:
+            unlock()
+
+
+def forget_databases() -> None:
+    """Drop the database handles inherited from a parent process, without using them
+
+    A forked child, like an export worker, opens its own and doesn't take
+    itself to hold a lock of its parent's. See locks.forget_locks.
+    """
+    global _lock, _depth, _held
+    _lock = threading.RLock()
+    _databases.clear()
+    _stamps.clear()
+    _released.clear()
+    _depth = 0
+    _held = None
+
+
+atexit.register(close_db)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=forget_databases)
+
+
+def blob_dir() -> str:
+    """Return the directory holding the content of written chapters.
+
+    Chapter content is compressed into blobs named by its hash, next to the
+    database file, so the file itself only holds small fields and parses quickly.
+    """
+    return blobs.directory_for(db_path())
+
+
+def pack_chapters(chapters: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Move the content of chapters into blobs, for storing"""
+    return [blobs.pack(blob_dir(), chapter) for chapter in chapters]
+
+
+def unpack_book(book: dict[str, Any]) -> dict[str, Any]:
+    """Return a stored book with the content of its chapters loaded from blobs"""
+    if not book.get("chapters"):
+        return book
+    chapters = [blobs.unpack(blob_dir(), chapter) for chapter in book["chapters"]]
+    return dict(book, chapters=chapters)
+
+
+def release_blobs(keys: set[str]) -> None:
+    """Leave the blobs in keys for sweep_blobs to delete, if nothing refers to them then"""
+    if keys:
+        with _lock:
+            _released.setdefault(db_path(), set()).update(keys)
+
+
+def sweep_blobs() -> None:
+    """Delete the released blobs that no chapter refers to anymore.
+
+    Finding out reads every book, so it is done once when the database is
+    flushed or closed rather than on every change that releases a blob.
+    """
+    if not _released.get(db_path()):
+        return
+    with transaction():
+        keys = _released.pop(db_path(), set())
+        for book in open_db().table("book").all():
+            keys = keys - blobs.keys(book.get("chapters"))
+        for key in keys:
+            blobs.remove(blob_dir(), key)
+
+
+def detach(document: Document) -> Document:
+    """Copy a document so callers can't change the cached data without saving it
+
+    The content of its chapters is loaded from their blobs.
+    """
+    return Document(deepcopy(unpack_book(dict(document))), document.doc_id)
+
+
+def init_db(table_name: str) -> Callable:
+    """Decorator function to give a function a table of the database.
+
+    See open_db for where the database is stored.
+
+    Use as follows:
+
+    @init_db(table_name)
+    def your_function(db, your_parameter):
+        db.operation()
+
+    your_function(your_argument)
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with transaction():
+                table = open_db().table(table_name)
+                return func(table, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def summarize(
+    book: dict[str, Any], record: dict[str, Any] | None = None
+) -> dict[str, Any]:
+    """Return the entry of a book in the metadata index"""
+    summary = {k: v for k, v in book.items() if k not in large_fields}
+    if record is None:
+        record = completion_record(unpack_book(book))
+    summary["_completion"] = record
+    return summary
+
+
+def index_table() -> Table:
+    """Return the metadata index, which holds the small fields of every book.
+
+    It lives in its own file next to the database, so listing books doesn't
+    load any chapters. Each entry also holds the book's completion record.
+    The index is rebuilt from the books if it is missing or out of date.
+    """
+    with transaction():
+        index_db = open_db(".index")
+        meta = index_db.table("meta").get(doc_id=1)
+        if meta is None or meta["version"] != index_version:
+            rebuild_index()
+        return index_db.table("book_index")
+
+
+def rebuild_index() -> None:
+    """Recreate the metadata index from the books."""
+    with transaction():
+        index_db = open_db(".index")
+        index = index_db.table("book_index")
+        index.truncate()
+        index.insert_multiple(
+            Document(summarize(book), book.doc_id)
+            for book in open_db().table("book").all()
+        )
+        index_db.table("meta").truncate()
+        index_db.table("meta").insert({"version": index_version})
+
+
+def write_index_entry(book_id: int, entry: dict[str, Any] | None) -> None:
+    """Replace the index entry of a book, or remove it if entry is None"""
+    index = index_table()
+    if entry is None:
+        if index.contains(doc_id=book_id):
+            index.remove(doc_ids=[book_id])
+    elif index.contains(doc_id=book_id):
+
+        def replace(old_entry):
+            old_entry.clear()
+            old_entry.update(entry)
+
+        index.update(replace, doc_ids=[book_id])
+    else:
+        index.insert(Document(entry, book_id))
+
+
+def reindex(book_id: int) -> None:
+    """Bring the index entry of a book up to date, counting every chapter again"""
+    book = open_db().table("book").get(doc_id=book_id)
+    write_index_entry(book_id, summarize(book) if book is not None else None)
+
+
+def reindex_fields(book_id: int) -> None:
+    """Update the index entry of a book after fields other than chapters changed"""
+    entry = index_table().get(doc_id=book_id)
+    book = open_db().table("book").get(doc_id=book_id)
+    if entry is None or book is None:
+        return reindex(book_id)
+    write_index_entry(book_id, summarize(book, with_fields(entry["_completion"], book)))
+
+
+def reindex_chapters(book_id: int, change: Callable[[list[dict]], Any]) -> None:
+    """Update the index entry of a book by changing only its chapter stats"""
+    entry = index_table().get(doc_id=book_id)
+    if entry is None:
+        return reindex(book_id)
+    changed = dict(entry, _completion=with_chapters(entry["_completion"], change))
+    write_index_entry(book_id, changed)
+
+
+def project(book: dict[str, Any], book_id: int, fields: list[str]) -> dict[str, Any]:
+    """Return only the requested fields of a book, plus its id"""
+    return dict({field: book.get(field) for field in fields}, book_id=book_id)
+
+
+def book_summaries(
+    fields: list[str],
+    ready: bool | None = None,
+    max_chapters_left: int | None = None,
+) -> list[dict[str, Any]]:
+    """Return the requested fields of every book matching a completion state.
+
+    Fields can also name entries of the completion record, like word_count.
+    """
+    with transaction():
+        entries = [
+            (entry.doc_id, dict(entry, **entry["_completion"]))
+            for entry in index_table().all()
+            if matches(entry["_completion"], ready, max_chapters_left)
+        ]
+        if any(field in large_fields for field in fields):
+            books = {
+                book.doc_id: unpack_book(book) for book in open_db().table("book").all()
+            }
+            entries = [
+                (book_id, dict(entry, **books[book_id])) for book_id, entry in entries
+            ]
+        return [project(entry, book_id, fields) for book_id, entry in entries]
+
+
+def get_completion(book_id: int) -> dict[str, Any] | None:
+    """Return the completion record of a book."""
+    with transaction():
+        entry = index_table().get(doc_id=book_id)
+        return deepcopy(entry["_completion"]) if entry is not None else None
+
+
+@init_db("book")
+def add_book(db, fields: dict) -> int:
+    """Add a book to the database."""
+    fields = deepcopy(fields)
+    if fields.get("chapters"):
+        fields["chapters"] = pack_chapters(fields["chapters"])
+    book_id = db.insert(fields)
+    reindex(book_id)
+    return book_id
+
+
+def add_doc_ids(books: list[Document]) -> list[Document]:
+    """Add doc ids to a list of books"""
+    books = [detach(book) for book in books]
+    for book in books:
+        book["book_id"] = book.doc_id
+    return books
+
+
+@init_db("book")
+def all_books(db) -> list[Document]:
+    """Return every book in the database."""
+    return add_doc_ids(db.all())
+
+
+@init_db("book")
+def unfinished_books(db) -> list[Document]:
+    """Return the books that aren't ready for export."""
+    book_ids = [
+        entry.doc_id
+        for entry in index_table().search(where("_completion")["ready"] == False)
+    ]
+    return add_doc_ids(db.get(doc_ids=book_ids)) if book_ids else []
+
+
+@init_db("book")
+def get_book(db, book_id: int) -> Document | None:
+    """Get a single book from the database."""
+    book = db.get(doc_id=book_id)
+    if book is not None:
+        book = detach(book)
+        book["book_id"] = book_id
+    return book
+
+
+@init_db("book")
+def update_book(db, book_id: int, field: str, content: Any) -> None:
+    """Update a field of a book in the database."""
+    content = deepcopy(content)
+    if field == "chapters":
+        old_keys = blobs.keys((db.get(doc_id=book_id) or {}).get("chapters"))
+        content = pack_chapters(content or [])
+    db.update({field: content}, doc_ids=[book_id])
+    if field == "chapters":
+        reindex(book_id)
+        release_blobs(old_keys)
+    else:
+        reindex_fields(book_id)
+
+
+@init_db("book")
+def delete_book(db, book_id: int) -> None:
+    """Remove a book from the database."""
+    if not db.contains(doc_id=book_id):
+        raise KeyError(book_id)
+    old_keys = blobs.keys(db.get(doc_id=book_id).get("chapters"))
+    db.remove(doc_ids=[book_id])
+    reindex(book_id)
+    release_blobs(old_keys)
+
+
+@init_db("book")
+def delete_book_field(db, book_id: int, field: str) -> None:
+    """Remove a book from the database."""
+    book = db.get(doc_id=book_id)
+    if field in book:
+        db.update(delete(field), doc_ids=[book_id])
+        if field == "chapters":
+            reindex(book_id)
+            release_blobs(blobs.keys(book["chapters"]))
+        else:
+            reindex_fields(book_id)
+
+
+def change_chapters(change: Callable[[list], None]) -> Callable:
+    """Return an operation that changes the chapters of a book in place"""
+
+    def transform(doc):
+        change(doc.setdefault("chapters", []))
+
+    return transform
+
+
+@init_db("book")
+def update_chapter(db, book_id: int, index: int, chapter: dict[str, Any]) -> None:
+    """Replace a single chapter of a book."""
+    packed = blobs.pack(blob_dir(), deepcopy(chapter))
+    old_keys: set[str] = set()
+
+    def replace(chapters):
+        old_keys.update(blobs.keys(chapters[index : index + 1]))
+        chapters[index] = packed
+
+    def replace_stats(stats):
+        stats[index] = chapter_stats(chapter)
+
+    db.update(change_chapters(replace), doc_ids=[book_id])
+    reindex_chapters(book_id, replace_stats)
+    release_blobs(old_keys)
+
+
+@init_db("book")
+def insert_chapter(db, book_id: int, index: int, chapter: dict[str, Any]) -> None:
+    """Insert a chapter into a book, pushing later chapters up."""
+    packed = blobs.pack(blob_dir(), deepcopy(chapter))
+    db.update(
+        change_chapters(lambda chapters: chapters.insert(index, packed)),
+        doc_ids=[book_id],
+    )
+    reindex_chapters(book_id, lambda stats: stats.insert(index, chapter_stats(chapter)))
+
+
+@init_db("book")
+def move_chapter(db, book_id: int, source: int, destination: int) -> None:
+    """Move a chapter of a book, as if it were removed and then inserted."""
+
+    def move(items):
+        items.insert(destination, items.pop(source))
+
+    db.update(change_chapters(move), doc_ids=[book_id])
+    reindex_chapters(book_id, move)
+
+
+@init_db("book")
+def delete_chapter(db, book_id: int, index: int) -> None:
+    """Remove a single chapter from a book."""
+    old_keys: set[str] = set()
+
+    def remove(items):
+        old_keys.update(blobs.keys(items[index : index + 1]))
+        items.pop(index)
+
+    def remove_stats(stats):
+        stats.pop(index)
+
+    db.update(change_chapters(remove), doc_ids=[book_id])
+    reindex_chapters(book_id, remove_stats)
+    release_blobs(old_keys)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+import contextvars
+import datetime
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from pathlib import Path
+
+from typing import Any, Callable, ContextManager, Iterator, TypeVar
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# Finished spans while tracing is on, or None while it is off
+_spans: list[dict[str, Any]] | None = None
+_started = 0.0
+_ids = itertools.count(1)
+_lock = threading.Lock()
+# The span that new spans in this context are children of
+_parent: contextvars.ContextVar[int | None] = contextvars.ContextVar(
+    "span", default=None
+)
+_off = nullcontext()
+
+
+def profiling() -> bool:
+    """Check whether the command should be profiled.
+
+    Set AUTOBOOK_PROFILE in your environment to turn profiling on.
+    """
+    return bool(os.environ.get("AUTOBOOK_PROFILE"))
+
+
+def trace_path() -> Path:
+    """Return the file that spans are written to.
+
+    Each run writes to instance/traces/<date and time>.jsonl by default.
+    Set AUTOBOOK_TRACE_FILE in your environment to use another file.
+    """
+    if "AUTOBOOK_TRACE_FILE" in os.environ:
+        return Path(os.environ["AUTOBOOK_TRACE_FILE"])
+    now = datetime.datetime.now().strftime("%Y-%m-%dT%H-%M-%S")
+    return Path(f"instance/traces/{now}.jsonl")
+
+
+def start() -> None:
+    """Start collecting spans, dropping any collected before"""
+    global _spans, _started
+    with _lock:
+        _spans = []
+        _started = time.perf_counter()
+
+
+def stop() -> list[dict[str, Any]]:
+    """Stop collecting spans and return them, in the order they finished"""
+    global _spans
+    with _lock:
+        spans, _spans = _spans or [], None
+    return spans
+
+
+def _add(
+    span_id: int, parent: int | None, name: str, start: float, attributes: dict
+) -> None:
+    """Add a span that ends now to the collected spans"""
+    end = time.perf_counter()
+    with _lock:
+        if _spans is None:
+            return
+        _spans.append(
+            {
+                "id": span_id,
+                "parent": parent,
+                "name": name,
+                "start": start - _started,
+                "duration": end - start,
+                "thread": threading.current_thread().name,
+                **attributes,
+            }
+        )
+
+
+def record(
+    name: str, start: float, parent: int | None = None, **attributes: Any
+) -> None:
+    """Add a span that ends now and started at start, as given by time.perf_counter
+
+    Use this for work that can't be wrapped in a with block, like the body of
+    a generator between its yields. See current for finding its parent.
+    """
+    _add(next(_ids), parent, name, start, attributes)
+
+
+@contextmanager
+def _span(name: str, attributes: dict[str, Any]) -> Iterator[None]:
+    span_id = next(_ids)
+    parent = _parent.get()
+    token = _parent.set(span_id)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _parent.reset(token)
+        _add(span_id, parent, name, start, attributes)
+
+
+def span(name: str, **attributes: Any) -> ContextManager[None]:
+    """Time a block of code, when tracing is on
+
+    Use as `with tracing.span("export.epub.write", path=file_path):`.
+    Spans started inside the block are its children, including those in
+    threads that run in a copy of its context. While tracing is off, this
+    returns a shared context manager that does nothing.
+    """
+    if _spans is None:
+        return _off
+    return _span(name, attributes)
+
+
+def traced(name: str) -> Callable[[F], F]:
+    """Decorator function to time every call of a function as a span
+
+    Only a check of whether tracing is on is added while it is off.
+    """
+
+    def decorator(func: F) -> F:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _spans is None:
+                return func(*args, **kwargs)
+            with _span(name, {}):
+                return func(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+def current() -> int | None:
+    """Return the id of the span that new spans in this context are children of"""
+    return _parent.get()
+
+
+def write(spans: list[dict[str, Any]], path: Path) -> None:
+    """Write spans to a JSON lines file, one span per line"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as file:
+        for span in spans:
+            file.write(json.dumps(span) + "\n")
+
+
+def summarize(spans: list[dict[str, Any]]) -> dict[str, dict[str, Any]]:
+    """Add up spans by name, sorted by the time spent in them
+
+    Each summary has the number of calls, their total and longest duration,
+    and their self time: the total minus the time of their children, which
+    tells where the time actually went.
+    """
+    children: dict[int, float] = {}
+    for span in spans:
+        if span["parent"] is not None:
+            children[span["parent"]] = (
+                children.get(span["parent"], 0.0) + span["duration"]
+            )
+    summary: dict[str, dict[str, Any]] = {}
+    for span in spans:
+        phase = summary.setdefault(
+            span["name"], {"calls": 0, "total": 0.0, "self": 0.0, "max": 0.0}
+        )
+        phase["calls"] += 1
+        phase["total"] += span["duration"]
+        # children in other threads can add up to more than their parent took
+        phase["self"] += max(0.0, span["duration"] - children.get(span["id"], 0.0))
+        phase["max"] = max(phase["max"], span["duration"])
+    return dict(sorted(summary.items(), key=lambda item: -item[1]["self"]))
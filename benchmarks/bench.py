@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import datetime
+import gc
+import io
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from benchmarks.synthetic import make_book, make_chapters
+
+from typing import Any, Callable
+
+# Chapter counts and words per chapter of the synthetic books used for exports and generation
+book_shapes = [(3, 1000), (3, 20000), (20, 1000), (20, 20000)]
+generation_shapes = [(3, 1000), (10, 1000), (20, 1000), (3, 5000)]
+library_sizes = [10, 1000, 10000]
+
+# Read-only commands, which should start without loading anything they don't use
+startup_commands = [
+    ["list"],
+    ["list", "1"],
+    ["list", "--ready"],
+    ["search", "river"],
+    ["stats"],
+]
+# Seconds that importing everything a read-only command needs may take
+startup_target = 0.1
+# Modules that only generating, editing or exporting books need
+heavy_modules = ("openai", "ebooklib", "lxml", "PIL", "dominate", "texteditor")
+
+
+def measure(
+    results: list[dict[str, Any]],
+    name: str,
+    params: dict[str, Any],
+    run: Callable[[], Any],
+    repeat: int,
+) -> dict[str, Any]:
+    """Time repeated runs of a function and add the result to results
+
+    Anything the function prints is discarded, so it doesn't count towards the time.
+    """
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+    result: dict[str, Any] = {
+        "name": name,
+        "params": params,
+        "runs": repeat,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+        "max": max(times),
+    }
+    results.append(result)
+    print(
+        f"{name:<36}{json.dumps(params):<48}"
+        f"median {result['median'] * 1000:>10.3f} ms"
+    )
+    return result
+
+
+def measure_memory(
+    results: list[dict[str, Any]],
+    name: str,
+    params: dict[str, Any],
+    load: Callable[[], Any],
+) -> dict[str, Any]:
+    """Measure the memory held by what a function returns and add it to results
+
+    The function runs once beforehand, so that caches it fills don't count.
+    """
+    load()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        loaded = load()
+        held = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del loaded
+    result = {"name": name, "params": params, "bytes": held}
+    results.append(result)
+    print(f"{name:<36}{json.dumps(params):<48}held {held / 1024:>13.1f} KiB")
+    return result
+
+
+def bench_outline(results: list[dict[str, Any]], repeat: int) -> None:
+    """Parse and print outlines of several lengths"""
+    from autobook import book
+
+    for count in (3, 20, 100):
+        chapters = make_chapters(count, 0)
+        outline = book.chapters_to_string(chapters)
+        params = {"chapters": count}
+        measure(
+            results,
+            "book.string_to_chapters",
+            params,
+            lambda: book.string_to_chapters(outline),
+            repeat * 20,
+        )
+        measure(
+            results,
+            "book.chapters_to_string",
+            params,
+            lambda: book.chapters_to_string(chapters),
+            repeat * 20,
+        )
+
+
+def populate(size: int) -> list[int]:
+    """Fill the database with size small books, returning their ids"""
+    from autobook import database as db
+
+    # hold every write in memory while filling, then go back to writing through
+    os.environ["AUTOBOOK_DB_WRITE_CACHE"] = str(size + 1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        book_ids = [
+            db.add_book(make_book(3, 200, seed) if seed % 2 else make_book(3, 0, seed))
+            for seed in range(size)
+        ]
+    db.close_db()
+    os.environ["AUTOBOOK_DB_WRITE_CACHE"] = "1"
+    return book_ids
+
+
+def bench_database(
+    results: list[dict[str, Any]],
+    memory: list[dict[str, Any]],
+    repeat: int,
+    sizes: list[int],
+    backends: list[str],
+) -> None:
+    """Time every database operation at several library sizes
+
+    Also measures the memory taken by loading the whole library, both as the
+    dicts the backend stores and as Book and Chapter models.
+    """
+    from autobook import database as db
+
+    chapter = make_chapters(1, 200, seed=1)[0]
+    for backend in backends:
+        os.environ["AUTOBOOK_DB_BACKEND"] = backend
+        for size in sizes:
+            os.environ["AUTOBOOK_DB_FILENAME"] = f"bench_{backend}_{size}"
+            params = {"backend": backend, "books": size}
+            book_ids: list[int] = []
+            measure(
+                results,
+                "database.populate",
+                params,
+                lambda: book_ids.extend(populate(size)),
+                1,
+            )
+            # the first read after populating parses the whole database file
+            measure(
+                results, "database.open", params, lambda: db.get_book(book_ids[0]), 1
+            )
+            measure_memory(
+                memory,
+                "database.all_books.memory",
+                dict(params, model="dict"),
+                db.backend().all_books,
+            )
+            measure_memory(
+                memory,
+                "database.all_books.memory",
+                dict(params, model="Book"),
+                db.all_books,
+            )
+            # each operation goes through the books in turn, so none runs out of chapters
+            targets = itertools.cycle(book_ids)
+            pick = lambda: next(targets)
+            # slow operations rewrite the whole library, so large sizes run fewer times
+            runs = repeat if size < 10000 else max(1, repeat // 2)
+            operations: list[tuple[str, Callable[[], Any]]] = [
+                ("database.get_book", lambda: db.get_book(pick())),
+                ("database.get_completion", lambda: db.get_completion(pick())),
+                ("database.book_summaries", lambda: db.book_summaries(["topic"])),
+                (
+                    "database.unfinished_book_summaries",
+                    lambda: db.unfinished_book_summaries(["topic"]),
+                ),
+                ("database.all_books", db.all_books),
+                ("database.unfinished_books", db.unfinished_books),
+                ("database.add_book", lambda: db.add_book(make_book(3, 200))),
+                ("database.update_book", lambda: db.update_book(pick(), "topic", "x")),
+                (
+                    "database.update_chapter",
+                    lambda: db.update_chapter(pick(), 1, chapter),
+                ),
+                (
+                    "database.insert_chapter",
+                    lambda: db.insert_chapter(pick(), 1, chapter),
+                ),
+                ("database.move_chapter", lambda: db.move_chapter(pick(), 0, 2)),
+                ("database.delete_chapter", lambda: db.delete_chapter(pick(), 0)),
+                (
+                    "database.delete_book_field",
+                    lambda: db.delete_book_field(pick(), "num_chapters"),
+                ),
+            ]
+            for name, operation in operations:
+                measure(results, name, params, operation, runs)
+            doomed = iter(book_ids)
+            measure(
+                results,
+                "database.delete_book",
+                params,
+                lambda: db.delete_book(next(doomed)),
+                runs,
+            )
+            db.close_db()
+
+
+def bench_search(results: list[dict[str, Any]], repeat: int, sizes: list[int]) -> None:
+    """Time building the search index, keeping it up to date and searching it
+
+    Synthetic chapters share a small vocabulary, so common words match every
+    chapter of every book, which is the slowest kind of search.
+    """
+    from autobook import database as db
+
+    os.environ["AUTOBOOK_DB_BACKEND"] = "sqlite"
+    chapter = make_chapters(1, 200, seed=1)[0]
+    for size in sizes:
+        os.environ["AUTOBOOK_DB_FILENAME"] = f"bench_search_{size}"
+        params = {"books": size}
+        book_ids = populate(size)
+        measure(results, "search.rebuild", params, db.rebuild_search_index, 1)
+        queries = [
+            ("search.common_word", "river"),
+            ("search.common_words", "ancient river garden"),
+            ("search.rare_word", f"topic {size // 2}"),
+            ("search.prefix", "hist"),
+        ]
+        for name, query in queries:
+            measure(results, name, params, lambda: db.search_books(query), repeat * 4)
+        targets = itertools.cycle(book_ids)
+        measure(
+            results,
+            "search.update_chapter",
+            params,
+            lambda: db.update_chapter(next(targets), 1, chapter),
+            repeat,
+        )
+        db.close_db()
+
+
+def bench_export(results: list[dict[str, Any]], repeat: int) -> None:
+    """Export synthetic books to epub, again when unchanged, and to text"""
+    from autobook import cache, epub, text
+
+    css = epub.load_css(Path(__file__).parent.parent / "styles" / "wendy.css")
+    for chapters, words in book_shapes:
+        book = make_book(chapters, words)
+        params = {"chapters": chapters, "words": words}
+        export = lambda file_path: epub.chapters_to_book(
+            book["chapters"], book["title"], book["author"], css, file_path=file_path
+        )
+        os.environ["AUTOBOOK_NO_CACHE"] = "1"
+        measure(
+            results,
+            "epub.chapters_to_book.cold",
+            params,
+            lambda: export("cold.epub"),
+            repeat,
+        )
+        del os.environ["AUTOBOOK_NO_CACHE"]
+        cache.clear("exports")
+        with contextlib.redirect_stdout(io.StringIO()):
+            export("exported.epub")
+        measure(
+            results,
+            "epub.chapters_to_book.unchanged",
+            params,
+            lambda: export("exported.epub"),
+            repeat,
+        )
+        measure(
+            results,
+            "text.chapters_to_text",
+            params,
+            lambda: text.chapters_to_text(
+                book["chapters"], book["title"], book["author"], file_path="book.txt"
+            ),
+            repeat,
+        )
+
+
+def generate_book(chapters: int) -> None:
+    """Create and fully write a book the way the nonfiction sequence does"""
+    from autobook import main
+
+    fields: dict[str, Any] = {"topic": main.random_topic(), "num_chapters": chapters}
+    for field in ("title", "author"):
+        fields[field] = main.generate_field_content(fields, field)
+    outline = main.generate_field_content(fields, "outline")
+    fields["chapters"] = main.outline_to_chapters(outline)
+    book_id = main.create_book(fields)
+    format_args = {
+        index: dict(
+            fields,
+            book_id=book_id,
+            outline=outline,
+            chapter=chapter.header,
+        )
+        for index, chapter in enumerate(fields["chapters"])
+    }
+    main.generate_chapter_contents(book_id, fields["chapters"], format_args)
+
+
+def bench_generation(results: list[dict[str, Any]], repeat: int) -> None:
+    """Generate whole books with the local provider and no response cache"""
+    os.environ["AUTOBOOK_PROVIDER"] = "local"
+    os.environ["AUTOBOOK_NO_CACHE"] = "1"
+    os.environ["AUTOBOOK_DB_BACKEND"] = "tinydb"
+    os.environ["AUTOBOOK_DB_FILENAME"] = "bench_generation"
+    for chapters, words in generation_shapes:
+        os.environ["AUTOBOOK_LOCAL_WORDS"] = str(words)
+        measure(
+            results,
+            "main.generate_book",
+            {"chapters": chapters, "words": words},
+            lambda: generate_book(chapters),
+            repeat,
+        )
+    del os.environ["AUTOBOOK_NO_CACHE"]
+
+
+def startup(command: list[str]) -> tuple[float, set[str]]:
+    """Run a CLI command with python -X importtime in the current directory
+
+    Returns the seconds spent importing and the names of every module imported.
+    """
+    root = Path(__file__).parent.parent
+    env = dict(os.environ, PYTHONPATH=str(root))
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "cli.cli", *command],
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+    seconds = 0.0
+    modules = set()
+    # each line reads "import time: <self us> | <cumulative us> | <indented name>"
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        modules.add(name.strip())
+        if not name.startswith("  "):
+            # only top level imports, since their time includes everything they import
+            seconds += int(cumulative) / 1e6
+    return seconds, modules
+
+
+def bench_startup(results: list[dict[str, Any]], repeat: int) -> None:
+    """Time starting read-only commands, and check what they import"""
+    os.environ["AUTOBOOK_DB_BACKEND"] = "tinydb"
+    os.environ["AUTOBOOK_DB_FILENAME"] = "bench_startup"
+    populate(10)
+    for command in startup_commands:
+        params = {"command": " ".join(command)}
+        import_times = []
+        result = measure(
+            results,
+            "cli.startup",
+            params,
+            lambda: import_times.append(startup(command)),
+            repeat,
+        )
+        imported = set().union(*(modules for _, modules in import_times))
+        heavy = sorted(
+            module
+            for module in heavy_modules
+            if any(name.split(".")[0] == module for name in imported)
+        )
+        result["imports"] = min(seconds for seconds, _ in import_times)
+        result["target"] = startup_target
+        result["heavy_modules"] = heavy
+        if result["imports"] > startup_target or heavy:
+            print(
+                f"{'':<36}imports took {result['imports'] * 1000:.1f} ms "
+                f"(target {startup_target * 1000:.0f} ms), "
+                f"loading {', '.join(heavy) or 'nothing heavy'}"
+            )
+
+
+def git_revision() -> str | None:
+    """Return the commit the benchmarks ran on, if this is a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(
+    output: str, suites: list[str], repeat: int, sizes: list[int], backends: list[str]
+) -> dict[str, Any]:
+    """Run the chosen suites in a scratch directory and write the results as JSON"""
+    output_path = Path(output).resolve()
+    report: dict[str, Any] = {
+        "started": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": [],
+        "memory": [],
+    }
+    previous = dict(os.environ)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="autobook-bench-") as scratch:
+        # databases, caches and metrics all live under the scratch directory
+        os.chdir(scratch)
+        os.environ["AUTOBOOK_CACHE_DIR"] = os.path.join(scratch, "cache")
+        os.environ["AUTOBOOK_METRICS_FILE"] = os.path.join(scratch, "metrics.jsonl")
+        os.environ.setdefault("OPENAI_API_KEY", "unused")
+        try:
+            if "outline" in suites:
+                bench_outline(report["results"], repeat)
+            if "database" in suites:
+                bench_database(
+                    report["results"], report["memory"], repeat, sizes, backends
+                )
+            if "search" in suites:
+                bench_search(report["results"], repeat, sizes)
+            if "export" in suites:
+                bench_export(report["results"], repeat)
+            if "generation" in suites:
+                bench_generation(report["results"], repeat)
+            if "startup" in suites:
+                bench_startup(report["results"], repeat)
+        finally:
+            from autobook import database
+
+            database.close_db()
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(previous)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {output_path}.")
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the book pipeline on synthetic books, without calling the API."
+    )
+    suites = ["outline", "database", "search", "export", "generation", "startup"]
+    parser.add_argument(
+        "suites",
+        help=f"Suites to run (default: all of {', '.join(suites)}).",
+        nargs="*",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="JSON file for the results (default: instance/benchmarks/<date and time>.json).",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        help="Number of times each benchmark runs (default: 5).",
+        type=int,
+        default=5,
+    )
+    parser.add_argument(
+        "-s",
+        "--sizes",
+        help="Library sizes for the database and search suites (default: 10 1000 10000).",
+        type=int,
+        nargs="+",
+        default=library_sizes,
+    )
+    parser.add_argument(
+        "-b",
+        "--backends",
+        help="Storage backends for the database suite (default: tinydb sqlite).",
+        nargs="+",
+        choices=["tinydb", "sqlite"],
+        default=["tinydb", "sqlite"],
+    )
+    args = parser.parse_args()
+    unknown = set(args.suites) - set(suites)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+    output = args.output or datetime.datetime.now().strftime(
+        "instance/benchmarks/%Y-%m-%dT%H-%M-%S.json"
+    )
+    run(output, args.suites or suites, args.repeat, args.sizes, args.backends)
+
+
+if __name__ == "__main__":
+    main()
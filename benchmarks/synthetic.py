@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+import random
+
+from autobook.models import Chapter
+from autobook.providers import roman, vocabulary
+
+from typing import Any
+
+
+def make_text(generator: random.Random, words: int) -> str:
+    """Return paragraphs of roughly 80 words that add up to the number of words"""
+    paragraphs = []
+    while words > 0:
+        length = min(words, 80)
+        paragraphs.append(
+            " ".join(generator.choice(vocabulary) for _ in range(length)) + "."
+        )
+        words -= length
+    return "\n".join(paragraphs)
+
+
+def make_chapters(count: int, words: int, seed: int = 0) -> list[Chapter]:
+    """Return count chapters with two sections and the given words of content each"""
+    generator = random.Random(seed)
+    return [
+        Chapter(
+            f"{roman(number)}. Chapter {number}",
+            [f"1. Section {number}a", f"2. Section {number}b"],
+            make_text(generator, words) if words else "",
+        )
+        for number in range(1, count + 1)
+    ]
+
+
+def make_book(chapters: int, words: int, seed: int = 0) -> dict[str, Any]:
+    """Return the fields of a finished book with synthetic chapters"""
+    return {
+        "topic": f"Synthetic topic {seed}",
+        "title": f"Synthetic Book {seed}",
+        "author": "A. Writer",
+        "num_chapters": chapters,
+        "chapters": make_chapters(chapters, words, seed),
+    }
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+import contextvars
+import hashlib
+import io
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+
+from autobook.main import (
+    book_completion,
+    create_book,
+    generate_field_content,
+    list_book,
+    random_topic,
+    reset_tasks,
+    run_task,
+    save_to_book,
+)
+from autobook.tasks import TaskBusy, TaskFailed
+from cli.chapter_menu import write_unwritten_chapters
+from cli.generators import field_orders, required_fields
+from cli.utils import has
+
+from typing import Any, Callable
+
+_print_lock = threading.Lock()
+# The log file of the job running in the current context, if any
+_job_log: contextvars.ContextVar[Any] = contextvars.ContextVar("job_log", default=None)
+# The task queue key of the job running in the current context
+_job_key: contextvars.ContextVar[str] = contextvars.ContextVar("job_key")
+# Topics of the jobs so far, which jobs without a topic are asked to avoid
+_topics: list[str] = []
+_topic_lock = threading.Lock()
+# How many of the latest topics a new topic is asked to be unlike
+topics_to_avoid = 20
+
+# Fields a job may set, as in the create command
+job_fields = ("topic", "num_chapters", "title", "author", "category")
+
+
+class JobOutput(io.TextIOBase):
+    """Send printed text to the log of the current job, or else to a stream"""
+
+    def __init__(self, stream: Any):
+        self.stream = stream
+
+    def write(self, text: str) -> int:
+        return (_job_log.get() or self.stream).write(text)
+
+    def flush(self) -> None:
+        (_job_log.get() or self.stream).flush()
+
+
+def report(job_number: int, message: str) -> None:
+    """Print a status line for a job, even while its output goes to its log"""
+    with _print_lock:
+        stream = sys.stdout.stream if isinstance(sys.stdout, JobOutput) else sys.stdout
+        print(f"[job {job_number}] {message}", file=stream, flush=True)
+
+
+def accept_field(fields: dict[str, Any], field: str, **rest) -> None:
+    """Generate a basic field if it is missing and accept it"""
+    if not has(fields, field):
+        fields[field] = run_task(
+            f"{_job_key.get()}/{field}", generate_field_content, fields, field
+        )
+    save_to_book(fields["book_id"], field, fields[field])
+
+
+def accept_bounded_field(
+    fields: dict[str, Any], field: str, bounds: tuple[int, int], **rest
+) -> None:
+    """Bring a numerical field within its bounds and accept it"""
+    allowed = range(*bounds)
+    fields[field] = min(max(int(fields[field]), allowed.start), allowed.stop - 1)
+    save_to_book(fields["book_id"], field, fields[field])
+
+
+def accept_recipe(
+    fields: dict[str, Any], field: str, recipe: Callable, save_to: str, **rest
+) -> None:
+    """Apply a recipe and accept the field it fills in"""
+    recipe(fields, save_to)
+    save_to_book(fields["book_id"], save_to, fields[save_to])
+
+
+def accept_menu(fields: dict[str, Any], field: str, **rest) -> None:
+    """Write every unwritten chapter instead of opening the menu"""
+    write_unwritten_chapters(fields, field, _job_key.get())
+
+
+# Headless counterparts of cli.generators.generators
+acceptors: dict[str, Callable] = {
+    "string": accept_field,
+    "bound": accept_bounded_field,
+    "recipe": accept_recipe,
+    "menu": accept_menu,
+}
+
+
+def parse_job(line: str) -> dict[str, Any]:
+    """Read the fields of a book from a line of the job file"""
+    job = json.loads(line)
+    if not isinstance(job, dict):
+        raise ValueError("a job must be a JSON object")
+    unknown = set(job) - set(job_fields)
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+    if "num_chapters" not in job:
+        raise ValueError("num_chapters is required")
+    job.setdefault("category", "nonfiction")
+    if job["category"] not in field_orders:
+        raise ValueError(f"unknown category: {job['category']}")
+    return job
+
+
+def job_key(jobs_file: Path, job_number: int, line: str) -> str:
+    """Name a job in the task queue by its file, line and content"""
+    digest = hashlib.sha256(line.strip().encode()).hexdigest()[:12]
+    return f"batch:{jobs_file.resolve()}:{job_number}:{digest}"
+
+
+def job_topic(fields: dict[str, Any]) -> str:
+    """Return the topic of a job, generating one unlike those of the jobs before it
+
+    Topics are generated one job at a time, so that each job sees the topics
+    of all the jobs before it.
+    """
+    with _topic_lock:
+        if not has(fields, "topic"):
+            taken = _topics[-topics_to_avoid:]
+            fields["topic"] = run_task(f"{_job_key.get()}/topic", random_topic, taken)
+        _topics.append(fields["topic"])
+    return fields["topic"]
+
+
+def write_book(job_number: int, job: dict[str, Any], status: dict[str, Any]) -> int:
+    """Create a book from a job and go through every step of its category, accepting everything
+
+    Every step that asks the AI for something is a task, so running the job
+    again after an interruption continues where it stopped.
+    """
+    fields = dict(job)
+    job_topic(fields)
+    book_id = status["book_id"] = run_task(
+        f"{_job_key.get()}/create", create_book, fields
+    )
+    report(job_number, f"book {book_id}: {fields['topic']}")
+    fields = list_book(book_id)
+    for field in field_orders[fields["category"]]:
+        acceptors[required_fields[field]["type"]](
+            fields, field, **required_fields[field]
+        )
+        report(job_number, f"{field} done")
+    completion = book_completion(book_id) or {}
+    if not completion.get("ready"):
+        raise RuntimeError(
+            f"{completion.get('unwritten_chapters', 0)} chapter(s) could not be written"
+        )
+    return book_id
+
+
+def run_job(key: str, job_number: int, line: str, log_path: Path) -> dict[str, Any]:
+    """Run one job with its output going to log_path, returning its status"""
+    status: dict[str, Any] = {"job": job_number, "book_id": None, "log": str(log_path)}
+    start = time.perf_counter()
+    with open(log_path, "a") as log:
+        log_token = _job_log.set(log)
+        key_token = _job_key.set(key)
+        try:
+            run_steps(key, job_number, line, status)
+        finally:
+            _job_key.reset(key_token)
+            _job_log.reset(log_token)
+    status["seconds"] = time.perf_counter() - start
+    report(job_number, describe(status))
+    return status
+
+
+def run_steps(key: str, job_number: int, line: str, status: dict[str, Any]) -> None:
+    """Write the book of a job, recording how it went in status"""
+    try:
+        report(job_number, "started")
+        job = parse_job(line)
+        status["book_id"] = run_task(key, write_book, job_number, job, status)
+        completion = book_completion(status["book_id"]) or {}
+        status["words"] = completion.get("word_count", 0)
+        status["state"] = "finished"
+    except TaskBusy:
+        status["state"] = "busy"
+    except TaskFailed as e:
+        status["state"] = "failed"
+        status["error"] = f"{e}; use --retry to try again"
+    except Exception as e:
+        status["state"] = "failed"
+        status["error"] = f"{type(e).__name__}: {e}"
+
+
+def describe(status: dict[str, Any]) -> str:
+    """Summarize the status of a job in one line"""
+    seconds = f"in {status['seconds']:.1f}s"
+    if status["state"] == "failed":
+        book = f" (book {status['book_id']})" if status["book_id"] else ""
+        return f"failed{book} {seconds}: {status['error']}"
+    if status["state"] == "busy":
+        return "skipped, another process is running it"
+    return f"book {status['book_id']} finished with {status['words']} words {seconds}"
+
+
+def batch_command(args: dict[str, Any]) -> None:
+    """Create a book for every line of a job file without asking anything
+
+    Jobs are numbered by their line in the file. Everything a job prints goes
+    to instance/batch/<job file name>.<job number>.log, leaving only status lines.
+    Progress is kept in the task queue, so running the same file again skips
+    finished jobs and resumes interrupted ones without asking the AI twice.
+    """
+    jobs_file = Path(args["jobs_file"])
+    try:
+        with open(jobs_file, "r") as file:
+            jobs = [(n, line) for n, line in enumerate(file, 1) if line.strip()]
+    except FileNotFoundError:
+        print(f"No job file found at {jobs_file}.")
+        return
+    if args["retry"]:
+        count = reset_tasks(f"batch:{jobs_file.resolve()}:")
+        print(f"Retrying {count} failed step(s).")
+    log_dir = Path("instance/batch")
+    log_dir.mkdir(parents=True, exist_ok=True)
+    _topics.clear()
+    print(f"Running {len(jobs)} job(s), logging to {log_dir}...")
+    start = time.perf_counter()
+    sys.stdout = JobOutput(sys.stdout)
+    try:
+        with ThreadPoolExecutor(max_workers=args["workers"] or 2) as executor:
+            # each job runs in a copy of this context, so that its spans nest
+            # under the command
+            runs = [
+                executor.submit(
+                    contextvars.copy_context().run,
+                    partial(
+                        run_job,
+                        job_key(jobs_file, number, line),
+                        number,
+                        line,
+                        log_dir / f"{jobs_file.stem}.{number}.log",
+                    ),
+                )
+                for number, line in jobs
+            ]
+            statuses = [run.result() for run in runs]
+    finally:
+        sys.stdout = sys.stdout.stream
+    finished = sum(status["state"] == "finished" for status in statuses)
+    print(
+        f"\n{finished} of {len(statuses)} job(s) finished "
+        f"in {time.perf_counter() - start:.1f}s."
+    )
+    for status in statuses:
+        if status["state"] != "finished":
+            print(f"job {status['job']}: {describe(status)}")
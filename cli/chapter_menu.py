@@ -1,5 +1,20 @@
 #!/usr/bin/env python3
-from autobook.main import chapters_to_outline, generate_field_content
+from autobook.main import (
+    chapters_to_outline,
+    delete_chapter as delete_saved_chapter,
+    generate_chapter_contents,
+    generate_field_content,
+    insert_chapter,
+    lookahead,
+    move_chapter as move_saved_chapter,
+    save_chapter,
+    stream_chapter_content,
+    streaming,
+    ahead_content,
+    take_written_ahead,
+    write_ahead,
+)
+from autobook.models import Chapter
 from cli.inputs import make_options, process_action
 from cli.menus import (
     C_options,
@@ -17,6 +32,7 @@ def make_chapter_format_args(
 ) -> dict[str, Any]:
     """Expand fields with additional entries used for formatting prompts"""
     temp_fields = {
+        "book_id": fields.get("book_id"),
         "topic": fields["topic"],
         "author": fields["author"],
         "title": fields["title"],
@@ -30,17 +46,63 @@ def update_chapter_by_index(
 ) -> None:
     """Access a chapter at a specific index and update one of its values"""
     chapter = fields[field][field_index]
-    to_update = chapter
-    format_args = make_chapter_format_args(
-        fields, field, {"chapter": chapter["header"]}
-    )
-    if type(chapter[key]) == list:
-        to_update = {key: "\n".join(chapter[key])}
-    generate_or_edit_menu_value(
-        to_update, key, lambda *_: generate_field_content(format_args, key)
-    )
-    if type(chapter[key]) == list:
-        chapter[key] = to_update[key].split("\n")
+    format_args = make_chapter_format_args(fields, field, {"chapter": chapter.header})
+    generate = lambda *_: generate_field_content(format_args, key)
+    if key == "content" and streaming():
+        generate = lambda *_: stream_chapter_content(
+            fields["book_id"], fields[field], field_index, format_args
+        )
+    if key == "content" and lookahead():
+        generate = with_lookahead(fields, field, field_index, format_args, generate)
+    to_update = {key: getattr(chapter, key)}
+    if type(to_update[key]) == list:
+        to_update[key] = "\n".join(to_update[key])
+    generate_or_edit_menu_value(to_update, key, generate)
+    if type(getattr(chapter, key)) == list:
+        to_update[key] = to_update[key].split("\n")
+    # content that isn't what an interrupted stream left is complete
+    if key == "content" and to_update[key] != chapter.content:
+        chapter.partial = False
+    setattr(chapter, key, to_update[key])
+    save_chapter(fields["book_id"], field_index, chapter)
+
+
+def with_lookahead(
+    fields: dict[str, Any],
+    field: str,
+    field_index: int,
+    format_args: dict[str, Any],
+    generate: Callable,
+) -> Callable:
+    """Make a generator use the chapter if it was written ahead, and write the next one ahead"""
+
+    def generate_with_lookahead(*args):
+        ahead = take_written_ahead(format_args)
+        write_next_chapter_ahead(fields, field, field_index)
+        return (ahead and ahead_content(ahead)) or generate(*args)
+
+    return generate_with_lookahead
+
+
+def write_next_chapter_ahead(
+    fields: dict[str, Any], field: str, field_index: int
+) -> None:
+    """Start writing the next unwritten chapter after this one, while this one is reviewed
+
+    If the outline changes before it is used, the format args no longer match
+    and it is left unused. Partial chapters are left to be resumed instead.
+    """
+    indexes = [
+        i
+        for i, chapter in enumerate(fields[field])
+        if not chapter.content and i != field_index
+    ]
+    later = [i for i in indexes if i > field_index]
+    if later or indexes:
+        next_chapter = fields[field][(later or indexes)[0]]
+        write_ahead(
+            make_chapter_format_args(fields, field, {"chapter": next_chapter.header})
+        )
 
 
 def select_chapter_index(fields: dict[str, Any], field: str, info: str) -> int | bool:
@@ -54,13 +116,20 @@ def select_chapter_index(fields: dict[str, Any], field: str, info: str) -> int |
     )
 
 
+def unwritten_chapters(fields: dict[str, Any], field: str) -> list[int]:
+    """Return the indexes of every unwritten chapter"""
+    return [
+        i
+        for i, chapter in enumerate(fields[field])
+        if not chapter.content or chapter.partial
+    ]
+
+
 def find_next_unwritten_chapter(fields: dict[str, Any], field: str) -> int | bool:
     """Return the index of the next unwritten chapter"""
-    for i, chapter in enumerate(fields[field]):
-        if not chapter["content"]:
-            # adding one here because select_field_index, which this is used as a lambda for, subtracts one
-            return i + 1
-    return True
+    indexes = unwritten_chapters(fields, field)
+    # adding one here because select_field_index, which this is used as a lambda for, subtracts one
+    return indexes[0] + 1 if indexes else True
 
 
 def select_chapter_or_next_unwritten_chapter(
@@ -97,10 +166,9 @@ def select_chapter_destination(
 
 def insert_new_chapter(fields: dict[str, Any], field: str, field_index: int) -> None:
     """Insert a chapter into the chapters list, pushing other chapters up"""
-    fields[field].insert(
-        field_index,
-        {"header": "<new chapter>", "sections": ["<new sections>"], "content": ""},
-    )
+    chapter = Chapter("<new chapter>", ["<new sections>"])
+    fields[field].insert(field_index, chapter)
+    insert_chapter(fields["book_id"], field_index, chapter)
 
 
 @menu_command(select_chapter_or_next_unwritten_chapter, "add/edit content")
@@ -109,6 +177,31 @@ def add_chapter_content(fields: dict[str, Any], field: str, field_index: int) ->
     update_chapter_by_index(fields, field, field_index, "content")
 
 
+def write_unwritten_chapters(
+    fields: dict[str, Any], field: str, task_prefix: str | None = None
+) -> bool:
+    """Generate content for every unwritten chapter at once
+
+    See generate_chapter_contents for what task_prefix does. The chapter menu
+    passes none: each chapter is saved as it finishes, so a rerun only writes
+    the chapters that are still unwritten.
+    """
+    indexes = unwritten_chapters(fields, field)
+    if not indexes:
+        print("Every chapter is already written.")
+        return True
+    format_args = {
+        i: make_chapter_format_args(fields, field, {"chapter": fields[field][i].header})
+        for i in indexes
+    }
+    print("Writing {} chapters...".format(len(indexes)))
+    written = generate_chapter_contents(
+        fields["book_id"], fields[field], format_args, task_prefix
+    )
+    print("Wrote {} of {} chapters.".format(written, len(indexes)))
+    return True
+
+
 @menu_command(select_chapter_index, "edit the header/sections")
 def edit_chapter_header_and_sections(
     fields: dict[str, Any], field: str, field_index: int
@@ -135,6 +228,7 @@ def move_chapter(fields: dict[str, Any], field: str, field_index: int) -> bool:
         fields: dict[str, Any], field: str, destination_field_index: int
     ) -> bool:
         fields[field].insert(destination_field_index, fields[field].pop(field_index))
+        move_saved_chapter(fields["book_id"], field_index, destination_field_index)
 
     move_to(fields, field, "")
 
@@ -150,6 +244,7 @@ def delete_chapter(fields: dict[str, Any], field: str, field_index: int) -> bool
     )
     if confirm:
         del fields[field][field_index]
+        delete_saved_chapter(fields["book_id"], field_index)
 
 
 @menu_command(select_chapter_index, "delete content only")
@@ -163,7 +258,9 @@ def delete_chapter_content(
         "n",
     )
     if confirm:
-        fields[field][field_index]["content"] = ""
+        fields[field][field_index].content = ""
+        fields[field][field_index].partial = False
+        save_chapter(fields["book_id"], field_index, fields[field][field_index])
 
 
 chapter_menu_commands = [
@@ -172,6 +269,11 @@ chapter_menu_commands = [
         add_chapter_content,
         "Select a chapter to add its content if it is marked unwritten, or edit its existing content",
     ),
+    (
+        "Write all unwritten chapters",
+        write_unwritten_chapters,
+        "Generate content for every unwritten chapter at once, saving each chapter as it finishes",
+    ),
     (
         "Edit chapter header and sections",
         edit_chapter_header_and_sections,
@@ -200,17 +302,20 @@ chapter_menu_commands = [
 ]
 
 
-def format_chapters(chapters: list[dict[str, Any]]) -> str:
+def format_chapters(chapters: list[Chapter]) -> str:
     content = "\n"
     for i, chapter in enumerate(chapters):
-        content += "[{}] {}".format(i + 1, chapter["header"])
-        if not chapter["content"]:
+        content += "[{}] {}".format(i + 1, chapter.header)
+        if not chapter.content:
             content += " (unwritten)"
+        elif chapter.partial:
+            content += " (partial)"
         content += "\n"
-        for section in chapter["sections"]:
+        for section in chapter.sections:
             content += "\t{}\n".format(section)
     return content
 
 
 def run_chapter_menu(fields: dict[str, Any], field: str) -> str | bool:
+    """Let the user work on the chapters, saving each change as a single chapter write"""
     return run_menu(fields, field, chapter_menu_commands, format_chapters)
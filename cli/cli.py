@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 import argparse
+import importlib
+import os
+import sys
 
-from cli.list_command import list_command
-from cli.create_command import create_command
-from cli.edit_command import edit_command
-from cli.delete_command import delete_command
-from cli.export_command import export_command
+from autobook import tracing
+from autobook.scheduler import GenerationError
+
+from typing import Any, Callable
 
 
 def add_commands(
@@ -19,6 +21,60 @@ def add_commands(
     return command
 
 
+global_options: dict[str, str] = {
+    "jobs": "AUTOBOOK_CONCURRENCY",
+    "no_cache": "AUTOBOOK_NO_CACHE",
+    "stream": "AUTOBOOK_STREAM",
+    "profile": "AUTOBOOK_PROFILE",
+    "lookahead": "AUTOBOOK_LOOKAHEAD",
+}
+
+
+def apply_global_options(args: dict[str, Any]) -> None:
+    """Remove global options from the parsed arguments and expose them through the environment"""
+    for option, variable in global_options.items():
+        value = args.pop(option)
+        if value is not None and value is not False:
+            os.environ[variable] = str(value)
+
+
+def load_command(name: str) -> Callable[[dict[str, Any]], None]:
+    """Import the module of a single command, so that others don't slow it down
+
+    The command run by "./run <name>" is <name>_command in cli/<name>_command.py.
+    """
+    module = importlib.import_module(f"cli.{name}_command")
+    return getattr(module, f"{name}_command")
+
+
+def print_profile(spans: list[dict[str, Any]]) -> None:
+    """Write the spans of a profiled command to a trace file and summarize them by phase
+
+    The hits and misses of each cache the command used are printed after.
+    """
+    path = tracing.trace_path()
+    tracing.write(spans, path)
+    ends = [span["start"] + span["duration"] for span in spans]
+    wall = max(ends, default=0.0) - min((span["start"] for span in spans), default=0.0)
+    print(f"\nProfile of {wall:.3f}s in {len(spans)} spans, written to {path}:")
+    print(
+        f"{'phase':<28}{'calls':>7}{'total s':>10}{'self s':>10}{'max s':>10}"
+        f"{'self %':>8}"
+    )
+    for name, phase in tracing.summarize(spans).items():
+        share = phase["self"] / wall * 100 if wall else 0.0
+        print(
+            f"{name:<28}{phase['calls']:>7}{phase['total']:>10.3f}"
+            f"{phase['self']:>10.3f}{phase['max']:>10.3f}{share:>8.1f}"
+        )
+    from autobook.main import cache_stats
+
+    for namespace, counters in cache_stats().items():
+        print(
+            f"Cache {namespace}: {counters['hits']} hits, {counters['misses']} misses"
+        )
+
+
 def cli() -> None:
     """Generate a book using values from commandline flags"""
 
@@ -30,8 +86,38 @@ def cli() -> None:
         "create": "Create a new book, generating any aspect of the book that is not provided at the command line via flag.",
         "edit": "Edit a saved book with a text editor or by regenerating. By itself, lists incomplete books. With a book id, fills in missing content, or displays list of chapters for easy editing. With a book id and field, edit that content directly.",
         "delete": "Remove a saved book from the database.",
-        "export": "Export a saved book to the epub format.",
+        "export": "Export saved books to the epub or text format.",
+        "migrate": "Copy every book from the JSON database into the SQLite database, keeping their ids.",
+        "batch": "Create a book for every line of a JSON lines job file, accepting every generated value without asking.",
+        "search": "Find books by words in their title, topic, outline, chapter headers or chapter content, best matches first.",
+        "stats": "Show the tokens, latency and cost of requests to the AI by prompt type, for every book or a single book.",
     }
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Maximum number of requests to send to the AI at once when writing several chapters (default: 4).",
+        type=int,
+    )
+    parser.add_argument(
+        "--no-cache",
+        help="Always send prompts to the AI instead of reusing cached responses.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--stream",
+        help="Print chapter content as it is generated, saving it as it arrives.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--lookahead",
+        help="While a chapter is reviewed, write the next unwritten chapter in the background, so it is ready when selected.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--profile",
+        help="Time prompt formatting, requests to the AI, storage and export, writing the spans to instance/traces and printing a summary.",
+        action="store_true",
+    )
     command = add_commands(parser, command_data)
     command["create"].add_argument(
         "-c",
@@ -76,6 +162,18 @@ def cli() -> None:
         type=int,
         nargs="?",
     )
+    command["list"].add_argument(
+        "-r",
+        "--ready",
+        help="List only books that are ready for export.",
+        action="store_true",
+    )
+    command["list"].add_argument(
+        "-l",
+        "--chapters_left",
+        help="List only books with at least one and at most this many unwritten chapters.",
+        type=int,
+    )
     command["edit"].add_argument(
         "book_id",
         help="A valid book id (default: list all unfinished books by id and topic).",
@@ -89,6 +187,12 @@ def cli() -> None:
         nargs="?",
         choices=["topic", "title", "author", "chapters", "num_chapters", "outline"],
     )
+    command["edit"].add_argument(
+        "-w",
+        "--write_all",
+        help="Write every unwritten chapter of the book at once.",
+        action="store_true",
+    )
     command["delete"].add_argument("book_id", help="A valid book id.", type=int)
     command["delete"].add_argument(
         "field",
@@ -97,31 +201,101 @@ def cli() -> None:
         nargs="?",
         choices=["title", "author", "chapters", "num_chapters", "outline"],
     )
-    command["export"].add_argument("book_id", help="A valid book id.", type=int)
-    command["export"].add_argument("file_path", help="File path for export.")
+    command["export"].add_argument(
+        "books",
+        help="A valid book id and a file path for export, or several book ids with --output_dir.",
+        nargs="*",
+    )
     command["export"].add_argument(
         "-f",
         "--format",
-        help="Define the format for export (default: epub).",
+        help="Define the format for export (default: epub). Repeat to export several formats with --all or --output_dir.",
         type=str,
-        default="epub",
-        const="epub",
-        nargs="?",
+        action="append",
         choices=["epub", "txt"],
     )
+    command["export"].add_argument(
+        "-a",
+        "--all",
+        help="Export every book that has saved chapters.",
+        action="store_true",
+    )
+    command["export"].add_argument(
+        "-o",
+        "--output_dir",
+        help="Directory to export several books to, as <book_id>.<format> (default: output).",
+    )
+    command["export"].add_argument(
+        "-p",
+        "--processes",
+        help="Number of books to export at once (default: number of CPUs).",
+        type=int,
+    )
+
+    command["migrate"].add_argument(
+        "source",
+        help="The JSON database file to copy from (default: instance/db.json, or the file named by AUTOBOOK_DB_FILENAME).",
+        nargs="?",
+    )
+
+    command["batch"].add_argument(
+        "jobs_file",
+        help='A file with one JSON object per line, like {"topic": "apples", "num_chapters": 5}. Jobs may also set title and author.',
+    )
+    command["batch"].add_argument(
+        "-w",
+        "--workers",
+        help="Number of books to write at once (default: 2).",
+        type=int,
+    )
+    command["batch"].add_argument(
+        "-r",
+        "--retry",
+        help="Try steps that already failed too many times again.",
+        action="store_true",
+    )
+
+    command["search"].add_argument(
+        "query",
+        help="Words to look for. Books must contain every word; the last word also matches words starting with it.",
+        nargs="*",
+    )
+    command["search"].add_argument(
+        "-n",
+        "--limit",
+        help="Number of books to show (default: 10).",
+        type=int,
+        default=10,
+    )
+    command["search"].add_argument(
+        "--rebuild",
+        help="Index every book again before searching, if the index got out of date.",
+        action="store_true",
+    )
+
+    command["stats"].add_argument(
+        "book_id",
+        help="A valid book id (default: every request).",
+        type=int,
+        nargs="?",
+    )
 
     args = vars(parser.parse_args())
     user_command = args.pop("command")
+    apply_global_options(args)
 
-    commands = {
-        "list": list_command,
-        "create": create_command,
-        "edit": edit_command,
-        "delete": delete_command,
-        "export": export_command,
-    }
-
-    commands[user_command](args)  # type: ignore
+    profile = tracing.profiling()
+    if profile:
+        tracing.start()
+    try:
+        with tracing.span(f"command.{user_command}"):
+            load_command(user_command)(args)
+    except GenerationError as e:
+        print(e)
+        sys.exit(1)
+    finally:
+        if profile:
+            print_profile(tracing.stop())
 
 
 if __name__ == "__main__":
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 from autobook.main import list_book, list_unfinished_books
+from cli.chapter_menu import write_unwritten_chapters
 from cli.generators import continue_book, make_generator, run_generator
-from cli.utils import list_id_and_topic
+from cli.utils import has, list_id_and_topic
 
 from typing import Any
 
@@ -15,6 +16,15 @@ def edit_field(args: dict[str, Any]) -> None:
     run_generator(make_generator(fields, field), fields)
 
 
+def write_all_chapters(args: dict[str, Any]) -> None:
+    """Write every unwritten chapter of a book without going through the menu"""
+    fields = list_book(args["book_id"])
+    if has(fields, "chapters"):
+        write_unwritten_chapters(fields, "chapters")
+    else:
+        print("Book does not have any saved chapters yet.")
+
+
 def list_all_unfinished_books() -> None:
     """List all unfinished books"""
     print("Unfinished books:\n")
@@ -24,7 +34,12 @@ def list_all_unfinished_books() -> None:
 def resume_editing(args: dict[str, Any]) -> None:
     """Edit a specific book's field or start at next required field for category"""
     try:
-        edit_field(args) if args["field"] else continue_book(list_book(args["book_id"]))
+        if args["write_all"]:
+            write_all_chapters(args)
+        elif args["field"]:
+            edit_field(args)
+        else:
+            continue_book(list_book(args["book_id"]))
     except KeyError:
         print(f"No book {args['book_id']} in database.")
 
@@ -1,20 +1,74 @@
 #!/usr/bin/env python3
-from autobook.main import export_book_to_epub, export_book_to_text, list_book
+import time
+
+from autobook.main import (
+    export_book_to_epub,
+    export_book_to_text,
+    export_books,
+    exportable_books,
+    list_book,
+)
 from cli.utils import has
 
 from typing import Any
 
 
-def export_command(args: dict[str, Any]) -> None:
-    """Export a saved book to epub format"""
-    print("Exporting a saved book...")
-    book_id = args["book_id"]
-    file_path = args["file_path"]
+def export_one(args: dict[str, Any]) -> None:
+    """Export a single book to a file"""
+    if len(args["books"]) != 2:
+        print("Give a book id and a file path, or use --all or --output_dir.")
+        return
+    formats = args["format"] or ["epub"]
+    if len(formats) > 1:
+        print("Give a single format, or use --all or --output_dir for several.")
+        return
+    book_id, file_path = int(args["books"][0]), args["books"][1]
     fields = list_book(book_id) or {}
     if has(fields, "chapters"):
-        if args["format"] == "txt":
+        if formats[0] == "txt":
             export_book_to_text(book_id, file_path)
         else:
             export_book_to_epub(book_id, file_path)
     else:
         print("Book does not have any saved chapters yet.")
+
+
+def export_many(args: dict[str, Any]) -> None:
+    """Export several books in every requested format, reporting how long each took"""
+    formats = args["format"] or ["epub"]
+    exportable = exportable_books()
+    if args["all"]:
+        book_ids = exportable
+    else:
+        book_ids = [int(book_id) for book_id in args["books"]]
+        for book_id in book_ids:
+            if book_id not in exportable:
+                print(f"Book {book_id} does not have any saved chapters yet.")
+        book_ids = [book_id for book_id in book_ids if book_id in exportable]
+    if not book_ids:
+        print("No books to export.")
+        return
+    output_dir = args["output_dir"] or "output"
+    start = time.perf_counter()
+    exported = 0
+    for book_id, format, file_path, seconds in export_books(
+        book_ids, formats, output_dir, args["processes"]
+    ):
+        print(f"Exported book {book_id} to {file_path} in {seconds:.2f}s.")
+        exported += 1
+    print(
+        f"Exported {exported} of {len(book_ids) * len(formats)} files "
+        f"in {time.perf_counter() - start:.2f}s."
+    )
+
+
+def export_command(args: dict[str, Any]) -> None:
+    """Export saved books to epub or text files"""
+    print("Exporting a saved book...")
+    try:
+        if args["all"] or args["output_dir"]:
+            export_many(args)
+        else:
+            export_one(args)
+    except ValueError:
+        print("Book ids must be whole numbers.")
@@ -41,10 +41,10 @@ def save_at_end(fields, field, generator: Callable, *rest) -> None:
     save_to_book(fields["book_id"], field, fields[field])
 
 
-def save_at_each_step(fields, field, generator: Callable, *rest) -> None:
-    """Generate information and save at the end"""
+def run_each_step(fields, field, generator: Callable, *rest) -> None:
+    """Keep generating information until done, leaving saving to each step"""
     while generator(fields, field, *rest):
-        save_to_book(fields["book_id"], field, fields[field])
+        pass
 
 
 def make_field_generator(
@@ -87,7 +87,7 @@ def make_menu_generator(
     """Create a generator for a menu that alters a complex field"""
     if not has(fields, field):
         fields[field] = []
-    return (field, lambda: save_at_each_step(fields, field, menu))
+    return (field, lambda: run_each_step(fields, field, menu))
 
 
 generators: dict[str, Callable] = {
@@ -3,6 +3,7 @@ import sys
 import texteditor
 from functools import wraps
 
+from autobook.main import without_cache
 from cli.ask import ask_for_action
 from cli.utils import has
 
@@ -88,6 +89,11 @@ def edit_value(fields: dict[str, Any], field: str) -> str:
     )
 
 
+def regenerate(generate_value: Callable) -> Callable:
+    """Make a generator skip cached responses, for replacing content the user has already seen"""
+    return lambda *args: without_cache(generate_value, *args)
+
+
 def make_options(func: Callable) -> Callable:
     @wraps(func)
     def wrapper(fields, field, *args, **kwargs):
@@ -118,7 +124,11 @@ def GE_options(generate_value: Callable) -> list[tuple[str, Callable, str]]:
 def YEG_options(generate_value: Callable) -> list[tuple[str, Callable, str]]:
     return [
         ("y", accept_value, "accept the current content"),
-        ("g", generate_value, "generate new content by sending a request to the AI"),
+        (
+            "g",
+            regenerate(generate_value),
+            "generate new content by sending a request to the AI",
+        ),
         ("e", edit_value, "edit content by opening a text editor"),
     ]
 
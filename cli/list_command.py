@@ -1,7 +1,14 @@
 #!/usr/bin/env python3
 from pprint import pformat
 
-from autobook.main import list_book, list_books
+from autobook.main import (
+    book_completion,
+    list_book,
+    list_books,
+    list_books_with_chapters_left,
+    list_ready_books,
+)
+from autobook.models import serialize
 from cli.utils import list_id_and_topic
 
 from typing import Any
@@ -10,16 +17,30 @@ from typing import Any
 def list_book_content(book: dict) -> None:
     """List formatted content for each field in a book"""
     for key in book:
-        content = pformat(book[key])
+        content = pformat(serialize(key, book[key]))
         print(f"\n{key}:\n{content}")
 
 
+def format_completion(completion: dict[str, Any]) -> str:
+    """Describe how far along a book is"""
+    written = completion["chapter_count"] - completion["unwritten_chapters"]
+    status = "{} of {} chapters written, {} words".format(
+        written, completion["chapter_count"], completion["word_count"]
+    )
+    if completion["missing_fields"]:
+        status += ", missing " + ", ".join(completion["missing_fields"])
+    return status + (" (ready for export)" if completion["ready"] else "")
+
+
 def list_one(book_id: int) -> None:
     """Pretty-print all info about a single book."""
     book = list_book(book_id)
     if book:
         print(f"Listing book {book_id}...")
         list_book_content(book)
+        completion = book_completion(book_id)
+        if completion is not None:
+            print(f"\nprogress:\n{format_completion(completion)}")
 
 
 def list_all() -> None:
@@ -28,6 +49,21 @@ def list_all() -> None:
     list_id_and_topic(list_books())
 
 
+def list_filtered(args: dict[str, Any]) -> None:
+    """List books by completion state"""
+    if args["ready"]:
+        print("Listing books ready for export...\n")
+        list_id_and_topic(list_ready_books())
+    else:
+        print(f"Listing books with {args['chapters_left']} or fewer chapters left...\n")
+        list_id_and_topic(list_books_with_chapters_left(args["chapters_left"]))
+
+
 def list_command(args: dict[str, Any]) -> None:
     """Handle list request"""
-    list_one(args["book_id"]) if args["book_id"] else list_all()
+    if args["book_id"]:
+        list_one(args["book_id"])
+    elif args["ready"] or args["chapters_left"]:
+        list_filtered(args)
+    else:
+        list_all()
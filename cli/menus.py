@@ -5,6 +5,7 @@ from cli.inputs import (
     edit_value,
     make_options,
     process_action,
+    regenerate,
     provide_options,
     update_field,
     generate_or_edit,
@@ -31,7 +32,11 @@ def GEC_options(generate_value: Callable) -> list[tuple[str, Callable, str]]:
 def YEGC_options(generate_value: Callable) -> list[tuple[str, Callable, str]]:
     return [
         ("y", accept_value, "accept the current content"),
-        ("g", generate_value, "generate new content by sending a request to the AI"),
+        (
+            "g",
+            regenerate(generate_value),
+            "generate new content by sending a request to the AI",
+        ),
         ("e", edit_value, "edit content by opening a text editor"),
         (
             "c",
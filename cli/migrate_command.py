@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+from autobook.main import migrate_to_sqlite
+
+from typing import Any
+
+
+def migrate_command(args: dict[str, Any]) -> None:
+    """Copy every book from the JSON database into the SQLite database"""
+    print("Migrating books to SQLite...")
+    try:
+        count = migrate_to_sqlite(args["source"])
+    except FileNotFoundError as e:
+        print(f"No JSON database found at {e.filename}.")
+        return
+    print(f"Copied {count} book(s). Set AUTOBOOK_DB_BACKEND=sqlite to use them.")
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+from autobook.main import rebuild_search_index, search_books
+
+from typing import Any
+
+
+def describe_part(result: dict[str, Any]) -> str:
+    """Name the part of a book a search result matched best"""
+    if result["chapter"] is not None:
+        return f"chapter {result['chapter'] + 1}"
+    return result["field"]
+
+
+def search_command(args: dict[str, Any]) -> None:
+    """Find books matching the query, printing the best matching part of each"""
+    if args["rebuild"]:
+        print(f"Indexed {rebuild_search_index()} book(s).")
+    if not args["query"]:
+        if not args["rebuild"]:
+            print("Give some words to search for.")
+        return
+    query = " ".join(args["query"])
+    print(f'Searching for "{query}"...\n')
+    results = search_books(query, args["limit"])
+    if not results:
+        print("No books found.")
+        return
+    for result in results:
+        matches = f"{result['matches']} matching part(s)"
+        print(
+            f"id: {result['book_id']}\ttitle: {result['title'] or result['topic']}"
+            f"\tin {describe_part(result)}, {matches}"
+        )
+        print(f"    {result['snippet']}\n")
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+from autobook.main import usage_stats
+
+from typing import Any
+
+
+def stats_command(args: dict[str, Any]) -> None:
+    """Show the tokens, latency and cost of requests by prompt type"""
+    book_id = args["book_id"]
+    print(f"Usage for book {book_id}...\n" if book_id else "Usage for every book...\n")
+    stats = usage_stats(book_id)
+    if not stats:
+        print("No requests recorded yet.")
+        return
+    print(
+        f"{'prompt':<12}{'calls':>7}{'cached':>8}{'est. tok':>10}{'prompt tok':>12}"
+        f"{'compl. tok':>12}{'avg s':>8}{'cost $':>10}"
+    )
+    for prompt_type, summary in stats.items():
+        print(
+            f"{prompt_type:<12}{summary['calls']:>7}{summary['cached']:>8}"
+            f"{summary['estimated_tokens']:>10}"
+            f"{summary['prompt_tokens']:>12}{summary['completion_tokens']:>12}"
+            f"{summary['latency']:>8.2f}{summary['cost']:>10.4f}"
+        )
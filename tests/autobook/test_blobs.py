@@ -0,0 +1,43 @@
+import zlib
+from autobook import blobs
+
+
+def test_put_and_get(tmp_path):
+    text = "Some chapter text. " * 100
+    key = blobs.put(str(tmp_path), text)
+    assert blobs.get(str(tmp_path), key) == text
+    stored = blobs.blob_path(str(tmp_path), key).read_bytes()
+    assert zlib.decompress(stored).decode() == text
+    assert len(stored) < len(text)
+
+
+def test_identical_text_is_stored_once(tmp_path):
+    assert blobs.put(str(tmp_path), "same") == blobs.put(str(tmp_path), "same")
+    assert len([path for path in tmp_path.rglob("*") if path.is_file()]) == 1
+
+
+def test_remove(tmp_path):
+    key = blobs.put(str(tmp_path), "gone")
+    blobs.remove(str(tmp_path), key)
+    blobs.remove(str(tmp_path), key)
+    assert not blobs.blob_path(str(tmp_path), key).exists()
+
+
+def test_pack_and_unpack(tmp_path):
+    chapter = {"header": "I.", "sections": [], "content": "Text"}
+    packed = blobs.pack(str(tmp_path), chapter)
+    assert "content" not in packed
+    assert blobs.keys([packed]) == {packed["blob"]}
+    assert blobs.unpack(str(tmp_path), packed) == chapter
+
+
+def test_unfinished_content_stays_inline(tmp_path):
+    empty = {"header": "I.", "sections": [], "content": ""}
+    partial = {"header": "I.", "sections": [], "content": "Te", "partial": True}
+    assert blobs.pack(str(tmp_path), empty) == empty
+    assert blobs.pack(str(tmp_path), partial) == partial
+    assert blobs.keys([empty, partial]) == set()
+
+
+def test_directory_for():
+    assert blobs.directory_for("instance/db.json") == "instance/db.blobs"
@@ -1,10 +1,21 @@
 import pytest
+from types import SimpleNamespace
+from autobook import metrics, providers
+from autobook.models import Chapter
 from autobook.book import (
+    condense_outline,
+    format_prompt,
     generate_content,
+    generate_content_stream,
+    generate_contents,
     generate_field,
+    get_response,
+    quiet,
+    stream_response,
     get_lines,
     string_to_chapters,
     chapters_to_string,
+    varies,
 )
 
 
@@ -18,12 +29,150 @@ def mock_response(mocker):
     )
 
 
+@pytest.fixture
+def mock_client(mocker, tmp_path, monkeypatch):
+    # Mocking the API client, with a fresh response cache and metrics file
+    monkeypatch.setenv("AUTOBOOK_CACHE_DIR", str(tmp_path))
+    monkeypatch.setenv("AUTOBOOK_METRICS_FILE", str(tmp_path / "metrics.jsonl"))
+    monkeypatch.delenv("AUTOBOOK_NO_CACHE", raising=False)
+    response = SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=" API Response "))],
+        usage=SimpleNamespace(total_tokens=50, prompt_tokens=30, completion_tokens=20),
+    )
+    create = mocker.Mock(return_value=response)
+    client = SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+    )
+    mocker.patch(
+        "autobook.book.providers.provider",
+        return_value=providers.OpenAIProvider(client),
+    )
+    return create
+
+
+def test_get_response(mock_client):
+    # Test that the response content is stripped and returned with its token usage
+    assert get_response("prompt") == ("API Response", 50)
+
+
+def test_get_response_uses_cache(mock_client):
+    # Test that a repeated prompt is answered from the cache without an API call
+    get_response("prompt")
+    assert get_response("prompt") == ("API Response", 0)
+    assert mock_client.call_count == 1
+    get_response("another prompt")
+    assert mock_client.call_count == 2
+
+
+def test_get_response_runs_quietly(mock_client, capsys):
+    # Test that a request made inside quiet prints nothing
+    with quiet():
+        assert get_response("prompt") == ("API Response", 50)
+    assert capsys.readouterr().out == ""
+    get_response("prompt")
+    assert "Using cached response." in capsys.readouterr().out
+
+
+def test_get_response_records_usage(mock_client):
+    # Test that every call is recorded, with cached calls costing no tokens
+    get_response("prompt", prompt_type="title", book_id=3)
+    get_response("prompt", prompt_type="title", book_id=3)
+    records = metrics.load(3)
+    assert [(r["prompt_tokens"], r["completion_tokens"]) for r in records] == [
+        (30, 20),
+        (0, 0),
+    ]
+    assert [r["cached"] for r in records] == [False, True]
+    assert records[0]["prompt_type"] == "title"
+    assert records[0]["estimated_tokens"] > 0
+
+
+def test_generate_content_records_prompt_type(mock_client, mocker):
+    # Test that the prompt type and book id reach the metrics
+    mocker.patch.dict("autobook.prompts.prompts", {"test_prompt": "fake prompt {var1}"})
+    generate_content({"var1": "Test", "book_id": 7}, "test_prompt")
+    [record] = metrics.load()
+    assert (record["prompt_type"], record["book_id"]) == ("test_prompt", 7)
+
+
+def test_generate_content_without_inputs_skips_cache(mock_client, mocker, tmp_path):
+    # Test that a prompt without inputs gets a new response every time
+    mocker.patch.dict("autobook.prompts.prompts", {"test_prompt": "fake prompt"})
+    generate_content({}, "test_prompt")
+    generate_content({}, "test_prompt")
+    assert mock_client.call_count == 2
+    assert not (tmp_path / "responses").exists()
+
+
+def test_varies():
+    assert varies("topic")
+    assert not varies("title")
+
+
+def make_chunks(*pieces):
+    # Build streamed chunks the way the API client returns them
+    return [
+        SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+        for piece in pieces
+    ]
+
+
+def test_stream_response(mock_client):
+    # Test that pieces are yielded as they arrive and the full response is cached
+    mock_client.return_value = make_chunks("Hello", None, " world ")
+    assert list(stream_response("prompt")) == ["Hello", " world "]
+    assert list(stream_response("prompt")) == ["Hello world"]
+    assert mock_client.call_count == 1
+
+
+def test_stream_response_records_usage(mock_client):
+    # Test that the usage sent with the last chunk is recorded
+    usage = SimpleNamespace(total_tokens=12, prompt_tokens=10, completion_tokens=2)
+    mock_client.return_value = make_chunks("Hello") + [
+        SimpleNamespace(choices=[], usage=usage)
+    ]
+    assert list(stream_response("prompt", prompt_type="content")) == ["Hello"]
+    [record] = metrics.load()
+    assert (record["prompt_tokens"], record["completion_tokens"]) == (10, 2)
+
+
+def test_generate_content_stream_resumes(mock_client, mocker):
+    # Test that resuming sends the partial content back as history
+    mocker.patch.dict("autobook.prompts.prompts", {"test_prompt": "fake prompt {var1}"})
+    mock_client.return_value = make_chunks(" more")
+    pieces = list(generate_content_stream({"var1": "Test"}, "test_prompt", "Partial"))
+    assert pieces == [" more"]
+    messages = mock_client.call_args.kwargs["messages"]
+    assert messages[0] == {"role": "user", "content": "fake prompt Test"}
+    assert messages[1] == {"role": "assistant", "content": "Partial"}
+
+
 def test_generate_content(mock_response):
     # Test that generate_content correctly formats and returns mocked content
     content = generate_content({"var1": "Test"}, "test_prompt")
     assert content == "Mocked Response"
 
 
+def test_generate_contents(mock_response):
+    # Test that every job is generated and returned under its own key
+    jobs = {i: ({"var1": "Test"}, "test_prompt") for i in range(5)}
+    results = dict(generate_contents(jobs, max_workers=2))
+    assert results == {i: "Mocked Response" for i in range(5)}
+
+
+def test_generate_contents_skips_failures(mocker):
+    # Test that a failed job doesn't stop the other jobs from finishing
+    def fake_generate_content(format_vars, prompt_type):
+        if prompt_type == "broken_prompt":
+            raise KeyError(prompt_type)
+        return "Mocked Response"
+
+    mocker.patch("autobook.book.generate_content", side_effect=fake_generate_content)
+    jobs = {"good": ({}, "test_prompt"), "bad": ({}, "broken_prompt")}
+    results = dict(generate_contents(jobs))
+    assert results == {"good": "Mocked Response"}
+
+
 def test_generate_field_with_provided_field(mock_response):
     # Test generate_field when field is provided in fields dict
     fields = {"test_field": "Predefined Field Content"}
@@ -50,16 +199,8 @@ def test_string_to_chapters():
     input_string = "I. Chapter 1\n1. Section 1\n2. Section 2\nII. Chapter 2\n1. Section 3\n2. Section 4"
     chapters = string_to_chapters(input_string)
     expected = [
-        {
-            "header": "I. Chapter 1",
-            "sections": ["1. Section 1", "2. Section 2"],
-            "content": "",
-        },
-        {
-            "header": "II. Chapter 2",
-            "sections": ["1. Section 3", "2. Section 4"],
-            "content": "",
-        },
+        Chapter("I. Chapter 1", ["1. Section 1", "2. Section 2"]),
+        Chapter("II. Chapter 2", ["1. Section 3", "2. Section 4"]),
     ]
     assert chapters == expected
 
@@ -67,17 +208,61 @@ def test_string_to_chapters():
 def test_chapters_to_string():
     # Test converting chapters structure back to a string
     chapters = [
-        {
-            "header": "I. Chapter 1",
-            "sections": ["1. Section 1", "2. Section 2"],
-            "content": "",
-        },
-        {
-            "header": "II. Chapter 2",
-            "sections": ["1. Section 3", "2. Section 4"],
-            "content": "",
-        },
+        Chapter("I. Chapter 1", ["1. Section 1", "2. Section 2"]),
+        Chapter("II. Chapter 2", ["1. Section 3", "2. Section 4"]),
     ]
     result_str = chapters_to_string(chapters)
     expected_str = "I. Chapter 1\n1. Section 1\n2. Section 2\nII. Chapter 2\n1. Section 3\n2. Section 4\n"
     assert result_str == expected_str
+
+
+def test_format_prompt_within_budget(mocker):
+    # Test that a prompt that fits is left alone
+    mocker.patch.dict("autobook.prompts.prompts", {"test_prompt": "{outline}{chapter}"})
+    outline = "I. One\n1. A\nII. Two\n1. B\n"
+    format_vars = {"outline": outline, "chapter": "I. One"}
+    assert format_prompt(format_vars, "test_prompt") == outline + "I. One"
+
+
+def test_format_prompt_condenses_distant_chapters(mocker, monkeypatch):
+    # Test that distant chapters lose their sections first, then their headers
+    mocker.patch.dict("autobook.prompts.prompts", {"test_prompt": "{outline}"})
+    chapters = [
+        Chapter(f"{numeral}. Chapter", ["1. Section with many words"])
+        for numeral in ["I", "II", "III", "IV", "V"]
+    ]
+    outline = chapters_to_string(chapters)
+    format_vars = {"outline": outline, "chapter": "I. Chapter"}
+    monkeypatch.setenv("AUTOBOOK_PROMPT_BUDGET", "27")
+    assert format_prompt(format_vars, "test_prompt") == (
+        "I. Chapter\n1. Section with many words\n"
+        "II. Chapter\n1. Section with many words\n"
+        "III. Chapter\nIV. Chapter\nV. Chapter\n"
+    )
+    monkeypatch.setenv("AUTOBOOK_PROMPT_BUDGET", "1")
+    assert format_prompt(format_vars, "test_prompt") == (
+        "I. Chapter\n1. Section with many words\n...\n"
+    )
+
+
+def test_condense_outline():
+    chapters = [
+        Chapter(f"{numeral}. Chapter", ["1. Section"])
+        for numeral in ["I", "II", "III", "IV", "V"]
+    ]
+    assert condense_outline(chapters, 2, 0, 1) == (
+        "...\nII. Chapter\nIII. Chapter\n1. Section\nIV. Chapter\n...\n"
+    )
+
+
+def test_generate_contents_keeps_context(mocker):
+    # Test that jobs see context variables set by the caller, like a cache bypass
+    from autobook import cache
+
+    def fake_generate_content(format_vars, prompt_type):
+        return cache.enabled()
+
+    mocker.patch("autobook.book.generate_content", side_effect=fake_generate_content)
+    with cache.bypassed():
+        results = dict(generate_contents({i: ({}, "test_prompt") for i in range(3)}))
+    assert results == {0: False, 1: False, 2: False}
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+import os
+import time
+import pytest
+from autobook import cache
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Keep every test's cache in its own temporary directory"""
+    monkeypatch.setenv("AUTOBOOK_CACHE_DIR", str(tmp_path))
+    monkeypatch.delenv("AUTOBOOK_NO_CACHE", raising=False)
+    monkeypatch.setattr(cache, "stats", {})
+    return tmp_path
+
+
+def test_make_key_is_stable():
+    assert cache.make_key("model", [{"a": 1, "b": 2}]) == cache.make_key(
+        "model", [{"b": 2, "a": 1}]
+    )
+    assert cache.make_key("model", "one") != cache.make_key("model", "two")
+
+
+def test_store_and_load():
+    cache.store("test", "key", {"content": "cached"})
+    assert cache.load("test", "key") == {"content": "cached"}
+    assert cache.stats["test"] == {"hits": 1, "misses": 0}
+
+
+def test_load_missing():
+    assert cache.load("test", "missing") is None
+    assert cache.stats["test"] == {"hits": 0, "misses": 1}
+
+
+def test_bypassed():
+    cache.store("test", "key", "cached")
+    with cache.bypassed():
+        assert cache.load("test", "key") is None
+    assert cache.load("test", "key") == "cached"
+
+
+def test_disabled_by_environment(monkeypatch):
+    monkeypatch.setenv("AUTOBOOK_NO_CACHE", "1")
+    cache.store("test", "key", "cached")
+    assert cache.load("test", "key") is None
+    assert not (cache.cache_dir("test") / "key.json").exists()
+
+
+def test_expired_entries_are_dropped(monkeypatch):
+    cache.store("test", "key", "cached")
+    old = time.time() - 100
+    os.utime(cache.cache_dir("test") / "key.json", (old, old))
+    monkeypatch.setenv("AUTOBOOK_CACHE_MAX_AGE", "10")
+    assert cache.load("test", "key") is None
+    assert not (cache.cache_dir("test") / "key.json").exists()
+
+
+def test_evict_least_recently_used(monkeypatch):
+    for i, key in enumerate(["old", "new"]):
+        cache.store("test", key, "x" * 100)
+        stamp = time.time() - 100 + i
+        os.utime(cache.cache_dir("test") / f"{key}.json", (stamp, stamp))
+    monkeypatch.setenv("AUTOBOOK_CACHE_MAX_BYTES", "150")
+    cache.evict("test")
+    assert cache.load("test", "old") is None
+    assert cache.load("test", "new") == "x" * 100
+
+
+def test_clear():
+    cache.store("test", "key", "cached")
+    cache.clear("test")
+    assert cache.load("test", "key") is None
+
+
+def test_evict_skips_entries_removed_meanwhile(monkeypatch):
+    cache.store("test", "gone", "cached")
+    cache.store("test", "kept", "cached")
+    scandir = os.scandir
+
+    def scandir_then_remove(path):
+        entries = list(scandir(path))
+        (cache.cache_dir("test") / "gone.json").unlink()
+        return iter(entries)
+
+    monkeypatch.setattr(os, "scandir", scandir_then_remove)
+    cache.evict("test")
+    assert cache.load("test", "kept") == "cached"
+
+
+def test_store_is_best_effort(mocker):
+    mocker.patch("autobook.cache.evict", side_effect=FileNotFoundError)
+    cache.store("test", "key", "cached")
+    assert cache.load("test", "key") == "cached"
+    mocker.patch("autobook.cache.json.dump", side_effect=OSError)
+    cache.store("test", "other", "cached")
+    assert list(cache.cache_dir("test").iterdir()) == [
+        cache.cache_dir("test") / "key.json"
+    ]
+
+
+def test_evict_only_when_due(mocker, monkeypatch):
+    evict = mocker.spy(cache, "evict")
+    monkeypatch.setattr(cache, "evict_every", 3)
+    for i in range(4):
+        cache.store("test", f"key{i}", "x" * 10)
+    # the first store, then every third
+    assert evict.call_count == 2
+    monkeypatch.setenv("AUTOBOOK_CACHE_MAX_BYTES", "30")
+    cache.store("test", "big", "x" * 100)
+    assert evict.call_count == 3
+    assert cache.load("test", "big") is None
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+from autobook.completion import (
+    completion_record,
+    chapter_stats,
+    matches,
+    with_chapters,
+    with_fields,
+)
+
+
+def make_book(*contents, **fields):
+    """Helper to build a book with chapters holding the given contents"""
+    chapters = [
+        {"header": f"{i}.", "sections": [], "content": content}
+        for i, content in enumerate(contents)
+    ]
+    return dict({"title": "Title", "author": "Author", "chapters": chapters}, **fields)
+
+
+def test_chapter_stats():
+    assert chapter_stats({"content": "three little words"}) == {
+        "words": 3,
+        "written": True,
+    }
+    assert chapter_stats({"content": ""}) == {"words": 0, "written": False}
+    assert chapter_stats({"content": "cut off", "partial": True})["written"] is False
+
+
+def test_completion_record_of_finished_book():
+    record = completion_record(make_book("one two", "three"))
+    assert record["missing_fields"] == []
+    assert record["chapter_count"] == 2
+    assert record["unwritten_chapters"] == 0
+    assert record["word_count"] == 3
+    assert record["ready"]
+
+
+def test_completion_record_of_unfinished_book():
+    record = completion_record(make_book("one", "", author=""))
+    assert record["missing_fields"] == ["author"]
+    assert record["unwritten_chapters"] == 1
+    assert not record["ready"]
+    assert completion_record({"topic": "x"})["missing_fields"] == required()
+
+
+def required():
+    """Helper listing every required field"""
+    return ["title", "author", "chapters"]
+
+
+def test_with_fields_keeps_chapter_stats():
+    record = completion_record(make_book("one two"))
+    updated = with_fields(record, {"title": "Title"})
+    assert updated["missing_fields"] == ["author"]
+    assert updated["word_count"] == 2
+
+
+def test_with_chapters():
+    record = completion_record(make_book("one", ""))
+    finished = with_chapters(
+        record, lambda stats: stats.__setitem__(1, chapter_stats({"content": "two"}))
+    )
+    assert finished["ready"]
+    assert finished["word_count"] == 2
+    emptied = with_chapters(finished, lambda stats: stats.clear())
+    assert emptied["missing_fields"] == ["chapters"]
+    assert not emptied["ready"]
+
+
+def test_matches():
+    record = completion_record(make_book("one", "", ""))
+    assert matches(record)
+    assert matches(record, ready=False)
+    assert not matches(record, ready=True)
+    assert matches(record, max_chapters_left=2)
+    assert not matches(record, max_chapters_left=1)
+    assert not matches(completion_record(make_book("one")), max_chapters_left=5)
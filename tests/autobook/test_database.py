@@ -1,33 +1,57 @@
 #!/usr/bin/env python3
+import json
+import multiprocessing
 import os
 import pytest
+import shutil
+import sqlite3
+import subprocess
+import sys
 from pathlib import Path
 from autobook.database import (
     add_book,
     all_books,
+    book_summaries,
+    close_db,
+    flush_db,
+    get_completion,
     get_book,
     update_book,
     delete_book,
     delete_book_field,
+    delete_chapter,
+    insert_chapter,
+    move_chapter,
+    search_books,
+    unfinished_book_summaries,
     unfinished_books,
+    update_chapter,
 )
+from autobook import search, sqlite_storage, tinydb_storage
+from autobook.models import Book, Chapter
+from autobook.sqlite_storage import migrate_from_json
 
 
 def delete_test_db():
-    """Helper to delete test db file"""
-    test_db_path = Path("instance/test_db.json")
-    if test_db_path.exists():
-        test_db_path.unlink()
+    """Helper to delete test db files"""
+    for test_db_path in Path("instance").glob("test_db.*"):
+        if test_db_path.is_dir():
+            shutil.rmtree(test_db_path)
+        else:
+            test_db_path.unlink()
 
 
-@pytest.fixture(scope="module", autouse=True)
-def setup_and_teardown():
-    """Specify test database name via environment variable
-    Remove test database and helper environment variable at end of test
+@pytest.fixture(scope="module", autouse=True, params=["tinydb", "sqlite"])
+def setup_and_teardown(request):
+    """Specify test database name and backend via environment variables
+    Remove test database and helper environment variables at end of test
     """
     os.environ["AUTOBOOK_DB_FILENAME"] = "test_db"
-    yield
+    os.environ["AUTOBOOK_DB_BACKEND"] = request.param
+    yield request.param
+    close_db()
     del os.environ["AUTOBOOK_DB_FILENAME"]
+    del os.environ["AUTOBOOK_DB_BACKEND"]
     delete_test_db()
 
 
@@ -39,7 +63,8 @@ def test_add_book():
 def test_get_book():
     book_id = add_book({"title": "Specific Book", "author": "Specific Author"})
     book = get_book(book_id)
-    assert book["title"] == "Specific Book", "Get book returned the wrong book"
+    assert book.title == "Specific Book", "Get book returned the wrong book"
+    assert book.book_id == book_id
 
 
 def test_all_books():
@@ -54,7 +79,7 @@ def test_update_book():
     book_id = add_book({"title": "Book to Update", "author": "Author A"})
     update_book(book_id, "title", "Updated Title")
     updated_book = get_book(book_id)
-    assert updated_book["title"] == "Updated Title", "Book title was not updated"
+    assert updated_book.title == "Updated Title", "Book title was not updated"
 
 
 def test_delete_book():
@@ -69,12 +94,367 @@ def test_delete_book_field():
     )
     delete_book_field(book_id, "extra_field")
     book_after_deletion = get_book(book_id)
-    assert "extra_field" not in book_after_deletion, "Book field was not deleted"
+    assert (
+        "extra_field" not in book_after_deletion.fields()
+    ), "Book field was not deleted"
+    assert book_after_deletion.author == "Author C"
+
+
+def test_delete_known_book_field():
+    book_id = add_book({"title": "Book with Author", "author": "Author C"})
+    delete_book_field(book_id, "author")
+    book_after_deletion = get_book(book_id)
+    assert book_after_deletion.author is None, "Book field was not deleted"
+    assert "author" not in book_after_deletion.fields()
 
 
 def test_unfinished_books():
     book_id = add_book({"title": "Unfinished Book"})
     unfinished_book_list = unfinished_books()
     assert any(
-        book["book_id"] == book_id for book in unfinished_book_list
+        book.book_id == book_id for book in unfinished_book_list
     ), "Unfinished book not detected"
+
+
+def test_get_book_returns_a_copy():
+    chapters = [Chapter("I. One", [])]
+    book_id = add_book({"title": "Copied Book", "chapters": chapters})
+    book = get_book(book_id)
+    book.chapters[0].header = "Unsaved change"
+    book.chapters[0].sections.append("1. Unsaved")
+    assert get_book(book_id).chapters == chapters
+
+
+def test_changes_reach_the_file():
+    book_id = add_book({"title": "Flushed Book"})
+    update_book(book_id, "title", "Flushed Title")
+    close_db()
+    assert get_book(book_id).title == "Flushed Title"
+
+
+def test_chapters_round_trip():
+    chapters = [
+        Chapter("I. One", ["1. A"], "Text"),
+        Chapter("II. Two", [], "", partial=True),
+    ]
+    book_id = add_book({"title": "Chaptered Book", "chapters": chapters})
+    assert get_book(book_id).chapters == chapters
+    update_book(book_id, "chapters", chapters[:1])
+    assert get_book(book_id).chapters == chapters[:1]
+
+
+def test_update_chapters_to_none():
+    book_id = add_book({"title": "Cleared Book", "chapters": [Chapter("I. One", [])]})
+    update_book(book_id, "chapters", None)
+    assert get_book(book_id).chapters == []
+
+
+def make_chapters(*headers):
+    """Helper to build chapters with the given headers"""
+    return [Chapter(header, []) for header in headers]
+
+
+def headers(book_id):
+    """Helper to list the saved chapter headers of a book"""
+    return [chapter.header for chapter in get_book(book_id).chapters]
+
+
+def test_update_chapter():
+    book_id = add_book({"title": "Chapter Book", "chapters": make_chapters("A", "B")})
+    update_chapter(book_id, 1, Chapter("B", ["1. S"], "T"))
+    chapters = get_book(book_id).chapters
+    assert chapters[1] == Chapter("B", ["1. S"], "T")
+    assert chapters[0] == make_chapters("A")[0]
+
+
+def test_insert_chapter():
+    book_id = add_book({"title": "Chapter Book", "chapters": make_chapters("A", "C")})
+    insert_chapter(book_id, 1, make_chapters("B")[0])
+    insert_chapter(book_id, 3, make_chapters("D")[0])
+    assert headers(book_id) == ["A", "B", "C", "D"]
+
+
+def test_insert_chapter_without_chapters():
+    book_id = add_book({"title": "Empty Book"})
+    insert_chapter(book_id, 0, make_chapters("A")[0])
+    assert headers(book_id) == ["A"]
+
+
+@pytest.mark.parametrize(
+    "source, destination, expected",
+    [(0, 2, "BCAD"), (3, 0, "DABC"), (1, 4, "ACDB"), (2, 2, "ABCD")],
+)
+def test_move_chapter(source, destination, expected):
+    book_id = add_book({"title": "Chapter Book", "chapters": make_chapters(*"ABCD")})
+    move_chapter(book_id, source, destination)
+    assert headers(book_id) == list(expected)
+
+
+def test_delete_chapter():
+    book_id = add_book({"title": "Chapter Book", "chapters": make_chapters(*"ABC")})
+    delete_chapter(book_id, 1)
+    assert headers(book_id) == ["A", "C"]
+
+
+def test_finished_book_is_not_unfinished():
+    chapters = [Chapter("I. One", [], "Text")]
+    book_id = add_book({"title": "Done", "author": "Author D", "chapters": chapters})
+    assert all(book.book_id != book_id for book in unfinished_books())
+    delete_book_field(book_id, "author")
+    assert any(book.book_id == book_id for book in unfinished_books())
+
+
+def test_delete_missing_book():
+    with pytest.raises(KeyError):
+        delete_book(999999)
+
+
+def test_migrate_from_json(setup_and_teardown, tmp_path):
+    if setup_and_teardown != "sqlite":
+        pytest.skip("migration goes from TinyDB to SQLite")
+    source = tmp_path / "db.json"
+    source.write_text(
+        json.dumps({"book": {"42": {"topic": "Migrated", "chapters": []}}})
+    )
+    assert migrate_from_json(str(source)) == 1
+    assert migrate_from_json(str(source)) == 1
+    assert get_book(42) == Book(book_id=42, topic="Migrated", chapters=[])
+
+
+def test_book_summaries():
+    book_id = add_book(
+        {"topic": "Summaries", "title": "Summarized", "chapters": make_chapters("A")}
+    )
+    summary = next(
+        book for book in book_summaries(["topic"]) if book["book_id"] == book_id
+    )
+    assert summary == {"book_id": book_id, "topic": "Summaries"}
+    update_book(book_id, "topic", "Updated Summaries")
+    summaries = book_summaries(["topic", "chapters", "author"])
+    summary = next(book for book in summaries if book["book_id"] == book_id)
+    assert summary["topic"] == "Updated Summaries"
+    assert summary["chapters"] == [chapter.to_dict() for chapter in make_chapters("A")]
+    assert summary["author"] is None
+
+
+def test_unfinished_book_summaries():
+    chapters = [Chapter("A", [], "Text")]
+    book_id = add_book(
+        {"topic": "Done", "title": "T", "author": "A", "chapters": chapters}
+    )
+    assert all(
+        book["book_id"] != book_id for book in unfinished_book_summaries(["topic"])
+    )
+    delete_book_field(book_id, "title")
+    assert {"book_id": book_id, "topic": "Done"} in unfinished_book_summaries(["topic"])
+    delete_book(book_id)
+    assert all(book["book_id"] != book_id for book in book_summaries(["topic"]))
+
+
+def test_index_is_rebuilt_when_missing(setup_and_teardown):
+    if setup_and_teardown != "tinydb":
+        pytest.skip("only the TinyDB backend keeps a separate index file")
+    book_id = add_book({"topic": "Reindexed"})
+    close_db()
+    Path("instance/test_db.index.json").unlink()
+    assert {"book_id": book_id, "topic": "Reindexed"} in book_summaries(["topic"])
+
+
+def test_completion_is_kept_up_to_date():
+    book_id = add_book(
+        {"title": "T", "author": "A", "chapters": make_chapters("I.", "II.")}
+    )
+    assert get_completion(book_id)["unwritten_chapters"] == 2
+    update_chapter(book_id, 0, Chapter("I.", [], "a b c"))
+    completion = get_completion(book_id)
+    assert completion["unwritten_chapters"] == 1
+    assert completion["word_count"] == 3
+    assert book_id in [b["book_id"] for b in book_summaries([], max_chapters_left=1)]
+    delete_chapter(book_id, 1)
+    completion = get_completion(book_id)
+    assert completion["ready"]
+    assert completion["chapters"] == [{"words": 3, "written": True}]
+    assert book_id in [b["book_id"] for b in book_summaries([], ready=True)]
+    delete_book_field(book_id, "title")
+    assert get_completion(book_id)["missing_fields"] == ["title"]
+    assert book_id in [b["book_id"] for b in book_summaries([], ready=False)]
+
+
+def test_summaries_include_completion():
+    chapters = [Chapter("I.", [], "a b")]
+    book_id = add_book({"topic": "Counted", "chapters": chapters})
+    summary = next(
+        book
+        for book in book_summaries(["topic", "word_count", "missing_fields"])
+        if book["book_id"] == book_id
+    )
+    assert summary == {
+        "book_id": book_id,
+        "topic": "Counted",
+        "word_count": 2,
+        "missing_fields": ["title", "author"],
+    }
+
+
+def test_sqlite_schema_is_migrated(setup_and_teardown):
+    if setup_and_teardown != "sqlite":
+        pytest.skip("only the SQLite backend has a versioned schema")
+    close_db()
+    delete_test_db()
+    connection = sqlite3.connect("instance/test_db.sqlite")
+    connection.executescript(sqlite_storage.schema)
+    connection.execute(
+        "INSERT INTO books (id, fields, has_chapters) VALUES (7, ?, 1)",
+        (json.dumps({"title": "Old", "author": "Old Author"}),),
+    )
+    connection.execute(
+        "INSERT INTO chapters VALUES (7, 0, 'I.', '[]', 'old words', '{}', 1)"
+    )
+    connection.commit()
+    connection.close()
+    completion = get_completion(7)
+    assert completion["word_count"] == 2
+    assert completion["ready"]
+
+
+def test_unknown_fields_are_kept():
+    book_id = add_book({"title": "Old Book", "subtitle": "Kept in storage"})
+    book = get_book(book_id)
+    assert book.extra == {"subtitle": "Kept in storage"}
+    assert book.fields() == {
+        "book_id": book_id,
+        "title": "Old Book",
+        "subtitle": "Kept in storage",
+    }
+
+
+def blob_files():
+    """Helper to list the stored blobs of the test database"""
+    return [
+        path for path in Path("instance/test_db.blobs").rglob("*") if path.is_file()
+    ]
+
+
+def test_content_is_kept_in_blobs(setup_and_teardown):
+    if setup_and_teardown != "tinydb":
+        pytest.skip("only the TinyDB backend keeps content in blobs")
+    text = "Prose that should stay out of the database file."
+    chapters = [Chapter("I.", [], text), Chapter("II.", [], text)]
+    book_id = add_book({"title": "Blobbed", "chapters": chapters})
+    close_db()
+    assert text not in Path("instance/test_db.json").read_text()
+    assert get_book(book_id).chapters == chapters
+    assert book_summaries(["chapters"])[-1]["chapters"][0]["content"] == text
+
+
+def test_unused_blobs_are_removed(setup_and_teardown):
+    if setup_and_teardown != "tinydb":
+        pytest.skip("only the TinyDB backend keeps content in blobs")
+    for path in blob_files():
+        path.unlink()
+    shared = Chapter("I.", [], "Shared text")
+    first = add_book({"title": "First", "chapters": [shared, Chapter("II.", [], "A")]})
+    second = add_book({"title": "Second", "chapters": [shared]})
+    assert len(blob_files()) == 2
+    update_chapter(first, 1, Chapter("II.", [], "B"))
+    # released blobs are only deleted once the database is flushed
+    assert len(blob_files()) == 3
+    flush_db()
+    assert len(blob_files()) == 2
+    delete_book(first)
+    flush_db()
+    assert len(blob_files()) == 1
+    assert get_book(second).chapters == [shared]
+    delete_chapter(second, 0)
+    close_db()
+    assert blob_files() == []
+
+
+def test_migrate_copies_blobs(setup_and_teardown, tmp_path):
+    if setup_and_teardown != "sqlite":
+        pytest.skip("migration goes from TinyDB to SQLite")
+    from autobook import blobs
+
+    source = tmp_path / "db.json"
+    key = blobs.put(blobs.directory_for(str(source)), "Blob text")
+    chapters = [{"header": "I.", "sections": [], "blob": key}]
+    source.write_text(json.dumps({"book": {"43": {"chapters": chapters}}}))
+    assert migrate_from_json(str(source)) == 1
+    assert get_book(43).chapters == [Chapter("I.", [], "Blob text")]
+
+
+# Each writer adds books and writes its share of the chapters of one book
+writer = """
+import sys
+from autobook.database import add_book, update_book, update_chapter
+from autobook.models import Chapter
+
+book_id, number, writers = map(int, sys.argv[1:])
+for index in range(number, 8, writers):
+    update_chapter(book_id, index, Chapter(f"{index}.", [], f"Text {index}"))
+    add_book({"title": f"Writer {number}"})
+update_book(book_id, "title", f"Written by {number}")
+"""
+
+
+def test_processes_writing_at_once_lose_nothing():
+    chapters = [Chapter(f"{index}.", []) for index in range(8)]
+    book_id = add_book({"title": "Shared", "chapters": chapters})
+    initial_count = len(all_books())
+    writers = [
+        subprocess.Popen([sys.executable, "-c", writer, str(book_id), str(number), "4"])
+        for number in range(4)
+    ]
+    assert [process.wait() for process in writers] == [0] * 4
+    book = get_book(book_id)
+    assert [chapter.content for chapter in book.chapters] == [
+        f"Text {index}" for index in range(8)
+    ]
+    assert book.title.startswith("Written by")
+    assert len(all_books()) == initial_count + 8
+    assert get_completion(book_id)["unwritten_chapters"] == 0
+
+
+def open_handles_after_fork(book_id):
+    # Count the handles a forked child starts with, then read through its own
+    handles = len(sqlite_storage._connections) + len(tinydb_storage._databases)
+    return handles, get_book(book_id).title
+
+
+def test_forked_processes_open_their_own_handles():
+    book_id = add_book({"title": "Forked"})
+    with multiprocessing.get_context("fork").Pool(1) as pool:
+        assert pool.apply(open_handles_after_fork, (book_id,)) == (0, "Forked")
+
+
+def test_search_follows_changes():
+    chapters = [Chapter("I. Kelp", [], "Seaweed forests"), Chapter("II. Coral", [])]
+    book_id = add_book({"title": "Under the sea", "chapters": chapters})
+    hits = lambda query: [
+        (result["chapter"], result["field"])
+        for result in search_books(query)
+        if result["book_id"] == book_id
+    ]
+    assert hits("seaweed") == [(0, "chapters")]
+    move_chapter(book_id, 0, 1)
+    update_chapter(book_id, 0, Chapter("II. Coral", [], "Reefs of coral"))
+    assert (hits("seaweed"), hits("reefs")) == ([(1, "chapters")], [(0, "chapters")])
+    update_book(book_id, "title", "Above the waves")
+    assert (hits("under"), hits("waves")) == ([], [(None, "title")])
+    delete_book(book_id)
+    assert hits("waves") == []
+
+
+def test_search_index_failures_do_not_fail_saves(monkeypatch, capsys):
+    book_id = add_book({"title": "Lighthouse keeper"})
+    search_books("lighthouse")
+
+    def locked(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(search, "index_field", locked)
+    update_book(book_id, "title", "Harbour master")
+    assert get_book(book_id).title == "Harbour master"
+    assert "rebuilt" in capsys.readouterr().out
+    monkeypatch.undo()
+    assert [result["book_id"] for result in search_books("harbour")] == [book_id]
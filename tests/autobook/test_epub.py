@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+import dataclasses
+import pytest
+from autobook import epub
+from autobook.models import Chapter
+
+chapters = [
+    Chapter("I. Chapter 1", [], "First.\nSecond."),
+    Chapter("II. Chapter 2", [], "Third."),
+]
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Keep every test's cache in its own temporary directory"""
+    monkeypatch.setenv("AUTOBOOK_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.delenv("AUTOBOOK_NO_CACHE", raising=False)
+
+
+def test_create_chapter_file():
+    xhtml = epub.create_chapter_file(
+        "First.\nSecond.", "I. Chapter 1", "chapter_1.xhtml", "style.css"
+    )
+    assert xhtml.content == "<h2>I. Chapter 1</h2><p>First.</p><p>Second.</p>"
+
+
+def test_chapters_to_book_skips_unchanged_export(tmp_path, mocker):
+    file_path = str(tmp_path / "book.epub")
+    epub.chapters_to_book(chapters, "Title", "Author", file_path=file_path)
+    write_epub = mocker.spy(epub.epub, "write_epub")
+    epub.chapters_to_book(chapters, "Title", "Author", file_path=file_path)
+    write_epub.assert_not_called()
+    changed = [dataclasses.replace(chapters[0], content="Changed."), chapters[1]]
+    epub.chapters_to_book(changed, "Title", "Author", file_path=file_path)
+    write_epub.assert_called_once()
+
+
+def test_chapters_to_book_rewrites_changed_file(tmp_path, mocker):
+    file_path = tmp_path / "book.epub"
+    epub.chapters_to_book(chapters, "Title", "Author", file_path=str(file_path))
+    file_path.write_bytes(b"replaced by someone else")
+    write_epub = mocker.spy(epub.epub, "write_epub")
+    epub.chapters_to_book(chapters, "Title", "Author", file_path=str(file_path))
+    write_epub.assert_called_once()
+
+
+def test_cover_png_is_cached_and_small():
+    epub.cover_png.cache_clear()
+    cover = epub.cover_png(16, 16, "blue")
+    assert cover.startswith(b"\x89PNG")
+    assert epub.cover_png(16, 16, "blue") is cover
+    assert epub.cover_png(16, 16, "red") != cover
+    assert len(epub.cover_png()) < 2048
+
+
+def test_chapters_to_book_leaves_no_cover_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    epub.chapters_to_book(chapters, "Title", "Author", file_path="book.epub")
+    assert not (tmp_path / "cover.png").exists()
+    assert (tmp_path / "book.epub").exists()
@@ -0,0 +1,38 @@
+import subprocess
+import sys
+from autobook import locks
+
+# Exits with 1 if the lock of the file is held by another process
+try_lock = """
+import fcntl, os, sys
+handle = os.open(sys.argv[1] + ".lock", os.O_RDWR | os.O_CREAT)
+try:
+    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+except BlockingIOError:
+    sys.exit(1)
+"""
+
+
+def lock_is_free(path):
+    return subprocess.run([sys.executable, "-c", try_lock, path]).returncode == 0
+
+
+def test_lock_keeps_out_other_processes(tmp_path):
+    path = str(tmp_path / "db.json")
+    with locks.locked(path):
+        assert not lock_is_free(path)
+    assert lock_is_free(path)
+
+
+def test_release_without_lock_does_nothing(tmp_path):
+    locks.release(str(tmp_path / "db.json"))
+
+
+def test_atomic_write_replaces_file(tmp_path):
+    path = tmp_path / "data" / "db.json"
+    locks.atomic_write(str(path), b"old")
+    inode = path.stat().st_ino
+    locks.atomic_write(str(path), b"new")
+    assert path.read_bytes() == b"new"
+    assert path.stat().st_ino != inode
+    assert [entry.name for entry in path.parent.iterdir()] == ["db.json"]
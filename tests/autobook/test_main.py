@@ -1,5 +1,6 @@
 import pytest
 from autobook import main
+from autobook.models import Book, Chapter
 
 
 @pytest.fixture
@@ -8,21 +9,25 @@ def mock_db(mocker):
     mocker.patch("autobook.main.db")
     mocker.patch(
         "autobook.main.db.get_book",
-        return_value={"book_id": 1, "topic": "Fiction", "content": "lorem ipsum"},
+        return_value=Book(book_id=1, topic="Fiction", outline="lorem ipsum"),
     )
     mocker.patch(
-        "autobook.main.db.all_books",
+        "autobook.main.db.book_summaries",
         return_value=[
             {"book_id": 1, "topic": "Fiction"},
             {"book_id": 2, "topic": "Non-Fiction"},
         ],
     )
     mocker.patch(
-        "autobook.main.db.unfinished_books",
+        "autobook.main.db.unfinished_book_summaries",
         return_value=[{"book_id": 1, "topic": "Fiction"}],
     )
     mocker.patch("autobook.main.db.add_book", return_value=3)
     mocker.patch("autobook.main.db.update_book")
+    mocker.patch("autobook.main.db.update_chapter")
+    mocker.patch("autobook.main.db.insert_chapter")
+    mocker.patch("autobook.main.db.move_chapter")
+    mocker.patch("autobook.main.db.delete_chapter")
     mocker.patch("autobook.main.db.delete_book")
     mocker.patch("autobook.main.db.delete_book_field")
     mocker.patch("autobook.main.book")
@@ -31,7 +36,7 @@ def mock_db(mocker):
 
 def test_list_book_found(mock_db):
     book = main.list_book(1)
-    assert book == {"book_id": 1, "topic": "Fiction", "content": "lorem ipsum"}
+    assert book == {"book_id": 1, "topic": "Fiction", "outline": "lorem ipsum"}
 
 
 def test_list_book_not_found(mocker, capsys):
@@ -70,7 +75,7 @@ def test_generate_field_content(mock_db):
 
 
 def test_load_from_book(mock_db):
-    content = main.load_from_book(1, "content")
+    content = main.load_from_book(1, "outline")
     assert content == "lorem ipsum"
 
 
@@ -79,6 +84,28 @@ def test_save_to_book(mock_db):
     main.db.update_book.assert_called_once_with(1, "content", "new content")
 
 
+def test_save_chapter(mock_db):
+    chapter = Chapter("I. One", [], "Text")
+    main.save_chapter(1, 0, chapter)
+    main.db.update_chapter.assert_called_once_with(1, 0, chapter)
+
+
+def test_insert_chapter(mock_db):
+    chapter = Chapter("I. One", [])
+    main.insert_chapter(1, 2, chapter)
+    main.db.insert_chapter.assert_called_once_with(1, 2, chapter)
+
+
+def test_move_chapter(mock_db):
+    main.move_chapter(1, 0, 3)
+    main.db.move_chapter.assert_called_once_with(1, 0, 3)
+
+
+def test_delete_chapter(mock_db):
+    main.delete_chapter(1, 2)
+    main.db.delete_chapter.assert_called_once_with(1, 2)
+
+
 def test_delete_book(mock_db):
     main.delete_book(1)
     main.db.delete_book.assert_called_once_with(1)
@@ -87,3 +114,129 @@ def test_delete_book(mock_db):
 def test_delete_book_field(mock_db):
     main.delete_book_field(1, "content")
     main.db.delete_book_field.assert_called_once_with(1, "content")
+
+
+def test_generate_chapter_contents(mock_db):
+    chapters = [
+        Chapter("I. One", [], "done"),
+        Chapter("II. Two", []),
+    ]
+    main.book.generate_contents.return_value = iter([(1, "new content")])
+    written = main.generate_chapter_contents(1, chapters, {1: {"chapter": "II. Two"}})
+    assert written == 1
+    assert chapters[1].content == "new content"
+    main.db.update_chapter.assert_called_once_with(1, 1, chapters[1])
+
+
+def test_stream_chapter_content(mock_db, monkeypatch):
+    monkeypatch.setenv("AUTOBOOK_CHECKPOINT_TOKENS", "2")
+    chapters = [Chapter("I. One", [])]
+    main.book.generate_content_stream.return_value = iter(["a", "b", "c "])
+    content = main.stream_chapter_content(1, chapters, 0, {})
+    assert content == "abc"
+    assert chapters[0] == Chapter("I. One", [], "abc")
+    # one checkpoint after two pieces, then the final save
+    assert main.db.update_chapter.call_count == 2
+
+
+def test_stream_chapter_content_keeps_partial_content(mock_db):
+    chapters = [Chapter("I. One", [])]
+
+    def interrupted_stream():
+        yield "paid for"
+        raise KeyboardInterrupt
+
+    main.book.generate_content_stream.return_value = interrupted_stream()
+    with pytest.raises(KeyboardInterrupt):
+        main.stream_chapter_content(1, chapters, 0, {})
+    assert chapters[0].content == "paid for"
+    assert chapters[0].partial
+    main.db.update_chapter.assert_called_with(1, 0, chapters[0])
+
+
+def test_stream_chapter_content_resumes_partial_content(mock_db):
+    chapters = [Chapter("I. One", [], "a", partial=True)]
+    main.book.generate_content_stream.return_value = iter(["b"])
+    assert main.stream_chapter_content(1, chapters, 0, {"x": 1}) == "ab"
+    main.book.generate_content_stream.assert_called_once_with({"x": 1}, "content", "a")
+    assert not chapters[0].partial
+
+
+def test_export_book(mocker):
+    export = mocker.patch.dict(main.exporters, {"txt": mocker.Mock()})
+    seconds = main.export_book(1, "txt", "out/1.txt")
+    export["txt"].assert_called_once_with(1, "out/1.txt")
+    assert seconds >= 0
+
+
+def test_exportable_books(mock_db, mocker):
+    mocker.patch(
+        "autobook.main.db.book_summaries",
+        return_value=[
+            {"book_id": 1, "chapter_count": 3},
+            {"book_id": 2, "chapter_count": 0},
+        ],
+    )
+    assert main.exportable_books() == [1]
+
+
+def test_export_books(mock_db, mocker, tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    mocker.patch("autobook.main.futures.ProcessPoolExecutor", ThreadPoolExecutor)
+    mocker.patch.dict(
+        main.exporters,
+        {"txt": mocker.Mock(), "epub": mocker.Mock(side_effect=ValueError("bad"))},
+    )
+    results = list(main.export_books([1, 2], ["txt", "epub"], str(tmp_path)))
+    assert sorted((book_id, format) for book_id, format, _, _ in results) == [
+        (1, "txt"),
+        (2, "txt"),
+    ]
+    assert {path for _, _, path, _ in results} == {
+        str(tmp_path / "1.txt"),
+        str(tmp_path / "2.txt"),
+    }
+
+
+def test_usage_stats(mocker):
+    records = [{"book_id": 1}]
+    load = mocker.patch("autobook.main.metrics.load", return_value=records)
+    summarize = mocker.patch("autobook.main.metrics.summarize", return_value={})
+    assert main.usage_stats(1) == {}
+    load.assert_called_once_with(1)
+    summarize.assert_called_once_with(records)
+
+
+def test_generate_chapter_contents_reuses_task_results(mock_db, mocker):
+    run = mocker.patch("autobook.main.tasks.run", side_effect=lambda key, f: key)
+    mocker.patch(
+        "autobook.main.book.generate_contents",
+        side_effect=lambda jobs, generate: [
+            (index, generate(*job)) for index, job in jobs.items()
+        ],
+    )
+    chapters = [Chapter("I.", [])]
+    assert main.generate_chapter_contents(1, chapters, {0: {}}, "job") == 1
+    assert chapters[0].content == "job/chapter/0"
+    run.assert_called_once()
+
+
+def test_write_ahead(mock_db):
+    main.book.generate_content.side_effect = (
+        lambda args, _: f"Text of {args['chapter']}"
+    )
+    main.write_ahead({"chapter": "II.", "outline": "I.\nII."})
+    assert main.take_written_ahead({"chapter": "II.", "outline": "changed"}) is None
+    ahead = main.take_written_ahead({"chapter": "II.", "outline": "I.\nII."})
+    assert main.ahead_content(ahead) == "Text of II."
+    # content is only taken once
+    assert main.take_written_ahead({"chapter": "II.", "outline": "I.\nII."}) is None
+
+
+def test_write_ahead_replaces_chapter_and_survives_failure(mock_db):
+    main.book.generate_content.side_effect = RuntimeError("API down")
+    main.write_ahead({"chapter": "II."})
+    main.write_ahead({"chapter": "III."})
+    assert main.take_written_ahead({"chapter": "II."}) is None
+    assert main.ahead_content(main.take_written_ahead({"chapter": "III."})) is None
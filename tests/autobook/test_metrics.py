@@ -0,0 +1,47 @@
+import pytest
+from autobook import metrics
+
+
+@pytest.fixture(autouse=True)
+def metrics_file(tmp_path, monkeypatch):
+    # Keep every test's records in its own temporary file
+    monkeypatch.setenv("AUTOBOOK_METRICS_FILE", str(tmp_path / "metrics.jsonl"))
+    return tmp_path / "metrics.jsonl"
+
+
+def test_load_without_file():
+    assert metrics.load() == []
+
+
+def test_record_and_load():
+    metrics.record("gpt-3.5-turbo-16k", "title", 1, 100, 10, 0.5)
+    metrics.record("gpt-3.5-turbo-16k", "content", 2, 1000, 500, 2.0)
+    assert len(metrics.load()) == 2
+    [record] = metrics.load(2)
+    assert record["prompt_type"] == "content"
+    assert record["completion_tokens"] == 500
+
+
+def test_load_skips_broken_lines(metrics_file):
+    metrics.record("gpt-3.5-turbo-16k", "title", 1, 100, 10, 0.5)
+    with open(metrics_file, "a") as file:
+        file.write('{"time": 1')
+    assert len(metrics.load()) == 1
+
+
+def test_cost():
+    assert metrics.cost("gpt-3.5-turbo-16k", 1000, 1000) == pytest.approx(0.007)
+    assert metrics.cost("unknown-model", 1000, 1000) == 0
+
+
+def test_summarize():
+    metrics.record("gpt-3.5-turbo-16k", "title", 1, 100, 10, 0.5)
+    metrics.record("gpt-3.5-turbo-16k", "title", 1, 0, 0, 0.0, cached=True)
+    metrics.record("gpt-3.5-turbo-16k", "content", 1, 1000, 500, 2.0)
+    summary = metrics.summarize(metrics.load())
+    assert list(summary) == ["content", "title", "total"]
+    assert summary["title"]["calls"] == 2
+    assert summary["title"]["cached"] == 1
+    assert summary["title"]["latency"] == pytest.approx(0.5)
+    assert summary["total"]["prompt_tokens"] == 1100
+    assert summary["total"]["cost"] == pytest.approx(0.00534)
@@ -0,0 +1,52 @@
+import sys
+from autobook.models import Book, Chapter, serialize
+
+
+def test_chapter_round_trip():
+    record = {"header": "I. One", "sections": ["1. A"], "content": "Text"}
+    chapter = Chapter.from_dict(record)
+    assert chapter == Chapter("I. One", ["1. A"], "Text")
+    assert chapter.to_dict() == record
+    assert chapter.to_dict()["sections"] is not chapter.sections
+
+
+def test_partial_chapter_round_trip():
+    record = {"header": "I. One", "sections": [], "content": "Te", "partial": True}
+    assert Chapter.from_dict(record).partial
+    assert Chapter.from_dict(record).to_dict() == record
+
+
+def test_chapter_is_smaller_than_its_dict():
+    chapter = Chapter("I. One", ["1. A"], "Text")
+    assert not hasattr(chapter, "__dict__")
+    assert sys.getsizeof(chapter) < sys.getsizeof(chapter.to_dict())
+
+
+def test_book_from_dict():
+    record = {
+        "book_id": 4,
+        "title": "Title",
+        "num_chapters": 3,
+        "chapters": [{"header": "I. One", "sections": [], "content": ""}],
+        "unknown": "kept",
+    }
+    book = Book.from_dict(record)
+    assert book.title == "Title"
+    assert book.author is None
+    assert book.chapters == [Chapter("I. One", [])]
+    assert book.extra == {"unknown": "kept"}
+    assert book.fields() == {
+        "book_id": 4,
+        "title": "Title",
+        "num_chapters": 3,
+        "chapters": book.chapters,
+        "unknown": "kept",
+    }
+
+
+def test_serialize():
+    chapters = [Chapter("I. One", [], "Text")]
+    assert serialize("chapters", chapters) == [
+        {"header": "I. One", "sections": [], "content": "Text"}
+    ]
+    assert serialize("title", "Title") == "Title"
@@ -0,0 +1,94 @@
+import pytest
+from autobook import providers
+from autobook.book import string_to_chapters
+from autobook.prompts import prompts
+from autobook.providers import LocalProvider, Usage
+
+
+def ask(prompt):
+    return [{"role": "user", "content": prompt}]
+
+
+def test_local_provider_is_deterministic():
+    local = LocalProvider()
+    first, usage = local.complete(ask("Write something."), {})
+    assert local.complete(ask("Write something."), {}) == (first, usage)
+    assert local.complete(ask("Write something else."), {})[0] != first
+
+
+def test_local_provider_writes_outlines():
+    prompt = prompts["outline"].format(title="Title", topic="Topic", num_chapters=12)
+    content, _ = LocalProvider().complete(ask(prompt), {})
+    chapters = string_to_chapters(content)
+    assert len(chapters) == 12
+    assert chapters[11].header.startswith("XII. ")
+    assert all(1 <= len(chapter.sections) <= 3 for chapter in chapters)
+
+
+def test_local_provider_sizes(monkeypatch):
+    monkeypatch.setenv("AUTOBOOK_LOCAL_WORDS", "300")
+    content, usage = LocalProvider().complete(ask("Write a chapter."), {})
+    assert len(content.split()) == 300
+    assert usage.completion_tokens > 0
+    title, _ = LocalProvider().complete(ask(prompts["title"].format(topic="x")), {})
+    assert 3 <= len(title.split()) <= 6
+
+
+def test_local_provider_streams_the_same_content():
+    local = LocalProvider()
+    content, usage = local.complete(ask("Write a chapter."), {})
+    pieces = list(local.stream(ask("Write a chapter."), {}))
+    assert pieces[-1] == usage
+    assert "".join(pieces[:-1]) == content
+
+
+def test_local_provider_model_names_its_settings(monkeypatch):
+    local = LocalProvider()
+    monkeypatch.setenv("AUTOBOOK_LOCAL_WORDS", "300")
+    monkeypatch.setenv("AUTOBOOK_LOCAL_LATENCY", "0.5")
+    assert local.model == "local-300w-0.5s"
+    monkeypatch.setenv("AUTOBOOK_LOCAL_WORDS", "600")
+    assert local.model == "local-600w-0.5s"
+
+
+def test_provider_must_implement_requests():
+    class Incomplete(providers.Provider):
+        def complete(self, messages, logit_bias):
+            return "", Usage(0, 0)
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_local_provider_latency(monkeypatch, mocker):
+    sleep = mocker.patch("autobook.providers.time.sleep")
+    monkeypatch.setenv("AUTOBOOK_LOCAL_LATENCY", "2")
+    LocalProvider().complete(ask("Write."), {})
+    sleep.assert_called_once_with(2.0)
+
+
+def test_provider(monkeypatch):
+    monkeypatch.setenv("AUTOBOOK_PROVIDER", "local")
+    monkeypatch.delenv("AUTOBOOK_LOCAL_WORDS", raising=False)
+    monkeypatch.delenv("AUTOBOOK_LOCAL_LATENCY", raising=False)
+    assert providers.provider() is providers.provider()
+    assert providers.provider().model == "local-500w-0s"
+    monkeypatch.setenv("AUTOBOOK_PROVIDER", "nonsense")
+    with pytest.raises(ValueError):
+        providers.provider()
+
+
+def test_usage_total_tokens():
+    assert Usage(3, 4).total_tokens == 7
+
+
+def test_roman():
+    assert [providers.roman(n) for n in (1, 4, 9, 14, 40, 99, 100)] == [
+        "I",
+        "IV",
+        "IX",
+        "XIV",
+        "XL",
+        "XCIX",
+        "C",
+    ]
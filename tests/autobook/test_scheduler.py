@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+import pytest
+from types import SimpleNamespace
+from autobook import scheduler
+from autobook.scheduler import GenerationError, TokenBucket
+
+
+class RetryableError(Exception):
+    def __init__(self, headers=None):
+        super().__init__("try again")
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+class FatalError(Exception):
+    status_code = 401
+
+
+@pytest.fixture
+def sleeps(mocker):
+    # Record every sleep instead of waiting
+    return mocker.patch("autobook.scheduler.time.sleep")
+
+
+@pytest.fixture(autouse=True)
+def fresh_buckets(monkeypatch):
+    monkeypatch.setattr(scheduler, "_buckets", {})
+
+
+def failing_request(failures: list[Exception]):
+    # Return a request that raises each of the given errors before succeeding
+    def request():
+        if failures:
+            raise failures.pop(0)
+        return "response"
+
+    return request
+
+
+def test_token_bucket_takes_available_units(sleeps):
+    bucket = TokenBucket(60)
+    assert bucket.acquire(30) == 0
+    assert bucket.acquire(30) == 0
+    sleeps.assert_not_called()
+
+
+def test_token_bucket_waits_when_empty(sleeps, mocker):
+    clock = mocker.patch("autobook.scheduler.time.monotonic", return_value=0.0)
+    bucket = TokenBucket(60)
+    bucket.acquire(60)
+    sleeps.side_effect = lambda seconds: setattr(
+        clock, "return_value", clock.return_value + seconds
+    )
+    assert bucket.acquire(2) == pytest.approx(2)
+
+
+def test_token_bucket_settle():
+    bucket = TokenBucket(100)
+    bucket.acquire(10)
+    bucket.settle(40)
+    assert bucket.available == pytest.approx(50, abs=1)
+
+
+def test_retry_after():
+    assert scheduler.retry_after(RetryableError({"retry-after": "3"})) == 3
+    assert scheduler.retry_after(RetryableError({"retry-after-ms": "1500"})) == 1.5
+    assert scheduler.retry_after(RetryableError()) is None
+
+
+def test_backoff_delay_is_capped():
+    assert 0 <= scheduler.backoff_delay(10, cap=5) <= 5
+
+
+def test_schedule_retries_retryable_errors(sleeps):
+    request = failing_request([RetryableError(), RetryableError({"retry-after": "7"})])
+    assert scheduler.schedule(request, (RetryableError,)) == "response"
+    assert sleeps.call_count == 2
+    sleeps.assert_called_with(7.0)
+
+
+def test_schedule_retries_quietly(sleeps, capsys):
+    request = failing_request([RetryableError()])
+    with scheduler.quiet():
+        assert scheduler.schedule(request, (RetryableError,)) == "response"
+    assert capsys.readouterr().out == ""
+
+
+def test_schedule_gives_up_after_max_attempts(sleeps, monkeypatch):
+    monkeypatch.setenv("AUTOBOOK_MAX_ATTEMPTS", "3")
+    request = failing_request([RetryableError() for _ in range(5)])
+    with pytest.raises(GenerationError) as error:
+        scheduler.schedule(request, (RetryableError,))
+    assert error.value.attempts == 3
+    assert error.value.kind == "RetryableError"
+
+
+def test_schedule_does_not_retry_fatal_errors(sleeps):
+    request = failing_request([FatalError()])
+    with pytest.raises(GenerationError) as error:
+        scheduler.schedule(request, (RetryableError,), (FatalError,), name="Test API")
+    assert str(error.value).startswith("Test API request failed after 1 attempt(s)")
+    assert error.value.attempts == 1
+    assert error.value.status == 401
+    sleeps.assert_not_called()
+
+
+def test_estimate_text_tokens():
+    assert scheduler.estimate_text_tokens("Hello, world.") == 4
+    assert scheduler.estimate_text_tokens("internationalization") == 3
+    assert scheduler.estimate_text_tokens("") == 0
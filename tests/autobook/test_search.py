@@ -0,0 +1,114 @@
+import pytest
+from autobook import search
+
+
+@pytest.fixture(autouse=True)
+def index(tmp_path, monkeypatch):
+    # Keep every test's index in its own directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("AUTOBOOK_DB_FILENAME", "test_search")
+    yield
+    search.close_db()
+
+
+def chapter(header, content=""):
+    return {"header": header, "sections": [f"1. {header} section"], "content": content}
+
+
+def book_ids(query):
+    return [result["book_id"] for result in search.search(query)]
+
+
+def positions(query):
+    return [result["chapter"] for result in search.search(query)]
+
+
+def test_finds_every_part_of_a_book():
+    search.index_book(
+        1,
+        {
+            "title": "Orchards",
+            "topic": "growing fruit",
+            "outline": "I. Soil and water",
+            "author": "Nobody Searched",
+            "chapters": [chapter("I. Pruning", "Cut the branches in winter.")],
+        },
+    )
+    assert book_ids("orchard") == [1]
+    assert book_ids("fruit") == [1]
+    assert book_ids("soil water") == [1]
+    assert book_ids("pruning") == [1]
+    assert book_ids("branches") == [1]
+    assert book_ids("nobody") == []
+
+
+def test_results_are_ranked_and_grouped_by_book():
+    search.index_book(
+        1, {"chapters": [chapter("I. Intro", "apples " + "filler " * 50)]}
+    )
+    search.index_book(
+        2, {"title": "Apples", "chapters": [chapter("I. Intro", "apples and pears")]}
+    )
+    best, other = search.search("apples")
+    assert (best["book_id"], best["field"], best["matches"]) == (2, "title", 2)
+    assert (other["book_id"], other["chapter"]) == (1, 0)
+    assert "[apples]" in other["snippet"]
+    assert search.search("apples", limit=1) == [best]
+
+
+def test_query_needs_every_word_and_prefixes_the_last():
+    search.index_book(1, {"title": "History of rivers"})
+    search.index_book(2, {"title": "History of cities"})
+    assert book_ids("history rivers") == [1]
+    assert sorted(book_ids("hist")) == [1, 2]
+    assert sorted(book_ids('"of" (history) -')) == [1, 2]
+    assert search.search("  --  ") == []
+
+
+def test_fields_are_replaced_and_removed():
+    search.index_book(1, {"title": "Old name"})
+    search.index_field(1, "title", "New name")
+    assert book_ids("old") == []
+    assert book_ids("new") == [1]
+    search.index_field(1, "title", None)
+    assert book_ids("new") == []
+    search.index_field(1, "num_chapters", 3)
+    search.index_book(1, None)
+    assert search.search("name") == []
+
+
+def test_chapters_keep_their_positions():
+    search.index_book(1, {"chapters": [chapter(f"{n}. Part{n}") for n in "abc"]})
+    search.index_chapter(1, 1, chapter("b. Changed", "rewritten"))
+    assert positions("rewritten") == [1]
+    search.insert_chapter(1, 0, chapter("new. Inserted"))
+    assert (positions("parta"), positions("rewritten"), positions("inserted")) == (
+        [1],
+        [2],
+        [0],
+    )
+    # like list.insert, -1 is before the last chapter
+    search.move_chapter(1, 0, -1)
+    assert (positions("inserted"), positions("parta")) == ([2], [0])
+    search.delete_chapter(1, 1)
+    assert (positions("rewritten"), positions("inserted"), positions("partc")) == (
+        [],
+        [1],
+        [2],
+    )
+
+
+def test_rebuild_replaces_everything():
+    search.index_book(1, {"title": "Stale"})
+    assert not search.built()
+    assert search.rebuild([{"book_id": 2, "title": "Fresh"}]) == 1
+    assert search.built()
+    assert (book_ids("stale"), book_ids("fresh")) == ([], [2])
+
+
+def test_invalidate_marks_the_index_for_rebuilding():
+    search.rebuild([{"book_id": 1, "title": "Fresh"}])
+    search.invalidate()
+    assert not search.built()
+    search.rebuild([])
+    assert search.built()
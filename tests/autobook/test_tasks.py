@@ -0,0 +1,84 @@
+import os
+import subprocess
+import sys
+import pytest
+from autobook import tasks
+from autobook.tasks import TaskBusy, TaskFailed
+
+
+@pytest.fixture(autouse=True)
+def queue(tmp_path, monkeypatch):
+    # Keep every test's queue in its own directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("AUTOBOOK_DB_FILENAME", "test_queue")
+    yield
+    tasks.close_db()
+
+
+def test_run_computes_once():
+    calls = []
+    compute = lambda: calls.append(1) or {"value": len(calls)}
+    assert tasks.run("a", compute) == {"value": 1}
+    assert tasks.run("a", compute) == {"value": 1}
+    assert len(calls) == 1
+    task = tasks.get("a")
+    assert (task["state"], task["attempts"]) == ("done", 1)
+
+
+def test_run_survives_a_new_connection():
+    tasks.run("a", lambda: 5)
+    tasks.close_db()
+    assert tasks.run("a", lambda: 6) == 5
+
+
+def test_failed_task_is_retried_until_out_of_attempts(monkeypatch):
+    monkeypatch.setenv("AUTOBOOK_TASK_ATTEMPTS", "2")
+
+    def broken():
+        raise ValueError("nope")
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            tasks.run("a", broken)
+    assert tasks.get("a")["error"] == "ValueError: nope"
+    with pytest.raises(TaskFailed):
+        tasks.run("a", lambda: 1)
+    assert tasks.reset("a") == 1
+    assert tasks.run("a", lambda: 1) == 1
+
+
+def test_claim_is_exclusive():
+    assert tasks.claim("a")
+    assert not tasks.claim("a")
+    with pytest.raises(TaskBusy):
+        tasks.run("a", lambda: 1)
+
+
+def test_abandoned_task_is_taken_over():
+    process = subprocess.run(
+        [sys.executable, "-c", "import os; print(os.getpid())"],
+        capture_output=True,
+        text=True,
+    )
+    dead_pid = int(process.stdout)
+    tasks.claim("a")
+    tasks.connect().execute(
+        "UPDATE tasks SET owner = ? WHERE key = 'a'",
+        (f"{tasks.worker_id().rpartition(':')[0]}:{dead_pid}",),
+    )
+    assert tasks.run("a", lambda: 1) == 1
+    assert tasks.get("a")["attempts"] == 2
+
+
+def test_expired_lease_is_taken_over(monkeypatch):
+    tasks.claim("a")
+    monkeypatch.setenv("AUTOBOOK_TASK_LEASE", "-1")
+    assert tasks.claim("a")
+
+
+def test_all_tasks():
+    tasks.run("job/1", lambda: 1)
+    tasks.run("job/2", lambda: 2)
+    tasks.run("other", lambda: 3)
+    assert [task["result"] for task in tasks.all_tasks("job/")] == [1, 2]
+    assert os.path.exists("instance/test_queue.tasks.sqlite")
@@ -0,0 +1,97 @@
+import contextvars
+import json
+import threading
+import time
+import pytest
+from autobook import tracing
+
+
+@pytest.fixture(autouse=True)
+def stopped():
+    yield
+    tracing.stop()
+
+
+def test_span_is_shared_null_context_while_off():
+    assert tracing.span("a") is tracing.span("b", key=1)
+    with tracing.span("a"):
+        pass
+    assert tracing.stop() == []
+
+
+def test_spans_nest():
+    tracing.start()
+    with tracing.span("outer", book_id=3):
+        with tracing.span("inner"):
+            assert tracing.current() is not None
+    assert tracing.current() is None
+    inner, outer = tracing.stop()
+    assert (inner["name"], outer["name"]) == ("inner", "outer")
+    assert inner["parent"] == outer["id"]
+    assert outer["parent"] is None
+    assert outer["book_id"] == 3
+    assert outer["duration"] >= inner["duration"]
+
+
+def test_traced_keeps_result_and_name():
+    @tracing.traced("double")
+    def double(x):
+        """Double x"""
+        return x * 2
+
+    assert double(2) == 4
+    tracing.start()
+    assert double(3) == 6
+    assert double.__doc__ == "Double x"
+    assert [span["name"] for span in tracing.stop()] == ["double"]
+
+
+def test_threads_with_copied_context_are_children():
+    tracing.start()
+    with tracing.span("parent"):
+        context = contextvars.copy_context()
+        thread = threading.Thread(
+            target=context.run, args=(_child_span,), name="worker"
+        )
+        thread.start()
+        thread.join()
+    child, parent = tracing.stop()
+    assert child["parent"] == parent["id"]
+    assert child["thread"] == "worker"
+
+
+def _child_span():
+    with tracing.span("child"):
+        pass
+
+
+def test_record_adds_span_with_given_start_and_parent():
+    tracing.start()
+    start = time.perf_counter()
+    tracing.record("api.stream", start, 7, tokens=10)
+    (span,) = tracing.stop()
+    assert (span["name"], span["parent"], span["tokens"]) == ("api.stream", 7, 10)
+    assert span["duration"] >= 0
+
+
+def test_summarize_subtracts_children():
+    spans = [
+        {"id": 2, "parent": 1, "name": "api", "duration": 3.0},
+        {"id": 3, "parent": 1, "name": "api", "duration": 4.0},
+        {"id": 1, "parent": None, "name": "command", "duration": 10.0},
+    ]
+    summary = tracing.summarize(spans)
+    assert list(summary) == ["api", "command"]
+    assert summary["api"] == {"calls": 2, "total": 7.0, "self": 7.0, "max": 4.0}
+    assert summary["command"]["self"] == 3.0
+
+
+def test_write_produces_json_lines(tmp_path, monkeypatch):
+    monkeypatch.setenv("AUTOBOOK_TRACE_FILE", str(tmp_path / "traces/run.jsonl"))
+    tracing.start()
+    with tracing.span("a"):
+        pass
+    path = tracing.trace_path()
+    tracing.write(tracing.stop(), path)
+    (line,) = path.read_text().splitlines()
+    assert json.loads(line)["name"] == "a"
@@ -0,0 +1,69 @@
+import json
+from benchmarks import bench
+from benchmarks.synthetic import make_book, make_chapters, roman
+
+
+def test_make_book():
+    book = make_book(3, 200, seed=1)
+    assert [chapter.header for chapter in book["chapters"]] == [
+        "I. Chapter 1",
+        "II. Chapter 2",
+        "III. Chapter 3",
+    ]
+    assert all(len(c.content.split()) == 200 for c in book["chapters"])
+    assert make_book(3, 200, seed=1) == book
+    assert make_chapters(2, 0)[0].content == ""
+
+
+def test_roman():
+    assert [roman(n) for n in (4, 19, 44, 99, 140)] == [
+        "IV",
+        "XIX",
+        "XLIV",
+        "XCIX",
+        "CXL",
+    ]
+
+
+def test_run_writes_results(tmp_path, monkeypatch):
+    monkeypatch.setattr(bench, "book_shapes", [(3, 100)])
+    monkeypatch.setattr(bench, "generation_shapes", [(2, 100)])
+    output = tmp_path / "results.json"
+    bench.run(
+        str(output),
+        ["outline", "database", "search", "export", "generation"],
+        1,
+        [10],
+        ["tinydb", "sqlite"],
+    )
+    report = json.loads(output.read_text())
+    names = {result["name"] for result in report["results"]}
+    assert {
+        "book.string_to_chapters",
+        "database.update_chapter",
+        "search.common_word",
+        "epub.chapters_to_book.unchanged",
+        "text.chapters_to_text",
+        "main.generate_book",
+    } <= names
+    assert all(result["median"] >= 0 for result in report["results"])
+    assert {
+        (entry["params"]["backend"], entry["params"]["model"])
+        for entry in report["memory"]
+    } == {
+        ("tinydb", "dict"),
+        ("tinydb", "Book"),
+        ("sqlite", "dict"),
+        ("sqlite", "Book"),
+    }
+    assert all(entry["bytes"] > 0 for entry in report["memory"])
+
+
+def test_startup_skips_heavy_modules(tmp_path, monkeypatch):
+    monkeypatch.setattr(bench, "startup_commands", [["list"]])
+    output = tmp_path / "results.json"
+    bench.run(str(output), ["startup"], 1, [10], ["tinydb"])
+    (result,) = json.loads(output.read_text())["results"]
+    assert result["name"] == "cli.startup"
+    assert result["heavy_modules"] == []
+    assert result["imports"] > 0
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import io
+import json
+import sys
+import pytest
+from autobook import database, tasks
+from cli import batch_command
+from cli.batch_command import JobOutput, batch_command as run_batch
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    # Write books offline into a library of their own
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("AUTOBOOK_DB_FILENAME", "test_batch")
+    monkeypatch.setenv("AUTOBOOK_PROVIDER", "local")
+    monkeypatch.setenv("AUTOBOOK_LOCAL_WORDS", "30")
+    monkeypatch.setenv("AUTOBOOK_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.delenv("AUTOBOOK_DB_BACKEND", raising=False)
+    monkeypatch.delenv("AUTOBOOK_NO_CACHE", raising=False)
+    yield tmp_path
+    database.close_db()
+    tasks.close_db()
+
+
+def write_jobs(path, *jobs):
+    path.write_text("".join(json.dumps(job) + "\n" for job in jobs))
+    return {"jobs_file": str(path), "retry": False, "workers": 2}
+
+
+def test_job_output_goes_to_the_log_of_the_job():
+    stream, log = io.StringIO(), io.StringIO()
+    output = JobOutput(stream)
+    output.write("before ")
+    token = batch_command._job_log.set(log)
+    output.write("inside")
+    batch_command._job_log.reset(token)
+    assert (stream.getvalue(), log.getvalue()) == ("before ", "inside")
+
+
+def test_report_skips_job_output(monkeypatch, capsys):
+    monkeypatch.setattr(sys, "stdout", JobOutput(sys.stdout))
+    batch_command._job_log.set(io.StringIO())
+    batch_command.report(3, "started")
+    assert capsys.readouterr().out == "[job 3] started\n"
+
+
+@pytest.mark.parametrize(
+    "line",
+    ["[]", '{"title": "No chapters"}', '{"num_chapters": 3, "isbn": 1}'],
+)
+def test_parse_job_rejects_bad_jobs(line):
+    with pytest.raises(ValueError):
+        batch_command.parse_job(line)
+
+
+def test_batch_writes_books_and_logs_their_output(library, capsys):
+    args = write_jobs(library / "jobs.jsonl", {"num_chapters": 2}, {"num_chapters": 2})
+    run_batch(args)
+    out = capsys.readouterr().out
+    assert "2 of 2 job(s) finished" in out
+    assert "[job 1] started" in out and "[job 2] chapters done" in out
+    # prompts and responses go to the logs, not the terminal
+    assert "Sending this prompt" not in out
+    assert "Sending this prompt" in (library / "instance/batch/jobs.1.log").read_text()
+    books = database.all_books()
+    assert len(books) == 2
+    assert books[0].topic != books[1].topic
+    assert all(chapter.content for book in books for chapter in book.chapters)
+
+
+def test_batch_resumes_where_it_stopped(library, mocker, capsys):
+    args = write_jobs(library / "jobs.jsonl", {"num_chapters": 2, "topic": "Moss"})
+    mocker.patch(
+        "cli.batch_command.write_unwritten_chapters",
+        side_effect=RuntimeError("interrupted"),
+    )
+    run_batch(args)
+    assert "0 of 1 job(s) finished" in capsys.readouterr().out
+    mocker.stopall()
+    generate = mocker.spy(batch_command, "generate_field_content")
+    run_batch(args)
+    assert "1 of 1 job(s) finished" in capsys.readouterr().out
+    # the title, author and outline were kept, and the book wasn't created twice
+    generate.assert_not_called()
+    [book] = database.all_books()
+    assert book.topic == "Moss" and all(c.content for c in book.chapters)
+    run_batch(args)
+    assert len(database.all_books()) == 1
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+import pytest
+from cli import chapter_menu
+from autobook.models import Chapter
+
+
+@pytest.fixture
+def fields(mocker, monkeypatch):
+    monkeypatch.delenv("AUTOBOOK_STREAM", raising=False)
+    monkeypatch.delenv("AUTOBOOK_LOOKAHEAD", raising=False)
+    # Generate instead of asking the user, and don't save anything
+    mocker.patch(
+        "cli.chapter_menu.generate_or_edit_menu_value",
+        side_effect=lambda fields, field, generate: fields.update({field: generate()}),
+    )
+    mocker.patch("cli.chapter_menu.generate_field_content", return_value="lorem ipsum")
+    mocker.patch("cli.chapter_menu.save_chapter")
+    chapter = Chapter("I. Start", ["a"], "lorem", partial=True)
+    return {
+        "book_id": 1,
+        "topic": "Fiction",
+        "author": "Anon",
+        "title": "Title",
+        "chapters": [chapter],
+    }
+
+
+def test_update_chapter_content_completes_partial_chapter(fields):
+    chapter_menu.update_chapter_by_index(fields, "chapters", 0, "content")
+    chapter = fields["chapters"][0]
+    assert chapter.content == "lorem ipsum"
+    assert not chapter.partial
+    chapter_menu.save_chapter.assert_called_once_with(1, 0, chapter)
+
+
+def test_update_chapter_content_keeps_unchanged_partial_chapter(fields, mocker):
+    mocker.patch("cli.chapter_menu.generate_field_content", return_value="lorem")
+    chapter_menu.update_chapter_by_index(fields, "chapters", 0, "content")
+    assert fields["chapters"][0].partial
+
+
+def test_write_next_chapter_ahead_skips_partial_chapters(fields, mocker):
+    write_ahead = mocker.patch("cli.chapter_menu.write_ahead")
+    chapters = fields["chapters"]
+    chapters.insert(0, Chapter("Intro", ["a"], "done"))
+    chapters.append(Chapter("II. End", ["b"]))
+    chapter_menu.write_next_chapter_ahead(fields, "chapters", 0)
+    (format_args,), _ = write_ahead.call_args
+    assert format_args["chapter"] == "II. End"
@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+import pytest
+from pathlib import Path
+from cli import cli
+
+# Every command module, named as "./run <name>" loads it
+commands = sorted(
+    path.stem.removesuffix("_command")
+    for path in Path(cli.__file__).parent.glob("*_command.py")
+)
+
+
+@pytest.mark.parametrize("name", commands)
+def test_commands_import(name):
+    assert callable(cli.load_command(name))